@@ -0,0 +1,164 @@
+import threading
+
+import pandas as pd
+
+from cache import LRUCache
+
+# Named count tables: name -> (source column, output column name)
+AGGREGATES = {
+    'facility_counts': ('Facility Type', 'Facility Type'),
+    'license_counts': ('License Type', 'License Type'),
+    'city_counts': ('City', 'City'),
+    'state_counts': ('State', 'State'),
+    'county_counts': ('County', 'County'),
+    'zip_counts': ('Zip', 'Zip'),
+    'government_count': ('isGovernment', 'isGovernment'),
+    'outsourcer_count': ('Registered Outsourcer', 'is503B'),
+}
+
+# Dimensions of the count cube every aggregate is derived from
+CUBE_DIMENSIONS = [
+    'Facility Type',
+    'License Type',
+    'City',
+    'State',
+    'County',
+    'Zip',
+    'isGovernment',
+    'Registered Outsourcer',
+]
+
+
+class AggregateRegistry:
+    """
+    Lazily computed count tables for one dataset version.
+
+    Nothing is counted until it is asked for. The first request builds a
+    single group-by cube over CUBE_DIMENSIONS (one pass over the rows); every
+    named aggregate and every `cube()` roll-up is then a sum over that much
+    smaller table. Results are memoized, and since the registry belongs to a
+    Dataset, a new snapshot version starts with an empty registry.
+    """
+
+    def __init__(self, dataset, cache_size=256):
+        self.dataset = dataset
+        self.aggregates = dict(AGGREGATES)
+        self._cube = None
+        self._lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+
+    def register(self, name, column, label=None):
+        self.aggregates[name] = (column, label or column)
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self.aggregates
+
+    @property
+    def base_cube(self):
+        # Count of rows per combination of every cube dimension (missing
+        # values kept as their own group)
+        if self._cube is None:
+            with self._lock:
+                if self._cube is None:
+                    self._cube = _group_counts(self.dataset.pharmacies)
+        return self._cube
+
+    def updated(self, dataset, added, retracted):
+        """
+        Registry for a refreshed `dataset`. When this registry has built its
+        cube, the new one starts from it adjusted by the `added` rows of the
+        new snapshot and the `retracted` rows of the old one, instead of
+        regrouping every row; otherwise it stays lazy.
+        """
+        registry = AggregateRegistry(dataset, cache_size=self._cache.maxsize)
+        registry.aggregates = dict(self.aggregates)
+        if self._cube is not None:
+            plus = _group_counts(dataset.pharmacies.iloc[added])
+            minus = _group_counts(self.dataset.pharmacies.iloc[retracted])
+            cube = (
+                pd.concat([self._cube, plus, minus.assign(Count=-minus['Count'])], ignore_index=True)
+                .groupby(CUBE_DIMENSIONS, dropna=False, observed=True)['Count']
+                .sum()
+                .reset_index()
+            )
+            registry._cube = cube[cube['Count'] > 0].reset_index(drop=True)
+        return registry
+
+    def get(self, name, where=None, query=None):
+        """
+        Count table for the named aggregate, like `value_counts()`.
+
+        `where` restricts the counts by cube dimensions, e.g.
+        `{'Registered Outsourcer': True}` for counts among 503B pharmacies.
+        `query` restricts them to the rows matching a PharmacyQuery.
+        """
+        column, label = self.aggregates[name]
+        where = _normalize_where(where)
+        key = ('aggregate', name, where, query)
+        return self._cache.get_or_compute(key, lambda: self._compute(column, label, where, query))
+
+    def cube(self, dimensions, where=None):
+        # Counts grouped by any combination of cube dimensions
+        dimensions = tuple(dimensions)
+        where = _normalize_where(where)
+        key = ('cube', dimensions, where)
+        return self._cache.get_or_compute(key, lambda: self._roll_up(dimensions, where))
+
+    def _compute(self, column, label, where, query):
+        if query is None and column in CUBE_DIMENSIONS:
+            counts = self._roll_up((column,), where).dropna(subset=[column])
+        else:
+            # Predicates the cube cannot answer (multi-valued terms, columns
+            # outside the cube) count the matching rows directly
+            columns = list(dict.fromkeys([column] + [dimension for dimension, _ in where]))
+            if query is not None:
+                pharmacies = self.dataset.engine.materialize(self.dataset.engine.run(query), columns)
+            else:
+                pharmacies = self.dataset.pharmacies[columns]
+            for dimension, values in where:
+                pharmacies = pharmacies[pharmacies[dimension].isin(values)]
+            # Categorical columns also count their unused categories
+            counts = pharmacies[column].value_counts().reset_index()
+            counts.columns = [column, 'Count']
+            counts = counts[counts['Count'] > 0]
+        counts = counts.sort_values('Count', ascending=False, kind='stable').reset_index(drop=True)
+        return counts.rename(columns={column: label})
+
+    def _roll_up(self, dimensions, where):
+        unknown = set(dimensions).union(dimension for dimension, _ in where) - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Not a cube dimension: {', '.join(sorted(unknown))}")
+        cube = self.base_cube
+        for dimension, values in where:
+            cube = cube[cube[dimension].isin(values)]
+        return (
+            cube
+            .groupby(list(dimensions), dropna=False, observed=True)['Count']
+            .sum()
+            .reset_index()
+        )
+
+
+def _group_counts(pharmacies):
+    # Rows per combination of the cube dimensions, missing values included
+    return (
+        pharmacies
+        .groupby(CUBE_DIMENSIONS, dropna=False, observed=True)
+        .size()
+        .reset_index(name='Count')
+    )
+
+
+def _normalize_where(where):
+    # Hashable, order-independent form of a {dimension: value(s)} filter
+    if not where:
+        return ()
+    normalized = []
+    for dimension, values in where.items():
+        if isinstance(values, str) or not hasattr(values, '__iter__'):
+            values = [values]
+        normalized.append((dimension, tuple(sorted(set(values)))))
+    return tuple(sorted(normalized))
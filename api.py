@@ -0,0 +1,294 @@
+import argparse
+import hashlib
+import json
+from urllib.parse import urlencode
+
+import tornado.ioloop
+import tornado.web
+
+from cache import LRUCache
+from data_loader import DATA_PATH, load_dataset
+from map_bins import is_points
+from paging import iter_csv_chunks, page_count
+from query_engine import PHARMACY_TYPES, SEARCH_COLUMNS, PharmacyQuery
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+DEFAULT_SUGGESTIONS = 10
+DEFAULT_MAP_ZOOM = 6
+MAX_MAP_ZOOM = 20
+
+# Columns of each typeahead suggestion
+SUGGEST_COLUMNS = ['Pharmacy Name', 'License Number', 'City', 'County']
+
+# Query parameter -> PharmacyQuery field; each may be repeated
+FILTER_PARAMETERS = {
+    'facility_type': 'facility_types',
+    'city': 'cities',
+    'specialty': 'specialties',
+    'condition': 'conditions',
+    'accreditation': 'accreditations',
+}
+
+# ETag -> encoded response body
+_responses = LRUCache(maxsize=1024)
+
+
+class JSONHandler(tornado.web.RequestHandler):
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json; charset=utf-8')
+
+    def write_error(self, status_code, **kwargs):
+        self.finish(json.dumps({'error': self._reason}))
+
+    def bad_request(self, message):
+        raise tornado.web.HTTPError(400, reason=message)
+
+    def list_argument(self, name):
+        # Values of a parameter given repeatedly and/or comma-separated
+        return [value.strip() for raw in self.get_arguments(name) for value in raw.split(',') if value.strip()]
+
+    def int_argument(self, name, default, minimum, maximum):
+        raw = self.get_argument(name, None)
+        if raw is None:
+            return default
+        try:
+            value = int(raw)
+        except ValueError:
+            self.bad_request(f"'{name}' must be an integer")
+        if not minimum <= value <= maximum:
+            self.bad_request(f"'{name}' must be between {minimum} and {maximum}")
+        return value
+
+    def respond(self, dataset, canonical, build):
+        """
+        Answer with the body from `build()`, tagged with an ETag derived from
+        the dataset version and the canonical query. A matching If-None-Match
+        gets a 304 and repeats are served from the response cache, so
+        neither runs the query again.
+        """
+        etag = self.tag(dataset, canonical)
+        if self.not_modified():
+            return
+        body = _responses.get_or_compute(etag, lambda: build().encode('utf-8'))
+        self.finish(body)
+
+    def tag(self, dataset, canonical):
+        etag = '"' + hashlib.sha1(f'{dataset.version}?{canonical}'.encode('utf-8')).hexdigest() + '"'
+        self.set_header('ETag', etag)
+        self.set_header('Cache-Control', 'public, max-age=60')
+        return etag
+
+    def not_modified(self):
+        # Answer 304 and return True if If-None-Match names the ETag set by
+        # tag(), compared weakly (a proxy may have turned it into W/"...")
+        # or is *
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return True
+        return False
+
+    def compute_etag(self):
+        # ETags are set explicitly by tag()
+        return None
+
+
+class SearchHandler(JSONHandler):
+    """
+    GET /api/search
+
+    Filters (repeatable): pharmacy_type (503A/503B), facility_type, city,
+    specialty, condition, accreditation. q: free text matched against name,
+    license number, city and county (results best match first unless
+    sorted). Paging: page (from 1), page_size. fields: comma-separated
+    columns to return. sort: a column, prefixed with '-' for descending.
+    """
+
+    def get(self):
+        dataset, query, fields, sort = self.parse_search()
+        page = self.int_argument('page', 1, 1, 10 ** 9)
+        page_size = self.int_argument('page_size', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+
+        canonical = urlencode([
+            ('query', repr(query)), ('fields', ','.join(fields)), ('sort', sort or ''),
+            ('page', page), ('page_size', page_size),
+        ])
+        self.respond(dataset, canonical, lambda: search_body(dataset, query, fields, sort, page, page_size))
+
+    def parse_search(self):
+        # Dataset, PharmacyQuery, projected fields and sort of the request
+        dataset = load_dataset(DATA_PATH)
+
+        pharmacy_types = self.list_argument('pharmacy_type')
+        unknown = set(pharmacy_types) - set(PHARMACY_TYPES)
+        if unknown:
+            self.bad_request(f"Unknown pharmacy_type: {', '.join(sorted(unknown))}")
+        query = PharmacyQuery(
+            pharmacy_types=pharmacy_types,
+            text=self.get_argument('q', ''),
+            **{field: self.get_arguments(parameter) for parameter, field in FILTER_PARAMETERS.items()}
+        )
+
+        fields = self.list_argument('fields') or SEARCH_COLUMNS
+        unknown = [field for field in fields if field not in SEARCH_COLUMNS]
+        if unknown:
+            self.bad_request(f"Unknown field: {', '.join(unknown)}")
+
+        sort = self.get_argument('sort', None)
+        if sort and sort.lstrip('-') not in SEARCH_COLUMNS:
+            self.bad_request(f"Unknown sort field: {sort.lstrip('-')}")
+        return dataset, query, fields, sort
+
+
+class ExportHandler(SearchHandler):
+    """
+    GET /api/export.csv
+
+    Every row of a search (same parameters as /api/search, without paging)
+    as CSV, written to the client a chunk at a time.
+    """
+
+    async def get(self):
+        dataset, query, fields, sort = self.parse_search()
+        canonical = urlencode([('export', repr(query)), ('fields', ','.join(fields)), ('sort', sort or '')])
+        self.tag(dataset, canonical)
+        if self.not_modified():
+            return
+
+        self.set_header('Content-Type', 'text/csv; charset=utf-8')
+        self.set_header('Content-Disposition', 'attachment; filename="pharmacies.csv"')
+        rows = sorted_rows(dataset, dataset.engine.run(query), sort)
+        for chunk in iter_csv_chunks(dataset.engine, rows, fields):
+            self.write(chunk)
+            await self.flush()
+        self.finish()
+
+
+class SuggestHandler(SearchHandler):
+    """
+    GET /api/suggest?q=walgr
+
+    Typeahead: the best `limit` (default 10) matches for partially typed
+    text, with the same filters as /api/search.
+    """
+
+    def get(self):
+        dataset, query, _, _ = self.parse_search()
+        limit = self.int_argument('limit', DEFAULT_SUGGESTIONS, 1, MAX_PAGE_SIZE)
+        canonical = urlencode([('suggest', repr(query)), ('limit', limit)])
+        self.respond(dataset, canonical, lambda: suggest_body(dataset, query, limit))
+
+
+class MapHandler(SearchHandler):
+    """
+    GET /api/map?zoom=6&bbox=32.5,-124.5,42,-114
+
+    The pharmacies of a search (same filters as /api/search) for a map at
+    `zoom` (0-20) within bbox (south,west,north,east): hexagonal bins with
+    their counts by facility type, or the pharmacies themselves once zoomed
+    in far enough with few enough in view.
+    """
+
+    def get(self):
+        dataset, query, _, _ = self.parse_search()
+        zoom = self.int_argument('zoom', DEFAULT_MAP_ZOOM, 0, MAX_MAP_ZOOM)
+        bbox = self.list_argument('bbox') or None
+        if bbox is not None:
+            try:
+                bbox = [float(value) for value in bbox]
+            except ValueError:
+                self.bad_request("'bbox' must be four numbers")
+            if len(bbox) != 4 or not (-90 <= bbox[0] <= bbox[2] <= 90):
+                self.bad_request("'bbox' must be south,west,north,east")
+        canonical = urlencode([('map', repr(query)), ('zoom', zoom), ('bbox', repr(bbox))])
+        self.respond(dataset, canonical, lambda: map_body(dataset, query, zoom, bbox))
+
+
+class OptionsHandler(JSONHandler):
+    # GET /api/options: the values each filter accepts
+    def get(self):
+        dataset = load_dataset(DATA_PATH)
+        self.respond(dataset, 'options', lambda: json.dumps({
+            'version': dataset.version,
+            'pharmacy_type': list(PHARMACY_TYPES),
+            'facility_type': list(dataset.facility_options),
+            'city': list(dataset.city_options),
+            'specialty': list(dataset.unique_specialty_terms),
+            'condition': list(dataset.unique_condition_terms),
+            'accreditation': list(dataset.unique_accreditations),
+            'fields': SEARCH_COLUMNS,
+        }))
+
+
+def sorted_rows(dataset, rows, sort):
+    # Order result rows by a column (missing values last), stable on ties
+    if not sort:
+        return rows
+    column = dataset.pharmacies[sort.lstrip('-')].iloc[rows]
+    order = column.reset_index(drop=True).sort_values(
+        ascending=not sort.startswith('-'), kind='stable', na_position='last'
+    ).index.to_numpy()
+    return rows[order]
+
+
+def search_body(dataset, query, fields, sort, page, page_size):
+    rows = sorted_rows(dataset, dataset.engine.run(query), sort)
+    page_rows = rows[(page - 1) * page_size:page * page_size]
+    records = records_json(dataset.engine.materialize(page_rows, fields))
+    header = json.dumps({
+        'version': dataset.version,
+        'total': int(len(rows)),
+        'page': page,
+        'page_size': page_size,
+        'pages': page_count(len(rows), page_size),
+    })
+    # Splice the records in rather than re-parsing them
+    return header[:-1] + ', "results": ' + records + '}'
+
+
+def suggest_body(dataset, query, limit):
+    rows = dataset.engine.run(query)[:limit]
+    return records_json(dataset.engine.materialize(rows, SUGGEST_COLUMNS))
+
+
+def map_body(dataset, query, zoom, bbox):
+    located = dataset.map_bins.get(zoom, query=query, bbox=bbox)
+    header = json.dumps({
+        'version': dataset.version,
+        'zoom': zoom,
+        'mode': 'points' if is_points(located) else 'bins',
+    })
+    return header[:-1] + ', "results": ' + records_json(located) + '}'
+
+
+def records_json(frame):
+    if 'Expiration Date' in frame.columns:
+        frame = frame.assign(**{'Expiration Date': frame['Expiration Date'].dt.strftime('%Y-%m-%d')})
+    return frame.to_json(orient='records', force_ascii=False)
+
+
+def make_app():
+    return tornado.web.Application([
+        (r'/api/search', SearchHandler),
+        (r'/api/export\.csv', ExportHandler),
+        (r'/api/suggest', SuggestHandler),
+        (r'/api/map', MapHandler),
+        (r'/api/options', OptionsHandler),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the pharmacy search as a JSON API.")
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args()
+
+    # Load before accepting requests so the first caller does not pay for it
+    load_dataset(DATA_PATH)
+    make_app().listen(args.port)
+    print(f"Serving the pharmacy search API on http://localhost:{args.port}/api/search")
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
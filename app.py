@@ -1,8 +1,16 @@
-import streamlit as st
+import io
+
 import pandas as pd
-import numpy as np
-import itertools
-import plotly.express as px
+import streamlit as st
+
+import perf
+
+from data_loader import DATA_PATH, load_dataset
+from expirations import EXCLUDED_YEARS
+from figures import get_figure
+from map_bins import POINT_ZOOM
+from paging import PAGE_SIZES, iter_csv_chunks, page_count, page_rows
+from query_engine import SEARCH_COLUMNS, PharmacyQuery
 
 
 
@@ -14,69 +22,59 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Load Datasets
-pharmacies = pd.read_csv('enriched_pharmacy_data_01032024.csv', dtype=str, encoding='utf-8')
-pharmacies['Expiration Date'] = pd.to_datetime(pharmacies['Expiration Date'])
-
-# Count Data
-facility_counts = pharmacies['Facility Type'].value_counts().reset_index()
-facility_counts.columns = ['Facility Type', 'Count']
-license_counts = pharmacies['License Type'].value_counts().reset_index()
-license_counts.columns = ['License Type', 'Count']
-city_counts = pharmacies['City'].value_counts().reset_index()
-city_counts.columns = ['City', 'Count']
-state_counts = pharmacies['State'].value_counts().reset_index()
-state_counts.columns = ['State', 'Count']
-county_counts = pharmacies['County'].value_counts().reset_index()
-county_counts.columns = ['County', 'Count']
-zip_counts = pharmacies['Zip'].value_counts().reset_index()
-zip_counts.columns = ['Zip', 'Count']
-government_count = pharmacies['isGovernment'].value_counts().reset_index()
-government_count.columns = ['isGovernment', 'Count']
-outsourcer_count = pharmacies['Registered Outsourcer'].value_counts().reset_index()
-outsourcer_count.columns = ['is503B', 'Count']
-unique_facility_types = pharmacies['Facility Type'].dropna().unique()
-facility_options = list(unique_facility_types)
-unique_cities = pharmacies['City'].dropna().unique()
-city_options = sorted(list(unique_cities))
-
-# Specialty Search
-pharmacies['Specialties'] = pharmacies['Specialties'].str.replace(
-    "Ear, Nose, and Throat",
-    "Ear Nose and Throat",
-    regex=False
-)
-specialities = pharmacies.dropna(subset=['Specialties'])
-# Define a function to clean the terms by removing unwanted punctuation
-def clean_term(term):
-    # Remove extra spaces, just in case
-    term = term.strip()
-    return term
-# 1. Flatten all lists from the 'Specialties' column by splitting on commas
-all_terms = list(itertools.chain(*specialities['Specialties'].apply(lambda x: x.split(','))))
-# Apply the cleaning function to each term
-cleaned_terms = [clean_term(term) for term in all_terms]
-# 2. Generate unique terms
-unique_specialty_terms = sorted(set(cleaned_terms))
-
-
-
-# Condition Search
-conditions = pharmacies.dropna(subset=['Conditions'])
-all_conditions = list(itertools.chain(*conditions['Conditions'].apply(lambda x: x.split(','))))
-cleaned_conditions = [clean_term(condition) for condition in all_conditions]
-unique_condition_terms = sorted(set(cleaned_conditions))
-
-#Accredidation Search
-accreditations = pharmacies.dropna(subset=['Accreditations'])
-all_accreditations = list(itertools.chain(*accreditations['Accreditations'].apply(lambda x: x.split(','))))
-cleaned_accreditations = [clean_term(accreditation) for accreditation in all_accreditations]
-unique_accreditations = sorted(set(cleaned_accreditations))
-# Replace the specific value
-unique_accreditations = [
-    "AAHP" if acc == "American Association of Homeopathic Pharmacists" else acc
-    for acc in unique_accreditations
-]
+# Opt-in timing of each stage of this rerun, shown in the diagnostics panel
+# (?diagnostics=1) and/or logged as JSON lines (PHARMACY_PERF_LOG=1)
+show_diagnostics = perf.PANEL_ENABLED or st.query_params.get('diagnostics') == '1'
+perf_recorder = perf.begin_rerun(st.session_state, show_diagnostics)
+
+# Load Datasets (cached once per server process and shared by every session)
+with perf.span('load') as span:
+    dataset = load_dataset(DATA_PATH)
+    span.set(rows=len(dataset.pharmacies), version=dataset.version[:12])
+pharmacies = dataset.pharmacies
+
+
+def show_figure(name, **params):
+    # Render a cached figure, timing the build/deserialize and the send
+    with perf.span(f'chart.{name}'):
+        st.plotly_chart(get_figure(dataset, name, **params), use_container_width=True)
+
+
+def show_results_table(rows, columns, name, extra_columns=None):
+    # Render one page of `rows`, projecting only `columns` of that page, with
+    # paging controls and an on-demand CSV export of every row
+    controls = st.columns([1, 1, 2])
+    page_size = controls[0].selectbox("Rows per page", PAGE_SIZES, index=1, key=f"{name}_page_size")
+    pages = page_count(len(rows), page_size)
+    # The widget resets to page 1 whenever the page count changes
+    page = controls[1].number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1)
+
+    shown = page_rows(rows, page, page_size)
+    with perf.span(f'dataframe.{name}', rows=len(shown), total=len(rows)):
+        table = dataset.engine.materialize(shown, columns)
+        offset = (page - 1) * page_size
+        for position, (column, values) in enumerate((extra_columns or {}).items()):
+            table.insert(position, column, values[offset:offset + page_size])
+        st.dataframe(table, use_container_width=True, hide_index=True)
+    if len(rows):
+        st.caption(f"Showing {offset + 1:,}-{offset + len(shown):,} of {len(rows):,}")
+
+    if controls[2].button("Export all rows as CSV", key=f"{name}_export"):
+        with perf.span(f'export.{name}', rows=len(rows)):
+            # Encode chunk by chunk into one buffer, so the file is held once
+            csv = io.BytesIO()
+            for chunk in iter_csv_chunks(dataset.engine, rows, columns, extra_columns=extra_columns):
+                csv.write(chunk.encode('utf-8'))
+        controls[2].download_button("Download CSV", csv, file_name=f"{name}.csv", mime="text/csv", key=f"{name}_download")
+
+
+facility_options = dataset.facility_options
+city_options = dataset.city_options
+
+# Search vocabularies
+unique_specialty_terms = dataset.unique_specialty_terms
+unique_condition_terms = dataset.unique_condition_terms
+unique_accreditations = dataset.unique_accreditations
 
 
 # Sidebar for user input
@@ -86,12 +84,27 @@ st.sidebar.warning(
     "This is a student project meant to validate interest in a 50 state Sterile Compounding Directory. "
     "Sign up for my waitlist [here!](https://docs.google.com/forms/d/e/1FAIpQLSfvlpsCtIYb-CVyz9cSaV1IGzoJrksr20bid8TFOyySPNF9pg/viewform?usp=header)"
 )
-pharmacy_type = st.sidebar.segmented_control("**Pharmacy Type**", ['Patient Specific (503A)', 'Bulk In-Office (503B)'], selection_mode="multi", default=['Patient Specific (503A)', 'Bulk In-Office (503B)'])
+text = st.sidebar.text_input("**Search**", placeholder="Pharmacy name, city, county or license number")
+pharmacy_type_codes = {'Patient Specific (503A)': '503A', 'Bulk In-Office (503B)': '503B'}
+pharmacy_type = st.sidebar.segmented_control("**Pharmacy Type**", list(pharmacy_type_codes), selection_mode="multi", default=list(pharmacy_type_codes))
 facility_type = st.sidebar.multiselect("**Facility Type**", facility_options, default='Sterile Compounding Pharmacy')
 city = st.sidebar.multiselect("**City**", city_options)
 specialty = st.sidebar.multiselect("**Specialty**", unique_specialty_terms)
 condition = st.sidebar.multiselect("**Condition**", unique_condition_terms)
 accreditations = st.sidebar.pills("**Claimed Accreditations**", unique_accreditations, selection_mode='multi', default=None)
+near = st.sidebar.text_input("**Near**", placeholder="ZIP code or latitude, longitude")
+radius = st.sidebar.slider("**Within (miles)**", min_value=1, max_value=250, value=25, disabled=not near)
+
+# The sidebar search, also used to map only the matching pharmacies
+query = PharmacyQuery(
+    pharmacy_types=[pharmacy_type_codes[label] for label in pharmacy_type],
+    facility_types=facility_type,
+    cities=city,
+    specialties=specialty,
+    conditions=condition,
+    accreditations=accreditations,
+    text=text
+)
 
 # Main content area with tabs
 st.title("Safer Sourcing: A Study of California Sterile Compounding Licenses")
@@ -99,83 +112,47 @@ st.write("""
 **California, home to 39 million residents, currently has only 70 licensed pharmacies authorized to provide sterile compounded drugs.**""")
 st.write("""
 This limited availability has raised concerns in the pharmaceutical supply chain, forcing some patients to seek medications illegally or go without. Unfortunately, healthcare providers are also affected. Some have been found purchasing unapproved chemicals, issuing false prescriptions, or rationing expired supplies. These practices increase the risk of harm to patients and undermine the integrity of the healthcare system.""")
-tabs = st.tabs(["**Search Pharmacies**", "**License Analysis**", "**About**"])
+# Streamlit runs the body of every st.tabs tab on each rerun, so pages are
+# switched with a control instead and only the selected page is built
+pages = ["**Search Pharmacies**", "**License Analysis**", "**About**"]
+page = st.radio("Page", pages, key="page", horizontal=True, label_visibility="collapsed")
 
 # Home Tab
-with tabs[0]:
+if page == pages[0]:
     # Check if pharmacy type is selected
     if not pharmacy_type:
         st.error("Please select at least one pharmacy type.")  # Display error box if no pharmacy type is selected
     else:
-        # Apply filters based on user selection
-        filtered_df = pharmacies.copy()
-        cols_to_drop = [
-            'License Status',
-            'LAT',
-            'LONG',
-            'isGovernment',
-            'isSatellite'
-        ]
-        filtered_df.drop(columns=cols_to_drop, inplace=True)
-
-        # Filter by Pharmacy Type (Handle all 4 possible scenarios)
-        if 'Patient Specific (503A)' in pharmacy_type and 'Bulk In-Office (503B)' not in pharmacy_type:
-            # Only 503A selected, filter by Registered Outsourcer = True
-            filtered_df = filtered_df[filtered_df['Registered Outsourcer'] == "False"]
-        elif 'Bulk In-Office (503B)' in pharmacy_type and 'Patient Specific (503A)' not in pharmacy_type:
-            # Only 503B selected, filter by Registered Outsourcer = False
-            filtered_df = filtered_df[filtered_df['Registered Outsourcer'] == "True"]
-        elif 'Patient Specific (503A)' in pharmacy_type and 'Bulk In-Office (503B)' in pharmacy_type:
-            # Both 503A and 503B selected, no filtering on Registered Outsourcer
-            filtered_df = filtered_df
-
-        # Filter by Facility Type
-        if facility_type:
-            filtered_df = filtered_df[filtered_df['Facility Type'].isin(facility_type)]
-
-        # Filter by City
-        if city:
-            filtered_df = filtered_df[filtered_df['City'].isin(city)]
-
-        # Filter by Specialty
-        if specialty:
-            filtered_df['Specialties'] = filtered_df['Specialties'].astype(str)
-            specialty_set = set(specialty)
-            filtered_df = filtered_df[
-                (pd.notna(filtered_df['Specialties'])) &
-                (filtered_df['Specialties'].apply(lambda x: all(term in x for term in specialty_set)))
-            ]
-
-        # Filter by Condition
-        if condition:
-            filtered_df['Conditions'] = filtered_df['Conditions'].astype(str)
-            condition_set = set(condition)
-            filtered_df = filtered_df[
-                (pd.notna(filtered_df['Conditions'])) &
-                (filtered_df['Conditions'].apply(lambda x: all(term in x for term in condition_set)))
-            ]
-
-        # Filter by Accreditations
-        if accreditations:
-            filtered_df['Accreditations'] = filtered_df['Accreditations'].astype(str)
-            acc_set = set(accreditations)
-            filtered_df = filtered_df[
-                (pd.notna(filtered_df['Accreditations'])) &
-                (filtered_df['Accreditations'].apply(lambda x: all(term in x for term in acc_set)))
-            ]
-
-        # Check if the filtered dataframe is empty and show an error if it is
-        if filtered_df.empty:
+        # Run the search through the shared query engine; repeated searches are
+        # answered from its cache, and only the visible columns are materialized
+        with perf.span('filter.query') as span:
+            rows = dataset.engine.run(query)
+            span.set(rows=len(rows))
+        distances = None
+
+        # Narrow to pharmacies within the radius, nearest first
+        location = dataset.geo_index.locate(near) if near else None
+        if near and location is None:
+            st.error("Enter a 5 digit ZIP code found in the directory, or a latitude and longitude separated by a comma.")
+            rows = rows[:0]
+        elif location:
+            with perf.span('filter.radius', miles=radius) as span:
+                rows, distances = dataset.geo_index.within(*location, radius, mask=dataset.engine.mask(query))
+                span.set(rows=len(rows))
+
+        # Check if the search is empty and show an error if it is
+        if not len(rows):
             st.error("No pharmacies match your criteria; try your search again with fewer restrictions.")
         else:
-            # Display the filtered dataframe (Read-Only view)
+            # Display the matching pharmacies a page at a time (Read-Only view)
             st.subheader("Matching Pharmacies:")
-            st.info("Use the sidebar to set your search criteria. Hover over the results table and a download icon will appear to save the table as a CSV locally.")
-            st.dataframe(filtered_df, use_container_width=True)
+            st.info("Use the sidebar to set your search criteria. Use the Export button below the table to save every match as a CSV locally.")
+            extra_columns = {'Distance (mi)': distances.round(1)} if distances is not None else None
+            show_results_table(rows, SEARCH_COLUMNS, 'search', extra_columns=extra_columns)
 
 
 # Profile Tab
-with tabs[1]:
+elif page == pages[1]:
     # Table of Contents
     st.markdown("""
     ### Table of Contents
@@ -199,16 +176,7 @@ with tabs[1]:
     - **Fee-Exempt Satellite Locations**: A special designation for fee-exempt satellite locations.
     - **Nonresident Sterile Compounding Pharmacy**: Issued to pharmacies physically located outside of California that are not government or satellite institutions.
     """)
-    fig_donut_license_type = px.pie(
-        license_counts,
-        names='License Type',
-        values='Count',
-        title='Distribution of License Types',
-        hole=0.25,
-        labels={'License Type': 'Type of License', 'Count': 'Number of Licenses'},
-        template='simple_white'
-    )
-    st.plotly_chart(fig_donut_license_type, use_container_width=True)
+    show_figure('license_types')
     st.subheader("What types of facilities are granted Sterile Compounding Licenses?")
     st.write("""
     The California Board of Pharmacy Database does not provide context for the types of facilities granted. This data was categorized through independent research utilizing the pharmacy name, address, and public information online. 
@@ -219,18 +187,7 @@ with tabs[1]:
     - **Research Center**: There was (1) government owned research center located in San Diego, CA, that has an active Sterile Compounding License in California.  
     """)
     st.warning("**Note**: There were only (68) Licensed Sterile Compounding Pharmacies that service human patients for the entire population of 39 million Californians.")
-    facility_counts = facility_counts.sort_values(by='Count', ascending=False)
-    bar_fig = px.bar(
-        facility_counts,
-        x='Count',
-        y='Facility Type',
-        orientation='h',
-        category_orders={'Facility Type': facility_counts['Facility Type'].tolist()},
-        title='What Types of Facilities Hold Sterile Compounding Licenses in California?',
-        labels={'Facility Type': 'Type of Facility', 'Count': 'Number of Facilities'},
-        template='seaborn'
-    )
-    st.plotly_chart(bar_fig, use_container_width=True)
+    show_figure('facility_types')
     st.subheader("Exploring Purchasing Styles: Bulk vs Patient Specific")
     st.write("""
     The Food, Drug, and Cosmetic Act defines two types of product distribution for compound pharmacies. Understanding them is critical if you are sourcing compound drugs.
@@ -242,79 +199,23 @@ with tabs[1]:
     st.warning("""
     Only (5) 503B pharmacies in California have a sterile license and serve human patients. This severely limits options for in-office compounded drugs, increasing costs for both providers and patients and restricting access to a significant portion of the U.S. compound drug supply chain.
     """)
-    pie_fig = px.pie(outsourcer_count,
-                     names='is503B',
-                     values='Count',
-                     title="Is the licensed facility a registered 503B Outsourcer with the FDA?",
-                     labels={'is503B': 'Pharmacy Type', 'Count': 'Count'})
-    st.plotly_chart(pie_fig, use_container_width=True)
+    show_figure('outsourcers')
     st.subheader("Which states do the pharmacies reside in?")
     st.write("California's Board of Pharmacy has a known preference for resident pharmacies; however, facilities outside of California have successfully won a sterile license.")
     st.warning("**Note**: The California BOP may grant an outside pharmacy a license but that does not guarantee they will allow their entire sterile catalog into the state; California BOP is known for strict enforcement of sterile compounds at the individual drug product level.")
-    # Apply a log transformation to the 'Count' column to compress large differences
-    state_counts['Log_Count'] = np.log1p(state_counts['Count'])  # Use log1p to avoid issues with log(0)
-
-    # Create the geographic heat map
-    fig_geo_heatmap = px.choropleth(
-        state_counts,
-        locations='State',  # The column with state names or abbreviations
-        locationmode='USA-states',  # Specify US states as the location mode
-        color='Log_Count',  # Use the log-transformed values for color
-        color_continuous_scale='Blues',  # Choose a color scale
-        scope='usa',  # Limit the map to the USA
-        title='Sterile Compounding Licenses: US Heatmap',
-        labels={'Log_Count': 'Log of Count', 'State': 'State'},
-        hover_name='State',  # Show state name when hovering
-        hover_data={'Log_Count': False, 'Count': True}  # Only show 'Count' on hover, not the log count
-    )
-    # Update layout for better appearance
-    fig_geo_heatmap.update_layout(
-        title={
-            'font': {'size': 16, 'family': 'Arial', 'color': 'darkblue'},
-            'x': 0.5,  # Center the title
-        },
-        geo=dict(
-            showframe=False,  # Hide the frame around the map
-            showcoastlines=True,  # Show coastlines
-            coastlinecolor="LightGray",  # Set the coastline color
-        )
-    )
-    st.plotly_chart(fig_geo_heatmap, use_container_width=True)
-    # Create the geographic scatter plot using LAT and LONG
+    show_figure('state_heatmap')
     st.subheader("Where are facilities located within California?")
     st.write("""
     For some of the 39 million people in California having a sterile compound shipped to them is not enough - they need in person services.  Explore the map below to see where the different types of licensed facilities exist.
     """)
-    fig_geo_pharmacies = px.scatter_geo(
-        pharmacies,
-        lat='LAT',  # Latitude column
-        lon='LONG',  # Longitude column
-        color='Facility Type',  # Color by Facility Type (you can replace this with any other column)
-        hover_name='Pharmacy Name',  # Show pharmacy name on hover
-        hover_data={'LAT': False, 'LONG': False},  # Do not show lat and long on hover
-        title='Pharmacy Locations in California'
-    )
-
-    # Update layout for better appearance with focus on California
-    fig_geo_pharmacies.update_layout(
-        title={
-            'font': {'size': 16, 'family': 'Arial', 'color': 'darkblue'},
-            'x': 0.5,  # Center the title
-        },
-        geo=dict(
-            showframe=False,  # Hide the frame around the map
-            showcoastlines=True,  # Show coastlines
-            coastlinecolor="LightGray",  # Set the coastline color
-            projection_type="albers usa",  # Projection type for the USA
-            center={"lat": 37.5, "lon": -119},  # Center on California (lat, lon for central California)
-            projection_scale=2,  # Zoom level for California (adjust for better focus)
-        ),
-        coloraxis_colorbar=dict(
-            title="Facility Type",  # Color bar title (if using categorical data)
-        )
-    )
-    # Display the scatter plot
-    st.plotly_chart(fig_geo_pharmacies, use_container_width=True)
+    # The map is only built and sent when asked for; unless zoomed in to single
+    # pharmacies it shows hexagonal bins counted on the server
+    if st.toggle("Show the pharmacy location map"):
+        map_zooms = {"State": 4, "County": 6, "City": 8, "Pharmacies": POINT_ZOOM}
+        map_controls = st.columns([2, 1])
+        map_detail = map_controls[0].select_slider("Map detail", options=list(map_zooms), value="City")
+        map_search = map_controls[1].checkbox("Only pharmacies matching my search", disabled=not pharmacy_type)
+        show_figure('pharmacy_map', zoom=map_zooms[map_detail], query=query if map_search else None)
     st.subheader("When are the licenses anticipated to expire?")
     st.write("""
     The California BOP issues Sterile Compounding Licenses for 12 months at a time; after that, they must be renewed.  Use the selection box below to determine what types of facilities you are interested in and review how many are expiring, and when. November of 2025 is expected to be a large month of turnover at the California BOP.
@@ -327,55 +228,28 @@ with tabs[1]:
         default=facility_types
     )
 
-    # Filter data based on selected facility types
-    filtered_pharmacies = pharmacies[
-        (pharmacies['Facility Type'].isin(selected_facility_types)) &
-        (pharmacies['Expiration Date'].notna())
-        ]
-
-    # Process expiration data for the area chart
-    filtered_pharmacies['Year'] = filtered_pharmacies['Expiration Date'].dt.year
-    filtered_pharmacies['Month'] = filtered_pharmacies['Expiration Date'].dt.month
-    filtered_pharmacies = filtered_pharmacies[filtered_pharmacies['Year'] != 2024]
-
-    # Group by Facility Type, Year, and Month and count the number of expirations
-    expirations_by_type_year_month = (
-        filtered_pharmacies
-        .groupby(['Facility Type', 'Year', 'Month'])
-        .size()
-        .reset_index(name='Count')
-    )
-
-    # Create a "Date" column for plotting
-    expirations_by_type_year_month['Date'] = pd.to_datetime(
-        expirations_by_type_year_month[['Year', 'Month']].assign(DAY=1)
-    )
-
-    # Create the stacked area chart
-    area_fig = px.area(
-        expirations_by_type_year_month,
-        x='Date',
-        y='Count',
-        color='Facility Type',
-        title="Pharmacy Expirations Over Time (Stacked by Facility Type)",
-        labels={'Count': 'Number of Expirations', 'Date': 'Date', 'Facility Type': 'Type of Facility'},
-        template='plotly_white'
-    )
+    # Licenses of the selected facility types, outside the years the chart
+    # leaves out, taken from the sorted expiration index in date order
+    with perf.span('filter.expirations') as span:
+        expiring_rows = dataset.expiration_index.between(exclude_years=EXCLUDED_YEARS)
+        if selected_facility_types:
+            expiring_rows = expiring_rows[dataset.engine.mask(PharmacyQuery(facility_types=selected_facility_types))[expiring_rows]]
+        else:
+            expiring_rows = expiring_rows[:0]
+        span.set(rows=len(expiring_rows))
 
     # Display the area chart
-    st.plotly_chart(area_fig, use_container_width=True)
+    show_figure('expirations', facility_types=selected_facility_types)
     # Display the interactive, read-only dataframe
     st.write("""
     Below is the data of the pharmacies whose licenses are anticipated to expire, based on your selected facility types.
     """)
-    display_filtered_df = filtered_pharmacies.copy()
-    cols_to_drop = ['License Type', 'License Status', 'Zip', 'LAT', 'LONG', 'isGovernment', 'isSatellite', 'Specialties', 'Conditions', 'Registered Outsourcer', 'Accreditations', 'Year', 'Month']
-    display_filtered_df.drop(columns=cols_to_drop, inplace=True)
-    st.dataframe(display_filtered_df)
+    expiration_columns = ['Pharmacy Name', 'License Number', 'Expiration Date', 'City', 'State', 'County', 'Facility Type', 'URL']
+    show_results_table(expiring_rows, expiration_columns, 'expirations')
 
 
 # Settings Tab
-with tabs[2]:
+elif page == pages[2]:
     st.header("About The Data")
     st.write("""
     All pharmacy license data is public knowledge and available through the California State Board of Pharmacy License Verification website located at https://www.pharmacy.ca.gov/. The initial licensure data was collected from this portal on 01/03/2025.
@@ -414,4 +288,20 @@ with tabs[2]:
     Looking forward to hearing from you!
     """)
     st.info("""
-    ***Interested In This Data for Another State? Sign up for my [waitlist!](https://docs.google.com/forms/d/e/1FAIpQLSfvlpsCtIYb-CVyz9cSaV1IGzoJrksr20bid8TFOyySPNF9pg/viewform?usp=header)""")
\ No newline at end of file
+    ***Interested In This Data for Another State? Sign up for my [waitlist!](https://docs.google.com/forms/d/e/1FAIpQLSfvlpsCtIYb-CVyz9cSaV1IGzoJrksr20bid8TFOyySPNF9pg/viewform?usp=header)""")
+
+
+# Diagnostics panel (opt in with ?diagnostics=1)
+if perf_recorder is not None:
+    perf_recorder.finish()
+    if show_diagnostics:
+        with st.expander("Diagnostics"):
+            st.write("**This rerun**")
+            st.dataframe(pd.DataFrame(perf_recorder.spans), use_container_width=True)
+            st.write("**This session**")
+            st.dataframe(perf.stats_frame(perf_recorder.session_stats), use_container_width=True)
+            st.write("**This server process**")
+            st.dataframe(perf.stats_frame(perf.process_stats()), use_container_width=True)
+            st.write(f"**Snapshot values not conforming to the schema** ({len(dataset.problems)})")
+            if len(dataset.problems):
+                st.dataframe(dataset.problems, use_container_width=True, hide_index=True)
@@ -0,0 +1,257 @@
+"""
+Load test of the Streamlit app: worker processes, each running several
+simulated sessions that click through the sidebar filters and the pages.
+
+    python -m benchmarks.load_test --data data/shared --workers 4 --sessions 8 --actions 25
+    python -m benchmarks.load_test --data enriched_pharmacy_data_01032024.csv --workers 4
+
+Every worker stands in for one server process: it loads the dataset once
+and interleaves its sessions, timing each rerun. The report gives the rerun
+latency percentiles, overall and per action, and the memory of each worker
+once its sessions are done: RSS, PSS (shared pages split between the
+processes mapping them) and USS (pages only that worker holds). The summed
+PSS is what the workers cost together, so a run against a shared store can
+be compared with one against the CSV.
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+from benchmarks.run import RESULTS_DIR, git_commit
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+PAGES = ["**Search Pharmacies**", "**License Analysis**", "**About**"]
+MAP_DETAILS = ["State", "County", "City", "Pharmacies"]
+PERCENTILES = [50, 90, 99]
+
+# /proc/self/smaps_rollup field -> report name
+MEMORY_FIELDS = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'private_clean', 'Private_Dirty': 'private_dirty'}
+
+
+def memory_usage():
+    # Resident memory of this process in bytes (Linux only; empty elsewhere)
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                field, _, value = line.partition(':')
+                if field in MEMORY_FIELDS:
+                    usage[MEMORY_FIELDS[field]] = int(value.split()[0]) * 1024
+    except OSError:
+        return {}
+    usage['uss'] = usage.pop('private_clean', 0) + usage.pop('private_dirty', 0)
+    return usage
+
+
+def _widget(at, kind, label):
+    return next(widget for widget in getattr(at, kind) if widget.label == label)
+
+
+class Actions:
+    """
+    The user actions a simulated session picks from, with the values to
+    pick drawn from the dataset.
+    """
+
+    def __init__(self, dataset, rng):
+        self.rng = rng
+        self.facility_types = list(dataset.facility_options)
+        self.cities = list(dataset.city_options)
+        self.specialties = list(dataset.unique_specialty_terms)
+        zips = [zip_code for zip_code in dataset.geo_index.zips[:10_000].tolist() if zip_code]
+        self.zips = zips or ['']
+        names = dataset.pharmacies['Pharmacy Name'].dropna().iloc[:10_000].tolist()
+        self.words = [word for name in names for word in str(name).split() if len(word) > 3] or ['pharmacy']
+
+    def choose(self):
+        return self.rng.choice([
+            'page', 'search', 'pharmacy_type', 'facility_type', 'city', 'specialty', 'near', 'map', 'reset',
+        ])
+
+    def apply(self, name, at):
+        getattr(self, name)(at)
+
+    def page(self, at):
+        at.radio(key='page').set_value(self.rng.choice(PAGES))
+
+    def search(self, at):
+        # A word of a pharmacy name, sometimes only partly typed
+        word = self.rng.choice(self.words)
+        _widget(at, 'text_input', "**Search**").set_value(word[:self.rng.randint(3, len(word))])
+
+    def pharmacy_type(self, at):
+        control = _widget(at, 'button_group', "**Pharmacy Type**")
+        options = [option.content for option in control.options]
+        control.set_value(self.rng.sample(options, self.rng.randint(1, len(options))))
+
+    def facility_type(self, at):
+        _widget(at, 'multiselect', "**Facility Type**").set_value(self.rng.sample(self.facility_types, min(2, len(self.facility_types))))
+
+    def city(self, at):
+        _widget(at, 'multiselect', "**City**").set_value([self.rng.choice(self.cities)] if self.cities else [])
+
+    def specialty(self, at):
+        _widget(at, 'multiselect', "**Specialty**").set_value([self.rng.choice(self.specialties)] if self.specialties else [])
+
+    def near(self, at):
+        _widget(at, 'text_input', "**Near**").set_value(self.rng.choice(self.zips))
+
+    def map(self, at):
+        # The map lives on the analysis page; switch to it and show the map
+        # at some level of detail in one rerun
+        at.radio(key='page').set_value("**License Analysis**")
+        toggles = [toggle for toggle in at.toggle if 'map' in toggle.label]
+        if toggles:
+            toggles[0].set_value(True)
+        if len(at.select_slider):
+            at.select_slider[0].set_value(self.rng.choice(MAP_DETAILS))
+
+    def reset(self, at):
+        _widget(at, 'text_input', "**Search**").set_value("")
+        _widget(at, 'text_input', "**Near**").set_value("")
+        for label in ["**City**", "**Specialty**"]:
+            _widget(at, 'multiselect', label).set_value([])
+
+
+def run_worker(worker, data, sessions, actions, seed, timeout):
+    """
+    Run `sessions` app sessions in this process, taking `actions` turns
+    round-robin, and return every rerun timing and the process memory.
+
+    The app serves data_loader.DATA_PATH, which is read from PHARMACY_DATA
+    when data_loader is first imported, so PHARMACY_DATA must already be set
+    to `data` when the worker process starts (main() sets it before the pool).
+    """
+    from streamlit.testing.v1 import AppTest
+
+    import data_loader
+
+    if os.path.abspath(data_loader.DATA_PATH) != data:
+        raise ValueError(
+            f"The app would serve {data_loader.DATA_PATH}, not {data}; set PHARMACY_DATA before starting the worker"
+        )
+    rng = random.Random(seed * 1000 + worker)
+    started = time.perf_counter()
+    dataset = data_loader.load_dataset(data)
+    load_seconds = time.perf_counter() - started
+    chooser = Actions(dataset, rng)
+
+    timings = []
+
+    def rerun(at, action):
+        started = time.perf_counter()
+        at.run()
+        timings.append({
+            'action': action,
+            'seconds': time.perf_counter() - started,
+            'error': bool(len(at.exception)),
+        })
+
+    apps = []
+    for _ in range(sessions):
+        at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        rerun(at, 'open')
+        apps.append(at)
+
+    for _ in range(actions):
+        for at in apps:
+            action = chooser.choose()
+            try:
+                chooser.apply(action, at)
+            except (StopIteration, IndexError, KeyError):
+                # The widget is not on the current page
+                action = 'rerun'
+            rerun(at, action)
+
+    return {'worker': worker, 'load_seconds': load_seconds, 'memory': memory_usage(), 'timings': timings}
+
+
+def latency_table(timings):
+    # Action -> count, errors and latency percentiles in milliseconds
+    by_action = {}
+    for timing in timings:
+        by_action.setdefault(timing['action'], []).append(timing)
+    by_action['all'] = timings
+    table = {}
+    for action, entries in by_action.items():
+        seconds = np.array([entry['seconds'] for entry in entries])
+        table[action] = {
+            'count': len(entries),
+            'errors': sum(entry['error'] for entry in entries),
+            **{f'p{percentile}_ms': float(np.percentile(seconds, percentile) * 1000) for percentile in PERCENTILES},
+            'max_ms': float(seconds.max() * 1000),
+        }
+    return table
+
+
+def print_report(data, workers, latencies):
+    print(f"\nRerun latency against {data}:")
+    print(f"{'action':<16}{'count':>7}{'errors':>8}" + ''.join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}")
+    for action, row in sorted(latencies.items(), key=lambda item: (item[0] == 'all', item[0])):
+        print(f"{action:<16}{row['count']:>7}{row['errors']:>8}"
+              + ''.join(f"{row[f'p{p}_ms']:>10.0f}" for p in PERCENTILES) + f"{row['max_ms']:>10.0f}")
+
+    mib = 1 << 20
+    print(f"\nWorker memory (MiB):\n{'worker':<8}{'load s':>8}{'RSS':>9}{'PSS':>9}{'USS':>9}")
+    for worker in workers:
+        memory = worker['memory']
+        print(f"{worker['worker']:<8}{worker['load_seconds']:>8.2f}"
+              + ''.join(f"{memory.get(field, 0) / mib:>9.0f}" for field in ['rss', 'pss', 'uss']))
+    total_pss = sum(worker['memory'].get('pss', 0) for worker in workers)
+    print(f"{'total':<16}{'':>9}{total_pss / mib:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the app with simulated sessions in worker processes.")
+    parser.add_argument('--data', default=os.environ.get('PHARMACY_DATA', 'enriched_pharmacy_data_01032024.csv'),
+                        help="Snapshot CSV, Parquet directory or shared store to serve")
+    parser.add_argument('--workers', type=int, default=4, help="Server processes to simulate")
+    parser.add_argument('--sessions', type=int, default=8, help="Sessions per worker")
+    parser.add_argument('--actions', type=int, default=25, help="Actions per session")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=120, help="Seconds a single rerun may take")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/load-<timestamp>.json)")
+    args = parser.parse_args()
+
+    data = os.path.abspath(args.data)
+    # Spawned workers import this module, and with it data_loader, before
+    # they run anything, so they must inherit the data path from the start
+    os.environ['PHARMACY_DATA'] = data
+    # Fresh interpreters, as separate server processes would be
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers) as pool:
+        workers = pool.starmap(run_worker, [
+            (worker, data, args.sessions, args.actions, args.seed, args.timeout) for worker in range(args.workers)
+        ])
+
+    latencies = latency_table([timing for worker in workers for timing in worker['timings']])
+    print_report(data, workers, latencies)
+
+    started = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = args.output or os.path.join(RESULTS_DIR, f'load-{started}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'started': started,
+                'commit': git_commit(),
+                'data': data,
+                'workers': args.workers,
+                'sessions': args.sessions,
+                'actions': args.actions,
+                'seed': args.seed,
+            },
+            'latency': latencies,
+            'workers': [{key: worker[key] for key in ['worker', 'load_seconds', 'memory']} for worker in workers],
+        }, f, indent=2)
+    print(f"\nWrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+A local stand-in for the license search, serving recorded result pages so
+that scraper.py can be run and timed offline.
+
+    python -m benchmarks.recorded_site pages --render enriched_pharmacy_data_01032024.csv
+    python -m benchmarks.recorded_site pages --port 8600 --latency 0.2 --error-rate 0.05
+    python scraper.py enriched_pharmacy_data_01032024.csv export.csv \\
+        --url 'http://localhost:8600/results?licenseNumber={license}'
+
+Pages are found by license number in the directory, as saved by
+`scraper.py --record`. --render instead writes a page for every license of
+a snapshot in the search's result markup. An unknown license gets a page
+without results, as on the search. --latency delays every response and
+--error-rate answers that share of requests with a 503, to exercise the
+rate limit and the retries.
+"""
+import argparse
+import asyncio
+import html
+import os
+import random
+
+import pandas as pd
+import tornado.ioloop
+import tornado.web
+
+from scraper import OUT_OF_STATE, PAGE_DATE_FORMAT, STATE_ABBREVIATIONS, page_name
+
+STATE_NAMES = {abbreviation: name for name, abbreviation in STATE_ABBREVIATIONS.items()}
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>License Search Results</title></head>
+<body><div id="main">
+{articles}
+<p>You have reached the end of your results</p>
+</div></body></html>
+"""
+
+ARTICLE = """<article class="post yes" id="{index}">
+<ul class="actions">
+<li><h3>{name}</h3></li>
+<li><strong>License Number:</strong> <a href="/details/{index}"><span id="lic{index}">{license}</span></a></li>
+<li><strong>License Type:</strong> {license_type}</li>
+<li><strong>License Status:</strong> {status}</li>
+<li><strong>Expiration Date:</strong> {expiration}</li>
+<li><strong>City:</strong> <span>{city}</span></li>
+<li><strong>State:</strong> <span>{state}</span></li>
+<li><strong>County:</strong> {county}</li>
+<li><strong>Zip:</strong> {zip}</li>
+</ul>
+</article>"""
+
+
+def render_page(row, index=0):
+    # A result page listing one license of a snapshot, written the way the
+    # search shows it (long dates and state names, OUT OF STATE counties)
+    def text(column):
+        value = row.get(column)
+        return '' if pd.isna(value) else html.escape(str(value))
+
+    expiration = pd.to_datetime(row.get('Expiration Date'), errors='coerce')
+    return PAGE.format(articles=ARTICLE.format(
+        index=index,
+        name=text('Pharmacy Name'),
+        license=text('License Number'),
+        license_type=text('License Type'),
+        status=text('License Status'),
+        expiration='' if pd.isna(expiration) else expiration.strftime(PAGE_DATE_FORMAT).replace(' 0', ' '),
+        city=text('City'),
+        state=html.escape(STATE_NAMES.get(row.get('State'), text('State'))),
+        county=text('County') or OUT_OF_STATE,
+        zip=text('Zip'),
+    ))
+
+
+def render_snapshot(snapshot, directory):
+    pharmacies = pd.read_csv(snapshot, dtype=str)
+    os.makedirs(directory, exist_ok=True)
+    for index, row in enumerate(pharmacies.to_dict('records')):
+        if pd.isna(row.get('License Number')):
+            continue
+        with open(os.path.join(directory, page_name(row['License Number'])), 'w', encoding='utf-8') as f:
+            f.write(render_page(row, index))
+    return len(pharmacies)
+
+
+class ResultsHandler(tornado.web.RequestHandler):
+    def initialize(self, directory, latency, error_rate):
+        self.directory = directory
+        self.latency = latency
+        self.error_rate = error_rate
+
+    async def get(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            raise tornado.web.HTTPError(503)
+        path = os.path.join(self.directory, page_name(self.get_argument('licenseNumber', '')))
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as f:
+                self.finish(f.read())
+        else:
+            self.finish(PAGE.format(articles=''))
+
+
+def make_app(directory, latency=0.0, error_rate=0.0):
+    return tornado.web.Application([
+        (r'/results', ResultsHandler, {'directory': directory, 'latency': latency, 'error_rate': error_rate}),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded license search pages for the scraper.")
+    parser.add_argument('pages', help="Directory of recorded result pages")
+    parser.add_argument('--render', metavar='SNAPSHOT', help="Write a page per license of a snapshot CSV and exit")
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 503")
+    args = parser.parse_args()
+
+    if args.render:
+        count = render_snapshot(args.render, args.pages)
+        print(f"Wrote {count} result pages to {args.pages}")
+        return
+    make_app(args.pages, args.latency, args.error_rate).listen(args.port)
+    print(f"Serving {args.pages} on http://localhost:{args.port}/results?licenseNumber=...")
+    tornado.ioloop.IOLoop.current().start()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""
+Benchmark the data layer on synthetic snapshots of increasing size.
+
+For each size this times loading the snapshot, applying a 1% refresh to
+it, every sidebar filter path (cold and from the query cache), the
+aggregates and the figures, and records the peak memory traced during each
+step. Results are written as
+JSON so runs can be compared:
+
+    python -m benchmarks.run --sizes 10000 100000 1000000
+    python -m benchmarks.run --sizes 10000 --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+from aggregates import AGGREGATES
+from benchmarks.synthetic import churn, generate
+from figures import FIGURES
+from query_engine import PharmacyQuery
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def measure(function, repeat=3):
+    # Wall time of each call, then one traced call for the peak memory
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds_median': statistics.median(timings),
+        'seconds_min': min(timings),
+        'peak_memory_bytes': peak,
+    }
+
+
+def filter_paths(dataset):
+    # One query per sidebar control, plus everything combined, using the
+    # most common values so that every path returns rows
+    pharmacies = dataset.pharmacies
+    top_city = pharmacies['City'].value_counts().index[0]
+    top_terms = {
+        name: index.counts().sort_values(ascending=False).index[:2].tolist()
+        for name, index in [
+            ('specialties', dataset.specialty_index),
+            ('conditions', dataset.condition_index),
+            ('accreditations', dataset.accreditation_index),
+        ]
+    }
+    paths = {
+        'default': PharmacyQuery(pharmacy_types=['503A', '503B'], facility_types=['Sterile Compounding Pharmacy']),
+        'pharmacy_type': PharmacyQuery(pharmacy_types=['503B']),
+        'facility_type': PharmacyQuery(facility_types=['Medical Facility', 'Infusion Center']),
+        'city': PharmacyQuery(cities=[top_city]),
+        'specialty': PharmacyQuery(specialties=top_terms['specialties']),
+        'condition': PharmacyQuery(conditions=top_terms['conditions'][:1]),
+        'accreditation': PharmacyQuery(accreditations=top_terms['accreditations'][:1]),
+    }
+    paths['text'] = PharmacyQuery(text=f"{pharmacies['Pharmacy Name'].iloc[0].split()[0]} {top_city[:3]}")
+    paths['combined'] = PharmacyQuery(
+        pharmacy_types=['503A'],
+        facility_types=['Sterile Compounding Pharmacy'],
+        specialties=top_terms['specialties'][:1],
+        accreditations=top_terms['accreditations'][:1],
+    )
+    return paths
+
+
+def run_size(n_rows, seed, include_figures):
+    results = []
+
+    def record(stage, name, function, repeat=3):
+        result = measure(function, repeat=repeat)
+        results.append({'rows': n_rows, 'stage': stage, 'name': name, **result})
+        print(f"{n_rows:>9} {stage:<10} {name:<24} {result['seconds_median'] * 1000:10.2f} ms "
+              f"{result['peak_memory_bytes'] / 2 ** 20:9.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, f'synthetic_{n_rows}.csv')
+        generate(n_rows, seed=seed).to_csv(path, index=False)
+
+        def cold_load():
+            data_loader.clear_cache()
+            return data_loader.load_dataset(path)
+
+        record('load', 'cold', cold_load, repeat=1)
+        dataset = data_loader.load_dataset(path)
+        record('load', 'cached', lambda: data_loader.load_dataset(path))
+
+    # Applying a 1% refresh to the loaded indexes versus building them anew
+    refreshed = churn(dataset.pharmacies, 0.01, seed=seed)
+    dataset.aggregates.base_cube
+    record('refresh', 'incremental 1%', lambda: data_loader.Dataset(
+        refreshed, 'refresh', dataset.path, previous=dataset
+    ).aggregates.base_cube, repeat=1)
+    record('refresh', 'full 1%', lambda: data_loader.Dataset(
+        refreshed, 'refresh', dataset.path
+    ).aggregates.base_cube, repeat=1)
+
+    for name, query in filter_paths(dataset).items():
+        record('filter', name, lambda: dataset.engine.mask(query))
+        dataset.engine.run(query)
+        record('filter', f'{name} (cached)', lambda: dataset.engine.run(query))
+
+    center = dataset.geo_index.locate(dataset.pharmacies['Zip'].value_counts().index[0])
+    record('filter', 'radius 25mi', lambda: dataset.geo_index.within(*center, 25))
+
+    for name in AGGREGATES:
+        record('aggregate', name, lambda: type(dataset.aggregates)(dataset)[name], repeat=1)
+    record('aggregate', 'cube', lambda: type(dataset.aggregates)(dataset).base_cube, repeat=1)
+
+    if include_figures:
+        default_types = dataset.expirations.facility_types
+        for name, builder in FIGURES.items():
+            params = {'facility_types': default_types} if name == 'expirations' else {}
+            record('figure', name, lambda: builder(dataset, **params), repeat=1)
+
+    return results
+
+
+def compare(current, previous_path):
+    # Print the ratio of each median timing to the same step in an earlier run
+    with open(previous_path) as f:
+        previous = {
+            (result['rows'], result['stage'], result['name']): result
+            for result in json.load(f)['results']
+        }
+    print(f"\nCompared with {previous_path} (ratio > 1 is slower):")
+    for result in current:
+        before = previous.get((result['rows'], result['stage'], result['name']))
+        if before and before['seconds_median'] > 0:
+            ratio = result['seconds_median'] / before['seconds_median']
+            print(f"{result['rows']:>9} {result['stage']:<10} {result['name']:<24} {ratio:6.2f}x")
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data layer on synthetic snapshots.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-figures', action='store_true', help="Skip building the plotly figures")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for n_rows in args.sizes:
+        results.extend(run_size(n_rows, args.seed, include_figures=not args.no_figures))
+
+    started = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = args.output or os.path.join(RESULTS_DIR, f'{started}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'meta': {
+                'started': started,
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'numpy': np.__version__,
+                'sizes': args.sizes,
+                'seed': args.seed,
+            },
+            'results': results,
+        }, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Schema-faithful synthetic snapshots for benchmarking.
+
+Every column is sampled from the distributions of the real snapshot:
+locations (City/State/County/Zip/LAT/LONG) are drawn together from real
+rows and jittered, and the multi-valued Specialties/Conditions/Accreditations
+columns reproduce the real share of tagged rows, the real number of terms per
+row and the real term frequencies.
+
+    python -m benchmarks.synthetic 100000 synthetic_100k.csv
+"""
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from data_loader import DATA_PATH
+
+TERM_COLUMNS = ['Specialties', 'Conditions', 'Accreditations']
+
+# Columns sampled independently of each other, as they appear in the source
+INDEPENDENT_COLUMNS = ['License Status', 'isSatellite', 'Registered Outsourcer']
+
+LOCATION_COLUMNS = ['City', 'State', 'County', 'Zip', 'LAT', 'LONG']
+
+
+def _split_terms(value):
+    return [term.strip() for term in value.split(',') if term.strip()]
+
+
+def _sample_terms(source, n_rows, rng):
+    # Comma-joined term lists following the source's tagging rate, list
+    # lengths and term frequencies; untagged rows are missing values
+    tagged = source.dropna().map(_split_terms)
+    lengths = tagged.map(len).to_numpy()
+    counts = pd.Series(list(itertools.chain.from_iterable(tagged))).value_counts()
+    terms = counts.index.to_numpy()
+    weights = (counts / counts.sum()).to_numpy()
+
+    values = np.full(n_rows, np.nan, dtype=object)
+    rows = np.flatnonzero(rng.random(n_rows) < len(tagged) / len(source))
+    for row, length in zip(rows, rng.choice(lengths, size=len(rows))):
+        picked = rng.choice(terms, size=min(length, len(terms)), replace=False, p=weights)
+        values[row] = ', '.join(picked)
+    return values
+
+
+def generate(n_rows, seed=0, source_path=DATA_PATH):
+    """
+    Return `n_rows` synthetic licenses with the columns (and string
+    representation) of the snapshot CSV at `source_path`.
+    """
+    rng = np.random.default_rng(seed)
+    source = pd.read_csv(source_path, dtype=str, encoding='utf-8')
+    picks = rng.integers(0, len(source), size=n_rows)
+
+    # Keep each row's license, facility and government flags consistent
+    licensed = source[['License Type', 'Facility Type', 'isGovernment', 'License Number']].iloc[picks]
+    prefixes = licensed['License Number'].str.split(' ').str[0].to_numpy()
+
+    located = source[LOCATION_COLUMNS].iloc[rng.integers(0, len(source), size=n_rows)]
+    lats = pd.to_numeric(located['LAT'], errors='coerce').to_numpy() + rng.normal(0, 0.05, n_rows)
+    longs = pd.to_numeric(located['LONG'], errors='coerce').to_numpy() + rng.normal(0, 0.05, n_rows)
+
+    names = source['Pharmacy Name'].to_numpy()[rng.integers(0, len(source), size=n_rows)]
+    expirations = source['Expiration Date'].to_numpy()[rng.integers(0, len(source), size=n_rows)]
+
+    synthetic = pd.DataFrame({
+        'Pharmacy Name': [f"{name} #{i}" for i, name in enumerate(names)],
+        'License Number': [f"{prefix} {200000 + i}" for i, prefix in enumerate(prefixes)],
+        'License Type': licensed['License Type'].to_numpy(),
+        'Expiration Date': expirations,
+        'City': located['City'].to_numpy(),
+        'State': located['State'].to_numpy(),
+        'County': located['County'].to_numpy(),
+        'Zip': located['Zip'].to_numpy(),
+        'LAT': pd.Series(lats).round(6).astype(str).replace('nan', np.nan).to_numpy(),
+        'LONG': pd.Series(longs).round(6).astype(str).replace('nan', np.nan).to_numpy(),
+        'isGovernment': licensed['isGovernment'].to_numpy(),
+        'Facility Type': licensed['Facility Type'].to_numpy(),
+    })
+    for column in INDEPENDENT_COLUMNS:
+        synthetic[column] = source[column].to_numpy()[rng.integers(0, len(source), size=n_rows)]
+    for column in TERM_COLUMNS:
+        synthetic[column] = _sample_terms(source[column], n_rows, rng)
+    synthetic['URL'] = pd.Series(
+        [f"https://www.pharmacy{i}.example.com" for i in range(n_rows)]
+    ).where(pd.notna(synthetic['Specialties'])).to_numpy()
+    return synthetic[list(source.columns)]
+
+
+def churn(pharmacies, share, seed=0):
+    """
+    A refresh of `pharmacies` in which `share` of the licenses changed:
+    half of them renewed for a year, a quarter dropped and as many new
+    licenses added (copies of existing rows under new License Numbers).
+    """
+    rng = np.random.default_rng(seed)
+    n_changed = max(int(len(pharmacies) * share), 4)
+    picks = rng.choice(len(pharmacies), size=n_changed, replace=False)
+    renewed, dropped, copied = picks[:n_changed // 2], picks[n_changed // 2:n_changed * 3 // 4], picks[n_changed * 3 // 4:]
+
+    refreshed = pharmacies.copy()
+    dates = refreshed.columns.get_loc('Expiration Date')
+    refreshed.iloc[renewed, dates] = refreshed['Expiration Date'].iloc[renewed] + pd.DateOffset(years=1)
+    added = pharmacies.iloc[copied].assign(
+        **{'License Number': [f"NEW {900000 + i}" for i in range(len(copied))]}
+    )
+    return pd.concat([refreshed.drop(index=refreshed.index[dropped]), added], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic pharmacy snapshot CSV.")
+    parser.add_argument('rows', type=int, help="Number of licenses to generate")
+    parser.add_argument('output', help="CSV file to write")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate(args.rows, seed=args.seed).to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    main()
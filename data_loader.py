@@ -0,0 +1,328 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+import perf
+import schema
+import shared_store
+import storage
+from aggregates import CUBE_DIMENSIONS, AggregateRegistry
+from expirations import ExpirationCube, ExpirationIndex
+from geo_index import GeoIndex
+from map_bins import MapBins
+from query_engine import PharmacyQueryEngine
+from snapshot_diff import SnapshotDiff
+from term_index import ACCREDITATION_ALIASES, SPECIALTY_REPLACEMENTS, TermIndex
+from text_index import TEXT_FIELDS, TextIndex
+
+# Snapshot to serve: the CSV shipped with the app, a Parquet directory
+# written by storage.py (optionally limited to a comma-separated list of
+# states), or a store published by shared_store.py. The states are fixed per
+# process: all of their partitions are loaded, whatever is queried.
+DATA_PATH = os.environ.get('PHARMACY_DATA', 'enriched_pharmacy_data_01032024.csv')
+DATA_STATES = tuple(state for state in os.environ.get('PHARMACY_STATES', '').split(',') if state)
+
+# Snapshot columns nothing in the app or the API reads; load_dataset leaves
+# them on disk (ingest.py and the other tools still read every column)
+UNSERVED_COLUMNS = ['License Status', 'isSatellite']
+SERVED_COLUMNS = [column for column in storage.SNAPSHOT_SCHEMA.names if column not in UNSERVED_COLUMNS]
+
+# Above this share of changed licenses a refresh rebuilds everything
+MAX_INCREMENTAL_CHURN = 0.5
+
+# A snapshot that is replaced while it is read (see storage.replace_path) is
+# read again, up to this many times, waiting this long while it is missing
+READ_ATTEMPTS = 5
+SWAP_WAIT = 0.05
+
+logger = logging.getLogger('pharmacy.schema')
+
+# Dataset attributes built once by a publisher and mapped from a shared
+# store by every worker (see shared_store.py)
+SHARED_ATTRIBUTES = [
+    'problems',
+    'expirations',
+    'expiration_index',
+    'geo_index',
+    'specialty_index',
+    'condition_index',
+    'accreditation_index',
+    'text_index',
+]
+
+# Multi-valued column -> Dataset attribute holding its TermIndex
+TERM_INDEXES = {
+    'Specialties': 'specialty_index',
+    'Conditions': 'condition_index',
+    'Accreditations': 'accreditation_index',
+}
+
+
+class Dataset:
+    """
+    A loaded snapshot plus everything derived from it at load time.
+
+    Instances are shared by every session in the server process, so callers
+    must treat the frames as read-only and copy before modifying them.
+    `problems` are the values that did not conform to the schema at load.
+    """
+
+    def __init__(self, pharmacies, version, path, previous=None, problems=None):
+        self.pharmacies = pharmacies
+        self.version = version
+        self.path = path
+        self.problems = problems if problems is not None else pd.DataFrame(columns=schema.PROBLEM_COLUMNS)
+
+        # A refresh of an already loaded snapshot only reprocesses the
+        # licenses that changed, unless most of them did
+        diff = None
+        if previous is not None:
+            with perf.span('refresh.diff', rows=len(pharmacies)) as span:
+                try:
+                    diff = SnapshotDiff(previous.pharmacies, pharmacies)
+                except ValueError:
+                    diff = None
+                if diff is not None and diff.churn > MAX_INCREMENTAL_CHURN:
+                    diff = None
+                span.set(incremental=diff is not None)
+
+        # Count Data, computed on first access
+        if diff is None:
+            self.aggregates = AggregateRegistry(self)
+        else:
+            self.aggregates = previous.aggregates.updated(self, *diff.delta(CUBE_DIMENSIONS))
+
+        # Expiration counts by Facility Type and month, and a sorted date index
+        with perf.span('expiration_index', rows=len(pharmacies)):
+            if diff is None:
+                self.expirations = ExpirationCube.from_frame(pharmacies)
+            else:
+                added, retracted = diff.delta(['Facility Type', 'Expiration Date'])
+                self.expirations = previous.expirations.apply_delta(
+                    added=pharmacies.iloc[added], removed=previous.pharmacies.iloc[retracted]
+                )
+            self.expiration_index = ExpirationIndex(pharmacies['Expiration Date'])
+
+        # Spatial index for radius searches around a ZIP or coordinate
+        with perf.span('geo_index', rows=len(pharmacies)):
+            if diff is None:
+                self.geo_index = GeoIndex.from_frame(pharmacies)
+            else:
+                self.geo_index = previous.geo_index.updated(
+                    diff.source, *diff.delta(['LAT', 'LONG', 'Zip']), pharmacies
+                )
+
+        # Term indexes over the multi-valued search columns
+        with perf.span('vocabulary', rows=len(pharmacies)):
+            self.specialty_index = self._term_index(
+                'Specialties', previous, diff, replacements=SPECIALTY_REPLACEMENTS
+            )
+            self.condition_index = self._term_index('Conditions', previous, diff)
+            self.accreditation_index = self._term_index(
+                'Accreditations', previous, diff, aliases=ACCREDITATION_ALIASES
+            )
+
+        # Free-text index over names, license numbers, cities and counties
+        with perf.span('text_index', rows=len(pharmacies)):
+            if diff is None:
+                self.text_index = TextIndex.from_frame(pharmacies)
+            else:
+                self.text_index = previous.text_index.updated(diff.source, diff.changed(list(TEXT_FIELDS)), pharmacies)
+
+        self._derive()
+
+    @classmethod
+    def from_shared(cls, pharmacies, version, path, shared):
+        """
+        A Dataset around the SHARED_ATTRIBUTES (`shared`, name -> object)
+        built by another process, instead of building them here.
+        """
+        dataset = cls.__new__(cls)
+        dataset.pharmacies = pharmacies
+        dataset.version = version
+        dataset.path = path
+        for name in SHARED_ATTRIBUTES:
+            setattr(dataset, name, shared[name])
+        dataset.aggregates = AggregateRegistry(dataset)
+        dataset._derive()
+        return dataset
+
+    def _derive(self):
+        # The cheap, per-process parts built on top of the indexes
+        self.facility_options = list(self.pharmacies['Facility Type'].dropna().unique())
+        self.city_options = sorted(self.pharmacies['City'].dropna().unique())
+
+        # Search vocabularies
+        self.unique_specialty_terms = self.specialty_index.terms
+        self.unique_condition_terms = self.condition_index.terms
+        self.unique_accreditations = self.accreditation_index.terms
+
+        # Query engine (and its result cache) for this version of the data
+        self.engine = PharmacyQueryEngine(self)
+
+        # Hexagonal map bins per zoom level, computed on first use
+        self.map_bins = MapBins(self)
+
+    def _term_index(self, column, previous, diff, replacements=None, aliases=None):
+        attribute = TERM_INDEXES[column]
+        if diff is None:
+            return TermIndex.from_column(self.pharmacies[column], replacements=replacements, aliases=aliases)
+        return getattr(previous, attribute).updated(
+            diff.source, diff.changed([column]), self.pharmacies[column],
+            replacements=replacements, aliases=aliases
+        )
+
+
+def _snapshot_files(path, states):
+    # A snapshot is either a single CSV or a directory partitioned by State;
+    # a shared store changes whenever its CURRENT file does
+    if shared_store.is_store(path):
+        return [shared_store.current_file(path)]
+    if os.path.isdir(path):
+        return storage.snapshot_files(path, states)
+    return [path]
+
+
+def _files_digest(files):
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.basename(os.path.dirname(file)).encode('utf-8'))
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_version(path, states=()):
+    # Content hash identifying a snapshot (or the given states of it)
+    return _files_digest(_snapshot_files(os.path.abspath(path), states))
+
+
+def publish_dataset(dataset, root, keep=shared_store.KEEP_VERSIONS):
+    # Make `dataset` the current version of the shared store at `root`
+    shared = {name: getattr(dataset, name) for name in SHARED_ATTRIBUTES}
+    shared_store.publish(dataset.pharmacies, shared, dataset.version, root, keep=keep)
+
+
+def read_raw_snapshot(path, states=(), columns=None):
+    # A snapshot as stored: the CSV as strings, a Parquet directory with its
+    # on-disk types. Only `columns` (all when None) are read; for Parquet
+    # only the partitions of `states` are opened at all.
+    if os.path.isdir(path):
+        return storage.read_snapshot(path, states=states, columns=columns)
+    usecols = None if columns is None else (lambda column: column in columns)
+    pharmacies = pd.read_csv(path, dtype=str, encoding='utf-8', usecols=usecols)
+    if states:
+        pharmacies = pharmacies[pharmacies['State'].isin(states)].reset_index(drop=True)
+    return pharmacies
+
+
+def read_snapshot(path, states=(), with_problems=False, columns=None, kinds=schema.FRAME_SCHEMA):
+    """
+    A snapshot as a frame typed by `kinds` (schema.FRAME_SCHEMA, or
+    schema.STORED_SCHEMA to write it back), with only `columns` (all when
+    None). Values that do not conform are left missing and logged; with
+    `with_problems` the problems frame is returned as well.
+    """
+    pharmacies, problems = schema.conform(read_raw_snapshot(path, states, columns), kinds)
+    if len(problems):
+        counts = problems.groupby(['Column', 'Problem']).size()
+        logger.warning(
+            "%s: %d values in %d rows do not conform to the schema (%s)", path, len(problems), problems['Row'].nunique(),
+            ', '.join(f'{column} {problem}: {count}' for (column, problem), count in counts.items())
+        )
+    return (pharmacies, problems) if with_problems else pharmacies
+
+
+# Process-wide cache: (path, states) -> (file signature, Dataset)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_dataset(path=DATA_PATH, states=DATA_STATES):
+    """
+    Return the Dataset for `path`, loading it at most once per process.
+
+    `path` is a snapshot CSV or a Parquet directory written by
+    storage.write_snapshot. Only SERVED_COLUMNS are read, and for the latter
+    only the partitions of `states` (all when empty). It can also be a store published by
+    shared_store.py, whose current version is mapped rather than read and
+    indexed (`states` are then chosen by the publisher).
+
+    Each call only stats the snapshot files. The content hash is recomputed
+    when an mtime or size changes, and the snapshot is re-read only when the
+    hash changes too, so touching a file without editing it keeps the cache.
+    A snapshot whose files change while it is read is read again. A changed
+    snapshot is applied to the previously loaded Dataset as a
+    delta keyed on License Number (see Dataset), and gets a new version, so
+    every cache keyed by the version starts over.
+    """
+    path = os.path.abspath(path)
+    states = tuple(sorted(states)) if states else ()
+    key = (path, states)
+    signature = _signature(path, states)
+
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with _cache_lock:
+        # Another session may have reloaded while we waited for the lock
+        cached = _cache.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        for _ in range(READ_ATTEMPTS):
+            try:
+                dataset = _load(path, states, [file for file, _, _ in signature], cached)
+            except FileNotFoundError:
+                dataset = None
+            current = _signature(path, states)
+            if dataset is not None and current == signature:
+                break
+            signature = current
+        else:
+            raise RuntimeError(f"{path} kept changing while it was read")
+        _cache[key] = (signature, dataset)
+        return dataset
+
+
+def _signature(path, states):
+    # (file, mtime, size) of every snapshot file, waiting out the moment a
+    # directory being replaced is missing
+    for attempt in range(READ_ATTEMPTS):
+        try:
+            files = _snapshot_files(path, states)
+            return tuple((file, stat.st_mtime_ns, stat.st_size) for file, stat in zip(files, map(os.stat, files)))
+        except FileNotFoundError:
+            if attempt == READ_ATTEMPTS - 1:
+                raise
+            time.sleep(SWAP_WAIT)
+
+
+def _load(path, states, files, cached):
+    # The Dataset of the snapshot `files` make up, reusing the cached one
+    # when the content is unchanged and refreshing it when it changed
+    shared = shared_store.is_store(path)
+    with perf.span('load.hash', files=len(files)):
+        version = shared_store.current_version(path) if shared else _files_digest(files)
+    if cached is not None and cached[1].version == version:
+        return cached[1]
+    if shared:
+        with perf.span('load.map', path=path) as span:
+            pharmacies, objects = shared_store.open_version(path, version)
+            span.set(rows=len(pharmacies))
+        return Dataset.from_shared(pharmacies, version, path, objects)
+    with perf.span('load.read', path=path) as span:
+        pharmacies, problems = read_snapshot(path, states, with_problems=True, columns=SERVED_COLUMNS)
+        span.set(rows=len(pharmacies), problems=len(problems))
+    return Dataset(pharmacies, version, path, previous=cached[1] if cached is not None else None, problems=problems)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
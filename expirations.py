@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+
+# Years left out of the expiration chart and table: licenses expiring in 2024
+# had already lapsed or been renewed when the snapshot was taken
+EXCLUDED_YEARS = (2024,)
+
+
+class ExpirationCube:
+    """
+    Facility Type x expiration month matrix of license counts.
+
+    Built once from `Expiration Date` as a monthly period. Selecting facility
+    types is a sum over rows of the matrix, and a snapshot refresh adjusts
+    the counts by the added and removed licenses instead of regrouping
+    every row.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    @classmethod
+    def from_frame(cls, pharmacies):
+        return cls(_count_matrix(pharmacies))
+
+    @property
+    def facility_types(self):
+        return list(self.matrix.index)
+
+    def monthly_totals(self, facility_types):
+        # Expirations per month summed over the selected facility types
+        return self.matrix.reindex(index=list(facility_types), fill_value=0).sum(axis=0)
+
+    def long_frame(self, facility_types, exclude_years=()):
+        """
+        Counts per Facility Type and month as a long frame (`Facility Type`,
+        `Date`, `Count`) with empty months left out, ready for plotting.
+        """
+        matrix = self.matrix.loc[self.matrix.index.isin(list(facility_types))]
+        if exclude_years:
+            matrix = matrix.loc[:, ~matrix.columns.year.isin(list(exclude_years))]
+        long = matrix.stack().rename('Count').reset_index()
+        long.columns = ['Facility Type', 'Month', 'Count']
+        long = long[long['Count'] > 0]
+        return pd.DataFrame({
+            'Facility Type': long['Facility Type'].to_numpy(),
+            'Date': long['Month'].dt.to_timestamp().to_numpy(),
+            'Count': long['Count'].to_numpy(),
+        })
+
+    def apply_delta(self, added=None, removed=None):
+        """
+        Return a new cube with the licenses in `added` counted and those in
+        `removed` uncounted; a renewal is a removal of the old row plus an
+        addition of the new one. The cube itself is shared and never changed.
+        """
+        matrix = self.matrix
+        if added is not None and len(added):
+            matrix = matrix.add(_count_matrix(added), fill_value=0)
+        if removed is not None and len(removed):
+            matrix = matrix.sub(_count_matrix(removed), fill_value=0)
+        matrix = matrix.fillna(0).astype('int64')
+        # Drop facility types and months that no longer have any licenses
+        matrix = matrix.loc[matrix.sum(axis=1) > 0, matrix.sum(axis=0) > 0]
+        return ExpirationCube(matrix.sort_index().sort_index(axis=1))
+
+
+class ExpirationIndex:
+    """
+    Row positions sorted by `Expiration Date`, for date range queries
+    answered with a binary search instead of a scan.
+    """
+
+    def __init__(self, dates):
+        values = pd.to_datetime(dates).to_numpy(dtype='datetime64[D]')
+        valid = np.flatnonzero(~np.isnat(values))
+        order = np.argsort(values[valid], kind='stable')
+        self._dates = values[valid][order]
+        self._rows = valid[order]
+        self._rows.flags.writeable = False
+
+    def between(self, start=None, end=None, exclude_years=()):
+        # Rows expiring in [start, end) outside `exclude_years`, earliest first
+        lo = 0 if start is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(start), 'D'), 'left')
+        hi = len(self._dates) if end is None else np.searchsorted(self._dates, np.datetime64(pd.Timestamp(end), 'D'), 'left')
+        rows = self._rows[lo:hi]
+        if exclude_years:
+            years = self._dates[lo:hi].astype('datetime64[Y]').astype(np.int64) + 1970
+            rows = rows[~np.isin(years, list(exclude_years))]
+        return rows
+
+    def expiring_within(self, days, today=None):
+        # Rows expiring from today through the next `days` days, earliest first
+        today = pd.Timestamp.today().normalize() if today is None else pd.Timestamp(today)
+        return self.between(today, today + pd.Timedelta(days=days + 1))
+
+
+def _count_matrix(pharmacies):
+    expiring = pharmacies[['Facility Type', 'Expiration Date']].dropna()
+    months = pd.to_datetime(expiring['Expiration Date']).dt.to_period('M')
+    # Plain labels, so unused categories do not become rows
+    facility_types = expiring['Facility Type'].astype(object)
+    return (
+        pd.crosstab(facility_types, months)
+        .rename_axis(index='Facility Type', columns='Month')
+        .astype('int64')
+    )
@@ -0,0 +1,184 @@
+import numpy as np
+import plotly.express as px
+import plotly.io as pio
+
+from cache import LRUCache
+from expirations import EXCLUDED_YEARS
+from map_bins import POINT_ZOOM, is_points
+
+# name -> function(dataset, **params) returning a plotly Figure
+FIGURES = {}
+
+# (dataset version, figure name, params) -> serialized figure JSON
+_cache = LRUCache(maxsize=128)
+
+
+def figure(name):
+    # Register a figure builder under `name`
+    def register(builder):
+        FIGURES[name] = builder
+        return builder
+    return register
+
+
+def get_figure(dataset, name, **params):
+    """
+    Return the named figure for `dataset`, building it at most once.
+
+    Figures are cached as serialized JSON keyed by the dataset version, the
+    figure name and its parameters, so a rerun only deserializes the stored
+    figure instead of running plotly express again.
+    """
+    key = (dataset.version, name, _freeze(params))
+    figure_json = _cache.get_or_compute(key, lambda: FIGURES[name](dataset, **params).to_json())
+    return pio.from_json(figure_json)
+
+
+def _freeze(params):
+    # Hashable form of the parameters (lists and sets become sorted tuples)
+    return tuple(
+        (key, tuple(sorted(value)) if isinstance(value, (list, set, tuple)) else value)
+        for key, value in sorted(params.items())
+    )
+
+
+@figure('license_types')
+def license_types_donut(dataset):
+    return px.pie(
+        dataset.aggregates['license_counts'],
+        names='License Type',
+        values='Count',
+        title='Distribution of License Types',
+        hole=0.25,
+        labels={'License Type': 'Type of License', 'Count': 'Number of Licenses'},
+        template='simple_white'
+    )
+
+
+@figure('facility_types')
+def facility_types_bar(dataset):
+    facility_counts = dataset.aggregates['facility_counts'].sort_values(by='Count', ascending=False)
+    return px.bar(
+        facility_counts,
+        x='Count',
+        y='Facility Type',
+        orientation='h',
+        category_orders={'Facility Type': facility_counts['Facility Type'].tolist()},
+        title='What Types of Facilities Hold Sterile Compounding Licenses in California?',
+        labels={'Facility Type': 'Type of Facility', 'Count': 'Number of Facilities'},
+        template='seaborn'
+    )
+
+
+@figure('outsourcers')
+def outsourcer_pie(dataset):
+    outsourcer_count = dataset.aggregates['outsourcer_count']
+    # Label the slices True/False rather than plotly's lowercase booleans
+    outsourcer_count = outsourcer_count.assign(is503B=outsourcer_count['is503B'].astype(str))
+    return px.pie(outsourcer_count,
+                  names='is503B',
+                  values='Count',
+                  title="Is the licensed facility a registered 503B Outsourcer with the FDA?",
+                  labels={'is503B': 'Pharmacy Type', 'Count': 'Count'})
+
+
+@figure('state_heatmap')
+def state_heatmap(dataset):
+    state_counts = dataset.aggregates['state_counts']
+    # Apply a log transformation to the 'Count' column to compress large differences
+    state_counts = state_counts.assign(Log_Count=np.log1p(state_counts['Count']))  # Use log1p to avoid issues with log(0)
+
+    # Create the geographic heat map
+    fig_geo_heatmap = px.choropleth(
+        state_counts,
+        locations='State',  # The column with state names or abbreviations
+        locationmode='USA-states',  # Specify US states as the location mode
+        color='Log_Count',  # Use the log-transformed values for color
+        color_continuous_scale='Blues',  # Choose a color scale
+        scope='usa',  # Limit the map to the USA
+        title='Sterile Compounding Licenses: US Heatmap',
+        labels={'Log_Count': 'Log of Count', 'State': 'State'},
+        hover_name='State',  # Show state name when hovering
+        hover_data={'Log_Count': False, 'Count': True}  # Only show 'Count' on hover, not the log count
+    )
+    # Update layout for better appearance
+    fig_geo_heatmap.update_layout(
+        title={
+            'font': {'size': 16, 'family': 'Arial', 'color': 'darkblue'},
+            'x': 0.5,  # Center the title
+        },
+        geo=dict(
+            showframe=False,  # Hide the frame around the map
+            showcoastlines=True,  # Show coastlines
+            coastlinecolor="LightGray",  # Set the coastline color
+        )
+    )
+    return fig_geo_heatmap
+
+
+@figure('pharmacy_map')
+def pharmacy_map(dataset, zoom=POINT_ZOOM, query=None):
+    # Pharmacies (or, zoomed out, hexagonal bins of them) from the map bins
+    located = dataset.map_bins.get(zoom, query=query)
+    if is_points(located):
+        # Create the geographic scatter plot using LAT and LONG
+        fig_geo_pharmacies = px.scatter_geo(
+            located,
+            lat='LAT',  # Latitude column
+            lon='LONG',  # Longitude column
+            color='Facility Type',  # Color by Facility Type (you can replace this with any other column)
+            hover_name='Pharmacy Name',  # Show pharmacy name on hover
+            hover_data={'LAT': False, 'LONG': False},  # Do not show lat and long on hover
+            title='Pharmacy Locations in California'
+        )
+    else:
+        # One marker per bin, sized by its count and colored by its most
+        # common facility type, with the count of each type on hover
+        type_columns = list(located.columns[4:])
+        fig_geo_pharmacies = px.scatter_geo(
+            located,
+            lat='LAT',
+            lon='LONG',
+            size='Count',
+            size_max=40,
+            color='Top Facility Type',
+            hover_data={'LAT': False, 'LONG': False, 'Count': True, **{column: True for column in type_columns}},
+            title='Pharmacy Locations in California'
+        )
+
+    # Update layout for better appearance with focus on California
+    fig_geo_pharmacies.update_layout(
+        title={
+            'font': {'size': 16, 'family': 'Arial', 'color': 'darkblue'},
+            'x': 0.5,  # Center the title
+        },
+        geo=dict(
+            showframe=False,  # Hide the frame around the map
+            showcoastlines=True,  # Show coastlines
+            coastlinecolor="LightGray",  # Set the coastline color
+            projection_type="albers usa",  # Projection type for the USA
+            center={"lat": 37.5, "lon": -119},  # Center on California (lat, lon for central California)
+            projection_scale=2,  # Zoom level for California (adjust for better focus)
+        ),
+        coloraxis_colorbar=dict(
+            title="Facility Type",  # Color bar title (if using categorical data)
+        )
+    )
+    return fig_geo_pharmacies
+
+
+@figure('expirations')
+def expirations_area(dataset, facility_types):
+    # Counts per Facility Type and month come straight from the precomputed cube
+    expirations_by_type_year_month = dataset.expirations.long_frame(facility_types, exclude_years=EXCLUDED_YEARS)
+
+    # Create the stacked area chart
+    return px.area(
+        expirations_by_type_year_month,
+        x='Date',
+        y='Count',
+        color='Facility Type',
+        title="Pharmacy Expirations Over Time (Stacked by Facility Type)",
+        labels={'Count': 'Number of Expirations', 'Date': 'Date', 'Facility Type': 'Type of Facility'},
+        template='plotly_white'
+    )
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+
+
+def haversine_miles(lat, lon, lats, lons):
+    # Great-circle distance in miles from one point to arrays of points
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (
+        np.sin((lats - lat) / 2) ** 2
+        + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """
+    Grid index over the pharmacy coordinates for radius searches.
+
+    Rows are bucketed into fixed-size lat/long cells and stored sorted by
+    cell, so a search only computes distances for the rows in the cells
+    overlapping the search radius. Rows without coordinates are left out.
+    Also holds a ZIP -> centroid table derived from the rows themselves, so
+    a ZIP can be used as the search center without any external lookup.
+    """
+
+    def __init__(self, lats, lons, zips, cell_degrees=0.5, zip_centroids=None):
+        self.cell_degrees = cell_degrees
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.n_rows = len(self.lats)
+        self._n_lon_cells = int(np.ceil(360 / cell_degrees))
+
+        located = np.flatnonzero(~(np.isnan(self.lats) | np.isnan(self.lons)))
+        keys = self._cell_keys(self.lats[located], self.lons[located])
+        order = np.argsort(keys, kind='stable')
+        self._rows = located[order]
+        self._cells, self._starts, self._sizes = np.unique(
+            keys[order], return_index=True, return_counts=True
+        )
+
+        # Fixed-width strings ('' when missing) rather than one object per row
+        self.zips = pd.Series(zips).astype('string').str[:5].fillna('').to_numpy(dtype='U5')
+        if zip_centroids is None:
+            zip_centroids = _zip_centroids(self.zips, self.lats, self.lons)
+        self.zip_centroids = zip_centroids
+
+    @classmethod
+    def from_frame(cls, pharmacies, cell_degrees=0.5):
+        return cls(
+            pd.to_numeric(pharmacies['LAT'], errors='coerce'),
+            pd.to_numeric(pharmacies['LONG'], errors='coerce'),
+            pharmacies['Zip'],
+            cell_degrees=cell_degrees
+        )
+
+    def updated(self, source, added, retracted, pharmacies):
+        """
+        Index of a refreshed snapshot in which only the `added` rows have
+        new coordinates or ZIPs (`retracted` being the rows of this index
+        they replace or remove). Other rows take theirs from row
+        `source[row]` of this index, and only the centroids of the ZIPs
+        involved are recomputed.
+        """
+        fresh = GeoIndex.from_frame(pharmacies.iloc[added], cell_degrees=self.cell_degrees)
+        lats, lons, zips = self.lats[source], self.lons[source], self.zips[source]
+        lats[added], lons[added], zips[added] = fresh.lats, fresh.lons, fresh.zips
+
+        touched = {zip_code for zip_code in np.concatenate([fresh.zips, self.zips[retracted]]) if zip_code}
+        centroids = {zip_code: centroid for zip_code, centroid in self.zip_centroids.items() if zip_code not in touched}
+        rows = np.flatnonzero(pd.Series(zips).isin(touched).to_numpy())
+        centroids.update(_zip_centroids(zips[rows], lats[rows], lons[rows]))
+        return GeoIndex(lats, lons, zips, cell_degrees=self.cell_degrees, zip_centroids=centroids)
+
+    def _cell_keys(self, lats, lons):
+        lat_cells = np.floor((lats + 90) / self.cell_degrees).astype(np.int64)
+        lon_cells = np.floor((lons + 180) / self.cell_degrees).astype(np.int64) % self._n_lon_cells
+        return lat_cells * self._n_lon_cells + lon_cells
+
+    def _candidates(self, lat, lon, miles):
+        # Rows in every cell overlapping the bounding box of the search circle
+        lat_span = miles / MILES_PER_DEGREE_LAT
+        cos_lat = np.cos(np.radians(min(abs(lat) + lat_span, 89.9)))
+        lon_span = min(miles / (MILES_PER_DEGREE_LAT * cos_lat), 180.0)
+
+        lat_cells = np.arange(
+            np.floor((max(lat - lat_span, -90) + 90) / self.cell_degrees),
+            np.floor((min(lat + lat_span, 90) + 90) / self.cell_degrees) + 1,
+            dtype=np.int64
+        )
+        lon_cells = np.arange(
+            np.floor((lon - lon_span + 180) / self.cell_degrees),
+            np.floor((lon + lon_span + 180) / self.cell_degrees) + 1,
+            dtype=np.int64
+        ) % self._n_lon_cells
+        if len(lat_cells) * len(lon_cells) >= len(self._cells):
+            # The box spans at least as many cells as are occupied; scan them all
+            return self._rows
+
+        keys = np.unique(lat_cells[:, None] * self._n_lon_cells + lon_cells[None, :])
+        positions = np.minimum(np.searchsorted(self._cells, keys), len(self._cells) - 1)
+        found = positions[self._cells[positions] == keys]
+        if not len(found):
+            return self._rows[:0]
+        return np.concatenate([
+            self._rows[start:start + size]
+            for start, size in zip(self._starts[found], self._sizes[found])
+        ])
+
+    def within(self, lat, lon, miles, mask=None):
+        """
+        Rows within `miles` of (lat, lon), nearest first, with their distances.
+        `mask` is an optional boolean mask over every row (e.g. the query
+        engine's) restricting the rows considered.
+        """
+        rows = self._candidates(lat, lon, miles)
+        if mask is not None:
+            rows = rows[mask[rows]]
+        distances = haversine_miles(lat, lon, self.lats[rows], self.lons[rows])
+        inside = distances <= miles
+        rows, distances = rows[inside], distances[inside]
+        order = np.argsort(distances, kind='stable')
+        return rows[order], distances[order]
+
+    def nearest(self, lat, lon, k=10, mask=None):
+        # The `k` closest rows, widening the search radius until enough are found
+        miles = 10.0
+        while True:
+            rows, distances = self.within(lat, lon, miles, mask=mask)
+            if len(rows) >= k or miles >= np.pi * EARTH_RADIUS_MILES:
+                return rows[:k], distances[:k]
+            miles *= 4
+
+    def locate(self, text):
+        """
+        Resolve a ZIP code or a "lat, long" pair to coordinates, or None if it
+        is neither a valid pair nor a ZIP present in the data.
+        """
+        text = (text or '').strip()
+        if ',' in text:
+            try:
+                lat, lon = (float(part) for part in text.split(','))
+            except ValueError:
+                return None
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+            return None
+        return self.zip_centroids.get(text[:5])
+
+
+def _zip_centroids(zips, lats, lons):
+    # Mean coordinates of the rows in each ZIP (already cut to 5 digits)
+    frame = pd.DataFrame({
+        'Zip': zips.astype(object),
+        'LAT': lats,
+        'LONG': lons,
+    }).dropna()
+    frame = frame[frame['Zip'] != '']
+    centroids = frame.groupby('Zip')[['LAT', 'LONG']].mean()
+    return dict(zip(centroids.index, zip(centroids['LAT'], centroids['LONG'])))
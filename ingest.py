@@ -0,0 +1,241 @@
+"""
+Refresh the snapshot from a new raw license export.
+
+The export is matched to the current snapshot on License Number. Columns
+the export has are taken from it; the enrichment columns it lacks (Facility
+Type, Specialties, Conditions, Accreditations, URL, ...) are carried forward
+from the current snapshot, so only new licenses need enriching. Writes the
+refreshed snapshot and a change log of new, removed, renewed, expired,
+status-changed and otherwise updated licenses:
+
+    python ingest.py enriched_pharmacy_data_01032024.csv export.csv --as-of 2024-02-01
+
+A CSV snapshot is written next to the current one, dated by --as-of like
+the original (enriched_pharmacy_data_02012024.csv). A Parquet snapshot
+directory is updated in place, rewriting only the partitions of the states
+with changes. Either is written aside and swapped in, so a running app
+never reads it half written.
+
+An app serving a Parquet directory picks up the refresh on its next rerun.
+An app serving a CSV keeps reading the file PHARMACY_DATA names, so pass
+that path as --publish to replace it with the refreshed snapshot too:
+
+    python ingest.py data/pharmacies.csv export.csv --as-of 2024-02-01 --publish data/pharmacies.csv
+"""
+import argparse
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import schema
+import storage
+from data_loader import read_snapshot, snapshot_version
+from snapshot_diff import KEY_COLUMN, SnapshotDiff
+
+# Columns every export must have
+REQUIRED_COLUMNS = [KEY_COLUMN, 'License Status', 'Expiration Date']
+
+# Carried-forward coordinates no longer hold once the address changes
+GEOCODED_COLUMNS = ['LAT', 'LONG']
+ADDRESS_COLUMNS = ['City', 'State', 'County', 'Zip']
+
+CHANGE_LOG_COLUMNS = [KEY_COLUMN, 'Pharmacy Name', 'Change', 'Column', 'Old', 'New']
+
+
+def merge_export(current, export):
+    """
+    The refreshed snapshot: every license of `export`, with the columns the
+    export lacks carried forward from `current`. Licenses already in the
+    snapshot keep their order and new ones are appended, so unchanged rows
+    stay where they were.
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in export.columns]
+    if missing:
+        raise ValueError(f"The export is missing columns: {', '.join(missing)}")
+    if not export[KEY_COLUMN].is_unique:
+        raise ValueError(f"{KEY_COLUMN} must be unique in the export")
+
+    source = pd.Index(current[KEY_COLUMN]).get_indexer(export[KEY_COLUMN])
+    order = np.argsort(np.where(source >= 0, source, len(current) + np.arange(len(source))), kind='stable')
+    source = source[order]
+    export = export.iloc[order].reset_index(drop=True)
+
+    carried = [column for column in current.columns if column not in export.columns]
+    refreshed = export.reindex(columns=current.columns)
+    matched = source >= 0
+    for column in carried:
+        values = current[column].iloc[np.where(matched, source, 0)].reset_index(drop=True)
+        refreshed[column] = values.where(matched)
+
+    moved = SnapshotDiff(current, refreshed).changed([column for column in ADDRESS_COLUMNS if column in export.columns])
+    for column in GEOCODED_COLUMNS:
+        if column in carried:
+            refreshed.loc[moved, column] = np.nan
+    return refreshed
+
+
+def change_log(current, refreshed, as_of):
+    """
+    One row per change between two snapshots: `new` and `removed`
+    licenses, `renewed` (a later Expiration Date), `expired` (a status
+    starting with EXPIRED, or still listed past its Expiration Date at
+    `as_of`), `status_changed`, and `updated` for any other column.
+    """
+    diff = SnapshotDiff(current, refreshed)
+    as_of = pd.Timestamp(as_of)
+    entries = [
+        _log_entries(refreshed, diff.added, 'new'),
+        _log_entries(current, diff.removed, 'removed'),
+    ]
+
+    for column in refreshed.columns:
+        if column == KEY_COLUMN:
+            continue
+        rows = diff.matched[diff.differs(column)]
+        before = current[column].iloc[diff.source[rows]].reset_index(drop=True)
+        after = refreshed[column].iloc[rows].reset_index(drop=True)
+        if column == 'Expiration Date':
+            change = pd.Series('updated', index=after.index).mask(after > before, 'renewed')
+        elif column == 'License Status':
+            change = pd.Series('status_changed', index=after.index).mask(_expired_status(after), 'expired')
+        else:
+            change = 'updated'
+        entries.append(_log_entries(refreshed, rows, change, column, _loggable(before), _loggable(after)))
+
+    # Still listed past the Expiration Date, with neither a renewal nor an
+    # expired status
+    dates = refreshed['Expiration Date'].to_numpy()[diff.matched]
+    rows = diff.matched[~diff.differs('Expiration Date') & (dates < as_of.to_datetime64())]
+    rows = rows[~_expired_status(refreshed['License Status'].iloc[rows]).to_numpy()]
+    lapsed = _loggable(refreshed['Expiration Date'].iloc[rows])
+    entries.append(_log_entries(refreshed, rows, 'expired', 'Expiration Date', lapsed, lapsed))
+
+    entries = [entry for entry in entries if len(entry)]
+    log = pd.concat(entries, ignore_index=True) if entries else pd.DataFrame()
+    log = log.reindex(columns=CHANGE_LOG_COLUMNS)
+    return log.sort_values([KEY_COLUMN, 'Change'], kind='stable').reset_index(drop=True)
+
+
+def _log_entries(pharmacies, rows, change, column=None, before=None, after=None):
+    entries = pharmacies.iloc[rows, pharmacies.columns.get_indexer([KEY_COLUMN, 'Pharmacy Name'])]
+    entries = entries.reset_index(drop=True).assign(Change=change)
+    if column is None:
+        return entries
+    return entries.assign(Column=column, Old=before, New=after)
+
+
+def _loggable(values):
+    # Values as written to the change log: dates without a time, and numbers
+    # as the shortest text that reads back at their own precision (a
+    # float32 printed as a float64 would show noise digits)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        values = values.dt.strftime('%Y-%m-%d')
+    elif pd.api.types.is_float_dtype(values):
+        values = pd.Series(
+            [None if np.isnan(value) else np.format_float_positional(value, trim='-') for value in values.to_numpy()],
+            index=values.index, dtype=object,
+        )
+    return values.reset_index(drop=True)
+
+
+def _expired_status(status):
+    return status.str.upper().str.startswith('EXPIRED', na=False)
+
+
+def changed_states(current, refreshed):
+    # States whose partition differs between the two snapshots
+    diff = SnapshotDiff(current, refreshed)
+    added, retracted = diff.delta(list(refreshed.columns))
+    return set(refreshed['State'].iloc[added].dropna()) | set(current['State'].iloc[retracted].dropna())
+
+
+def write_refreshed(current_path, current, refreshed, output):
+    """
+    Write the refreshed snapshot to `output`: a CSV file, or a Parquet
+    directory in which only the partitions of changed states are rewritten.
+    Either is written next to `output` and then swapped in, so an app
+    serving it never reads a partly written snapshot.
+    """
+    if not os.path.isdir(current_path):
+        storage.replace_path(output, lambda path: refreshed.to_csv(path, index=False, date_format='%Y-%m-%d'))
+        return
+    states = changed_states(current, refreshed)
+    remaining = set(refreshed['State'].dropna())
+
+    def write(directory):
+        # The partitions of unchanged states are hard links to the current
+        # files, so only the changed states are written
+        shutil.copytree(current_path, directory, copy_function=os.link)
+        for state in states:
+            shutil.rmtree(os.path.join(directory, f'{storage.PARTITION_COLUMN}={state}'), ignore_errors=True)
+        if states & remaining:
+            storage.write_snapshot(refreshed[refreshed['State'].isin(states & remaining)], directory)
+
+    storage.replace_path(output, write)
+
+
+def publish(output, served):
+    # Replace the snapshot an app serves with the refreshed one at `output`
+    if os.path.abspath(output) == os.path.abspath(served):
+        return
+    if os.path.isdir(output):
+        storage.replace_path(served, lambda path: shutil.copytree(output, path, copy_function=os.link))
+    else:
+        storage.replace_path(served, lambda path: shutil.copyfile(output, path))
+
+
+def default_output(current_path, as_of):
+    # The current location for a Parquet directory; otherwise a CSV dated
+    # like the original (MMDDYYYY)
+    if os.path.isdir(current_path):
+        return current_path
+    directory = os.path.dirname(os.path.abspath(current_path))
+    return os.path.join(directory, f"enriched_pharmacy_data_{as_of.strftime('%m%d%Y')}.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the snapshot from a raw license export.")
+    parser.add_argument('current', help="Current snapshot (CSV or Parquet directory)")
+    parser.add_argument('export', help="Raw license export CSV")
+    parser.add_argument('--as-of', default=None, help="Date of the export (default: today)")
+    parser.add_argument('--output', help="Refreshed snapshot (default: see above)")
+    parser.add_argument('--changes', help="Change log CSV (default: changes_<MMDDYYYY>.csv next to the snapshot)")
+    parser.add_argument('--publish', metavar='PATH',
+                        help="Also replace PATH, the snapshot a running app serves, with the refreshed one")
+    args = parser.parse_args()
+
+    as_of = pd.Timestamp(args.as_of) if args.as_of else pd.Timestamp.today().normalize()
+    # Read with the stored types, so carried-forward coordinates are written
+    # back at full precision
+    current = read_snapshot(args.current, kinds=schema.STORED_SCHEMA)
+    export, problems = schema.conform(pd.read_csv(args.export, dtype=str, encoding='utf-8'), schema.STORED_SCHEMA)
+    if len(problems):
+        print(f"{len(problems)} values in the export do not conform to the schema and were left empty:")
+        print(problems.to_string(index=False))
+
+    refreshed = merge_export(current, export)
+    log = change_log(current, refreshed, as_of)
+    output = args.output or default_output(args.current, as_of)
+    write_refreshed(args.current, current, refreshed, output)
+
+    changes = args.changes or os.path.join(
+        os.path.dirname(os.path.abspath(output.rstrip(os.sep))), f"changes_{as_of.strftime('%m%d%Y')}.csv"
+    )
+    log.to_csv(changes, index=False, date_format='%Y-%m-%d')
+
+    version = snapshot_version(output)
+    summary = ', '.join(f'{count} {change}' for change, count in log['Change'].value_counts().items())
+    print(f"Wrote {len(refreshed)} licenses to {output} (version {version[:12]}): {summary or 'no changes'}")
+    print(f"Change log: {changes}")
+    if args.publish:
+        publish(output, args.publish)
+        print(f"Published to {args.publish}")
+    missing = refreshed['Facility Type'].isna().sum() if 'Facility Type' in refreshed else 0
+    if missing:
+        print(f"{missing} licenses have no Facility Type yet and need enriching")
+
+
+if __name__ == '__main__':
+    main()
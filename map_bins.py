@@ -0,0 +1,148 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+
+# Hexagon size (degrees from center to corner) at zoom 0; every zoom level
+# halves it, roughly following web map zoom levels
+BASE_HEX_DEGREES = 45.0
+MAX_BIN_ZOOM = 9
+# From this zoom on individual pharmacies are returned instead of bins, as
+# long as there are at most MAX_POINTS of them in view
+POINT_ZOOM = 10
+MAX_POINTS = 2000
+
+# Columns of each pharmacy returned at point zoom
+POINT_COLUMNS = ['Pharmacy Name', 'License Number', 'Facility Type', 'City', 'LAT', 'LONG']
+
+UNKNOWN_FACILITY = 'Unknown'
+
+_SQRT3 = np.sqrt(3.0)
+# Offset keeping axial hex coordinates positive when packed into one key
+_OFFSET = 1 << 24
+
+
+class MapBins:
+    """
+    Pharmacy locations aggregated into hexagonal bins per zoom level.
+
+    The bin of every row is computed once per zoom level and kept, so
+    mapping any subset of rows (a search, a viewport) is a count over
+    integer keys. Results are memoized per zoom, query and viewport, and
+    since the bins belong to a Dataset, a new snapshot version starts empty.
+    """
+
+    def __init__(self, dataset, cache_size=256):
+        self.dataset = dataset
+        self.lats = dataset.geo_index.lats
+        self.lons = dataset.geo_index.lons
+        self._located = ~(np.isnan(self.lats) | np.isnan(self.lons))
+        codes, uniques = pd.factorize(dataset.pharmacies['Facility Type'])
+        self.facility_types = list(uniques) + [UNKNOWN_FACILITY]
+        self._facility_codes = np.where(codes < 0, len(uniques), codes)
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+
+    def hex_keys(self, zoom):
+        # Bin of every row at `zoom` (rows without coordinates get -1)
+        zoom = min(zoom, MAX_BIN_ZOOM)
+        if zoom not in self._keys:
+            with self._lock:
+                if zoom not in self._keys:
+                    keys = np.full(len(self.lats), -1, dtype=np.int64)
+                    located = self._located
+                    keys[located] = _hex_keys(self.lats[located], self.lons[located], _hex_size(zoom))
+                    self._keys[zoom] = keys
+        return self._keys[zoom]
+
+    def get(self, zoom, query=None, bbox=None):
+        """
+        The map at `zoom`: a frame of pharmacies (POINT_COLUMNS) when zoomed
+        in to POINT_ZOOM with few enough in view, otherwise one row per
+        hexagon with its center (LAT, LONG), its Count, the count of each
+        facility type and its most common (Top Facility Type).
+
+        `query` restricts the map to the rows of a PharmacyQuery and `bbox`
+        (south, west, north, east) to a viewport.
+        """
+        bbox = None if bbox is None else tuple(round(float(value), 4) for value in bbox)
+        key = (zoom, query, bbox)
+        return self._cache.get_or_compute(key, lambda: self._compute(zoom, query, bbox))
+
+    def _rows(self, query, bbox):
+        if query is None:
+            visible = self._located.copy()
+        else:
+            visible = np.zeros(len(self.lats), dtype=bool)
+            visible[self.dataset.engine.run(query)] = True
+            visible &= self._located
+        if bbox is not None:
+            south, west, north, east = bbox
+            visible &= (self.lats >= south) & (self.lats <= north)
+            if west <= east:
+                visible &= (self.lons >= west) & (self.lons <= east)
+            else:
+                # The viewport crosses the antimeridian
+                visible &= (self.lons >= west) | (self.lons <= east)
+        return np.flatnonzero(visible)
+
+    def _compute(self, zoom, query, bbox):
+        rows = self._rows(query, bbox)
+        if zoom >= POINT_ZOOM and len(rows) <= MAX_POINTS:
+            points = self.dataset.engine.materialize(rows, POINT_COLUMNS[:-2])
+            return points.assign(LAT=self.lats[rows], LONG=self.lons[rows])
+
+        n_types = len(self.facility_types)
+        combined = self.hex_keys(zoom)[rows] * n_types + self._facility_codes[rows]
+        pairs, counts = np.unique(combined, return_counts=True)
+        hexes, inverse = np.unique(pairs // n_types, return_inverse=True)
+        matrix = np.zeros((len(hexes), n_types), dtype=np.int64)
+        matrix[inverse, pairs % n_types] = counts
+
+        lats, lons = _hex_centers(hexes, _hex_size(min(zoom, MAX_BIN_ZOOM)))
+        present = matrix.sum(axis=0) > 0
+        bins = pd.DataFrame({
+            'LAT': lats,
+            'LONG': lons,
+            'Count': matrix.sum(axis=1),
+            'Top Facility Type': np.array(self.facility_types, dtype=object)[matrix.argmax(axis=1)],
+        })
+        by_type = pd.DataFrame(matrix[:, present], columns=[name for name, kept in zip(self.facility_types, present) if kept])
+        return pd.concat([bins, by_type], axis=1)
+
+
+def is_points(frame):
+    # Whether a MapBins result holds pharmacies rather than bins
+    return 'Count' not in frame.columns
+
+
+def _hex_size(zoom):
+    return BASE_HEX_DEGREES / 2 ** zoom
+
+
+def _hex_keys(lats, lons, size):
+    # Pointy-top axial coordinates of the hexagon containing each point,
+    # packed into one integer
+    q = (_SQRT3 / 3 * lons - lats / 3) / size
+    r = (2 / 3 * lats) / size
+    # Round in cube coordinates, fixing the component with the largest error
+    x, z = q, r
+    y = -x - z
+    rx, ry, rz = np.round(x), np.round(y), np.round(z)
+    dx, dy, dz = np.abs(rx - x), np.abs(ry - y), np.abs(rz - z)
+    fix_x = (dx > dy) & (dx > dz)
+    fix_z = ~fix_x & (dz >= dy)
+    rx = np.where(fix_x, -ry - rz, rx)
+    rz = np.where(fix_z, -rx - ry, rz)
+    return (rx.astype(np.int64) + _OFFSET) * (2 * _OFFSET) + (rz.astype(np.int64) + _OFFSET)
+
+
+def _hex_centers(keys, size):
+    q = keys // (2 * _OFFSET) - _OFFSET
+    r = keys % (2 * _OFFSET) - _OFFSET
+    lons = size * _SQRT3 * (q + r / 2)
+    lats = size * 1.5 * r
+    return lats, lons
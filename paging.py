@@ -0,0 +1,30 @@
+PAGE_SIZES = (25, 50, 100, 250)
+
+# Rows materialized at a time while writing a CSV export
+EXPORT_CHUNK_ROWS = 10_000
+
+
+def page_count(total, page_size):
+    return max(1, -(-total // page_size))
+
+
+def page_rows(rows, page, page_size):
+    # The row positions shown on `page` (counted from 1)
+    start = (page - 1) * page_size
+    return rows[start:start + page_size]
+
+
+def iter_csv_chunks(engine, rows, columns, extra_columns=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yield the CSV of `rows` x `columns` piece by piece.
+
+    Only `chunk_rows` rows are materialized at a time, so the full result is
+    never built as a frame next to its CSV text. `extra_columns` maps names
+    of computed columns (e.g. distances) to arrays aligned with `rows`; they
+    are placed first, as in the results table.
+    """
+    for start in range(0, max(len(rows), 1), chunk_rows):
+        chunk = engine.materialize(rows[start:start + chunk_rows], columns)
+        for position, (name, values) in enumerate((extra_columns or {}).items()):
+            chunk.insert(position, name, values[start:start + chunk_rows])
+        yield chunk.to_csv(index=False, header=start == 0)
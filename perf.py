@@ -0,0 +1,180 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+# Write every span as a JSON log line when set
+LOG_ENABLED = os.environ.get('PHARMACY_PERF_LOG', '') not in ('', '0')
+# Show the diagnostics panel to every session when set (otherwise opt in
+# per session with the ?diagnostics=1 query parameter)
+PANEL_ENABLED = os.environ.get('PHARMACY_DIAGNOSTICS', '') not in ('', '0')
+
+logger = logging.getLogger('pharmacy.perf')
+if LOG_ENABLED and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Recorder of the rerun running in the current thread/context, if any
+_current = contextvars.ContextVar('pharmacy_perf_recorder', default=None)
+
+# Per-process totals: span name -> {'count', 'total_seconds', 'max_seconds'}
+_process_stats = {}
+_process_lock = threading.Lock()
+
+
+def rss_bytes():
+    # Resident memory of this process (0 where /proc is unavailable)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class Span:
+    """
+    One timed stage of a rerun. Use through `span()`; extra fields such as
+    the number of rows produced can be attached with `set()` while it runs.
+    """
+    __slots__ = ('name', 'fields', '_recorder', '_start', '_rss_start')
+
+    def __init__(self, name, recorder, fields):
+        self.name = name
+        self.fields = fields
+        self._recorder = recorder
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self._rss_start = rss_bytes()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        self._recorder.record(self.name, seconds, rss_bytes() - self._rss_start, self.fields)
+        return False
+
+
+class _NullSpan:
+    # Shared stand-in used when nothing is recording
+    __slots__ = ()
+
+    def set(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **fields):
+    """
+    Time the enclosed block as `name` in the current rerun. When no rerun is
+    being recorded this returns a shared no-op, so instrumented code costs a
+    context-variable lookup.
+    """
+    recorder = _current.get()
+    if recorder is None:
+        return _NULL_SPAN
+    return Span(name, recorder, fields)
+
+
+def recording():
+    # Whether spans are being recorded here, to skip work done only for them
+    return _current.get() is not None
+
+
+class RerunRecorder:
+    """
+    Collects the spans of one script rerun and folds them into the session
+    and process totals.
+    """
+
+    def __init__(self, session_stats, session_id):
+        self.spans = []
+        self.session_stats = session_stats
+        self.session_id = session_id
+        self._start = time.perf_counter()
+        self._token = None
+
+    def record(self, name, seconds, rss_delta, fields):
+        entry = {'span': name, 'seconds': seconds, 'rss_delta_bytes': rss_delta, **fields}
+        self.spans.append(entry)
+        _accumulate(self.session_stats, name, seconds)
+        with _process_lock:
+            _accumulate(_process_stats, name, seconds)
+        if LOG_ENABLED:
+            logger.info(json.dumps({'event': 'perf_span', 'session': self.session_id, **entry}, default=str))
+
+    def finish(self):
+        # Record the whole rerun and stop collecting in this context
+        self.record('rerun', time.perf_counter() - self._start, 0, {})
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+
+def begin_rerun(session_state, enabled):
+    """
+    Start recording the current rerun if `enabled` (the panel is shown) or
+    JSON logging is on; returns the recorder, or None when nothing records.
+    Session totals are kept in `session_state`.
+    """
+    if not (enabled or LOG_ENABLED):
+        # Drop any recorder left behind by a rerun that stopped early
+        _current.set(None)
+        return None
+    session_stats = session_state.setdefault('_perf_stats', {})
+    session_id = session_state.setdefault('_perf_session_id', uuid.uuid4().hex[:12])
+    recorder = RerunRecorder(session_stats, session_id)
+    recorder._token = _current.set(recorder)
+    return recorder
+
+
+def process_stats():
+    with _process_lock:
+        return {name: dict(stats) for name, stats in _process_stats.items()}
+
+
+def stats_frame(stats):
+    # Totals as rows of span, count, total/mean/max milliseconds
+    rows = [
+        {
+            'span': name,
+            'count': entry['count'],
+            'total_ms': entry['total_seconds'] * 1000,
+            'mean_ms': entry['total_seconds'] * 1000 / entry['count'],
+            'max_ms': entry['max_seconds'] * 1000,
+        }
+        for name, entry in stats.items()
+    ]
+    return pd.DataFrame(rows, columns=['span', 'count', 'total_ms', 'mean_ms', 'max_ms']).sort_values(
+        'total_ms', ascending=False
+    )
+
+
+def _accumulate(stats, name, seconds):
+    entry = stats.get(name)
+    if entry is None:
+        stats[name] = {'count': 1, 'total_seconds': seconds, 'max_seconds': seconds}
+    else:
+        entry['count'] += 1
+        entry['total_seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
@@ -0,0 +1,167 @@
+from dataclasses import dataclass, fields
+
+import numpy as np
+import pandas as pd
+
+import perf
+from cache import LRUCache
+from text_index import tokenize
+
+# Columns shown in the Search tab results table
+SEARCH_COLUMNS = [
+    'Pharmacy Name',
+    'License Number',
+    'License Type',
+    'Expiration Date',
+    'City',
+    'State',
+    'County',
+    'Zip',
+    'Facility Type',
+    'Specialties',
+    'Conditions',
+    'Registered Outsourcer',
+    'Accreditations',
+    'URL',
+]
+
+PHARMACY_TYPES = ('503A', '503B')
+
+
+@dataclass(frozen=True)
+class PharmacyQuery:
+    """
+    The sidebar search as a hashable value.
+
+    Every field is a collection of selected values; an empty selection does
+    not restrict the search. Values are sorted and de-duplicated on creation
+    so equivalent selections share one cache entry.
+    """
+    pharmacy_types: tuple = ()
+    facility_types: tuple = ()
+    cities: tuple = ()
+    specialties: tuple = ()
+    conditions: tuple = ()
+    accreditations: tuple = ()
+    # Free-text search over name, license number, city and county
+    text: str = ''
+
+    def __post_init__(self):
+        # Only the words of the text matter to the search
+        object.__setattr__(self, 'text', ' '.join(tokenize(self.text or '')))
+        for field in fields(self):
+            if field.name == 'text':
+                continue
+            value = getattr(self, field.name)
+            if value is None:
+                value = ()
+            elif isinstance(value, str):
+                value = (value,)
+            object.__setattr__(self, field.name, tuple(sorted(set(value))))
+
+
+class PharmacyQueryEngine:
+    """
+    Answers PharmacyQuery objects with the matching row positions.
+
+    Every predicate is a precomputed boolean mask (or a lookup into one), so a
+    query is a few vectorized ANDs over the full dataset and never copies the
+    frame. Recent results are kept in an LRU cache.
+    """
+
+    def __init__(self, dataset, cache_size=256):
+        self.dataset = dataset
+        pharmacies = dataset.pharmacies
+        self.n_rows = len(pharmacies)
+
+        # 503A pharmacies are the ones not registered as an FDA outsourcer
+        # (a missing flag matches neither)
+        outsourcer = pharmacies['Registered Outsourcer']
+        self._pharmacy_type_masks = {
+            '503A': outsourcer.eq(False).to_numpy(dtype=bool, na_value=False),
+            '503B': outsourcer.eq(True).to_numpy(dtype=bool, na_value=False),
+        }
+        self._facility_codes, self._facility_lookup = _factorize(pharmacies['Facility Type'])
+        self._city_codes, self._city_lookup = _factorize(pharmacies['City'])
+        self._cache = LRUCache(cache_size)
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def mask(self, query):
+        # Boolean mask over every row of the dataset
+        mask = self._filter_mask(query)
+        if query.text:
+            matched = np.zeros(self.n_rows, dtype=bool)
+            matched[self._search_text(query, mask)] = True
+            mask = matched
+        return mask
+
+    def _filter_mask(self, query):
+        # Every predicate that restricts the search is its own span
+        mask = np.ones(self.n_rows, dtype=bool)
+
+        # Selecting both pharmacy types (or neither) does not filter
+        if len(query.pharmacy_types) == 1:
+            _narrow(mask, 'pharmacy_type', lambda: self._pharmacy_type_masks[query.pharmacy_types[0]])
+        if query.facility_types:
+            _narrow(mask, 'facility_type', lambda: _codes_mask(self._facility_codes, self._facility_lookup, query.facility_types))
+        if query.cities:
+            _narrow(mask, 'city', lambda: _codes_mask(self._city_codes, self._city_lookup, query.cities))
+        if query.specialties:
+            _narrow(mask, 'specialty', lambda: self.dataset.specialty_index.match_all(query.specialties))
+        if query.conditions:
+            _narrow(mask, 'condition', lambda: self.dataset.condition_index.match_all(query.conditions))
+        if query.accreditations:
+            _narrow(mask, 'accreditation', lambda: self.dataset.accreditation_index.match_all(query.accreditations))
+        return mask
+
+    def _search_text(self, query, mask):
+        with perf.span('filter.text') as span:
+            rows = self.dataset.text_index.search(query.text, mask=mask)
+            span.set(rows=len(rows))
+        return rows
+
+    def run(self, query):
+        """
+        Row positions matching `query`, in row order, or best text match
+        first when the query has text. The array is shared and read-only.
+        """
+        return self._cache.get_or_compute(query, lambda: _freeze(self._rows(query)))
+
+    def _rows(self, query):
+        if query.text:
+            return self._search_text(query, self._filter_mask(query))
+        return np.flatnonzero(self._filter_mask(query))
+
+    def materialize(self, rows, columns=SEARCH_COLUMNS):
+        # Build a frame of only `rows` x `columns`, taking nothing else
+        pharmacies = self.dataset.pharmacies
+        return pharmacies.iloc[rows, pharmacies.columns.get_indexer(columns)]
+
+
+def _factorize(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # The codes a categorical already has
+        return column.cat.codes.to_numpy(), {value: code for code, value in enumerate(column.cat.categories)}
+    codes, uniques = pd.factorize(column)
+    return codes, {value: code for code, value in enumerate(uniques)}
+
+
+def _narrow(mask, name, predicate):
+    # mask &= predicate(), timed as filter.<name> with the rows left after it
+    with perf.span(f'filter.{name}') as span:
+        mask &= predicate()
+        if perf.recording():
+            span.set(rows=int(np.count_nonzero(mask)))
+
+
+def _codes_mask(codes, lookup, values):
+    wanted = [lookup[value] for value in values if value in lookup]
+    return np.isin(codes, wanted)
+
+
+def _freeze(array):
+    array.flags.writeable = False
+    return array
@@ -0,0 +1,185 @@
+"""
+In-memory column types of a snapshot, applied and checked at load.
+
+The CSV is read as strings; `conform()` converts each column to its declared
+kind (low-cardinality columns as categoricals, coordinates as float32, the
+flag columns as nullable booleans, Expiration Date as a date) and reports
+every value it could not convert instead of letting it fail quietly in a
+filter. Print the problems and a memory comparison of the two
+representations with:
+
+    python schema.py enriched_pharmacy_data_01032024.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Column -> kind: 'text' (Arrow strings, for the mostly unique columns),
+# 'category', 'float32'/'float64', 'boolean' (nullable) or 'date'. The multi-valued
+# term columns repeat a few combinations, so they are categoricals too.
+FRAME_SCHEMA = {
+    'Pharmacy Name': 'text',
+    'License Number': 'text',
+    'License Type': 'category',
+    'License Status': 'category',
+    'Expiration Date': 'date',
+    'City': 'category',
+    'State': 'category',
+    'County': 'category',
+    'Zip': 'category',
+    'LAT': 'float32',
+    'LONG': 'float32',
+    'isGovernment': 'boolean',
+    'isSatellite': 'boolean',
+    'Facility Type': 'category',
+    'Specialties': 'category',
+    'Conditions': 'category',
+    'Registered Outsourcer': 'boolean',
+    'Accreditations': 'category',
+    'URL': 'text',
+}
+
+# The kinds kept when a snapshot is read to be written back (ingest.py):
+# full-precision coordinates, so a refresh leaves them as stored
+STORED_SCHEMA = {**FRAME_SCHEMA, 'LAT': 'float64', 'LONG': 'float64'}
+
+# Valid range of each float column; values outside it are malformed
+VALUE_RANGES = {'LAT': (-90.0, 90.0), 'LONG': (-180.0, 180.0)}
+
+BOOLEAN_VALUES = {'true': True, 'false': False}
+
+# Checked but kept as they are
+ZIP_PATTERN = r'\d{5}(-\d{4})?'
+
+PROBLEM_COLUMNS = ['Row', 'License Number', 'Column', 'Value', 'Problem']
+
+
+def conform(pharmacies, kinds=FRAME_SCHEMA):
+    """
+    (typed frame, problems): `pharmacies` with every column of `kinds`
+    it has converted to its kind, and one row per malformed value (which is
+    left missing in the typed frame), missing or duplicate License Number,
+    or ZIP code that is not 5 or 5+4 digits.
+    """
+    typed = {}
+    problems = []
+    for column in pharmacies.columns:
+        values = pharmacies[column]
+        kind = kinds.get(column)
+        if kind is None:
+            typed[column] = values
+            continue
+        convert, problem = _CONVERTERS[kind]
+        converted = convert(values, column)
+        if problem is not None:
+            malformed = pd.notna(values).to_numpy() & pd.isna(converted).to_numpy()
+            problems.append(_problems(pharmacies, malformed, column, problem))
+        typed[column] = converted
+    typed = pd.DataFrame(typed, index=pharmacies.index)
+
+    if 'License Number' in pharmacies.columns:
+        licenses = pharmacies['License Number']
+        problems.append(_problems(pharmacies, licenses.isna().to_numpy(), 'License Number', 'missing'))
+        duplicated = licenses.duplicated(keep=False) & licenses.notna()
+        problems.append(_problems(pharmacies, duplicated.to_numpy(), 'License Number', 'duplicate'))
+    if 'Zip' in pharmacies.columns:
+        zips = pharmacies['Zip'].astype('string[pyarrow]')
+        malformed = zips.notna() & ~zips.str.fullmatch(ZIP_PATTERN).fillna(False)
+        problems.append(_problems(pharmacies, malformed.to_numpy(dtype=bool), 'Zip', 'not a ZIP code'))
+
+    problems = [problem for problem in problems if len(problem)]
+    problems = pd.concat(problems, ignore_index=True) if problems else pd.DataFrame(columns=PROBLEM_COLUMNS)
+    return typed, problems.sort_values(['Row', 'Column'], kind='stable').reset_index(drop=True)
+
+
+def _to_text(values, column):
+    return values.astype('string[pyarrow]')
+
+
+def _to_category(values, column):
+    return values.astype('category')
+
+
+def _to_float32(values, column):
+    return _to_float64(values, column).astype('float32')
+
+
+def _to_float64(values, column):
+    numbers = pd.to_numeric(values, errors='coerce')
+    low, high = VALUE_RANGES.get(column, (-np.inf, np.inf))
+    return numbers.where(numbers.between(low, high)).astype('float64')
+
+
+def _to_boolean(values, column):
+    text = values.astype('string').str.strip().str.lower()
+    return text.map(BOOLEAN_VALUES).astype('boolean')
+
+
+def _to_date(values, column):
+    return pd.to_datetime(values, errors='coerce').dt.normalize()
+
+
+# Kind -> (converter, problem reported for values it leaves missing)
+_CONVERTERS = {
+    'text': (_to_text, None),
+    'category': (_to_category, None),
+    'float32': (_to_float32, 'not a number in range'),
+    'float64': (_to_float64, 'not a number in range'),
+    'boolean': (_to_boolean, 'not True or False'),
+    'date': (_to_date, 'not a date'),
+}
+
+
+def _problems(pharmacies, malformed, column, problem):
+    rows = np.flatnonzero(malformed)
+    return pd.DataFrame({
+        'Row': rows,
+        'License Number': pharmacies['License Number'].iloc[rows].to_numpy() if 'License Number' in pharmacies else None,
+        'Column': column,
+        'Value': pharmacies[column].iloc[rows].astype(object).to_numpy(),
+        'Problem': problem,
+    })
+
+
+def memory_report(before, after):
+    """
+    Deep memory use in bytes of each column of two representations of the
+    same snapshot, with the total and how many times smaller `after` is.
+    """
+    report = pd.DataFrame({
+        'Before': before.memory_usage(index=False, deep=True),
+        'After': after.memory_usage(index=False, deep=True),
+    })
+    report.loc['Total'] = report.sum()
+    report['Before dtype'] = before.dtypes.astype(str)
+    report['After dtype'] = after.dtypes.astype(str)
+    report['Ratio'] = (report['Before'] / report['After']).round(1)
+    return report.rename_axis('Column')
+
+
+def main():
+    from data_loader import read_raw_snapshot
+    from storage import BOOLEAN_COLUMNS
+
+    parser = argparse.ArgumentParser(description="Check a snapshot against the schema and compare its memory use.")
+    parser.add_argument('path', help="Snapshot CSV or Parquet directory")
+    args = parser.parse_args()
+
+    raw = read_raw_snapshot(args.path)
+    # The representation the app used before: strings, with parsed dates
+    before = raw.assign(**{'Expiration Date': pd.to_datetime(raw['Expiration Date'], errors='coerce')})
+    for column in BOOLEAN_COLUMNS:
+        before[column] = before[column].map({True: "True", False: "False", "True": "True", "False": "False"})
+    typed, problems = conform(raw)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_rows', None):
+        print(f"{len(problems)} problems in {len(raw)} rows")
+        if len(problems):
+            print(problems.to_string(index=False))
+        print()
+        print(memory_report(before, typed))
+
+
+if __name__ == '__main__':
+    main()
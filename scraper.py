@@ -0,0 +1,427 @@
+"""
+Look up licenses on the Board of Pharmacy license search and write them as
+a raw license export for ingest.py:
+
+    python scraper.py enriched_pharmacy_data_01032024.csv export.csv --workers 8 --rate 4
+    python ingest.py enriched_pharmacy_data_01032024.csv export.csv
+
+Every License Number of the snapshot (or each --license) is looked up from
+a pool of threads sharing one rate limit and one pool of kept-alive
+connections. Lookups that time out or get a 429/5xx are retried with
+exponential backoff. Result pages are parsed into the export columns, in
+the snapshot's conventions: ISO dates, state abbreviations, and no
+OUT OF STATE county.
+
+Each finished lookup is appended to a checkpoint file next to the output,
+so a run that is interrupted, or that has failed lookups, continues where
+it stopped when run again. No export is written when lookups failed, when
+none found a license, or when more than --max-missing of the licenses are
+not listed. The checkpoint is removed once the export is written. Lookups only cover licenses the snapshot already has; new licenses
+still come from a full search export.
+
+To run it offline, serve recorded pages (saved with --record) with
+benchmarks/recorded_site.py and point --url at it.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+from urllib.parse import quote
+
+import pandas as pd
+import requests
+import tenacity
+from requests.adapters import HTTPAdapter
+
+import schema
+
+logger = logging.getLogger('pharmacy.scraper')
+
+# License lookup on the DCA license search (the Board of Pharmacy is board
+# 7200); {license} is replaced by the URL-encoded license number
+LOOKUP_URL = 'https://search.dca.ca.gov/results?BD=7200&licenseNumber={license}'
+USER_AGENT = 'california-pharmacy-license-dashboard'
+
+DEFAULT_WORKERS = 8
+# Requests per second across all workers
+DEFAULT_RATE = 4.0
+DEFAULT_ATTEMPTS = 5
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 30)
+# Statuses worth retrying; any other error status fails the lookup at once
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_BACKOFF = 60
+
+CHECKPOINT_SUFFIX = '.checkpoint.jsonl'
+
+# Share of licenses that may come back not listed before the export is
+# refused; more than that points at a changed site or a wrong --url rather
+# than at removed licenses
+MAX_MISSING_SHARE = 0.1
+
+# The columns of a raw license export, as in the snapshot
+EXPORT_COLUMNS = [
+    'Pharmacy Name', 'License Number', 'License Type', 'License Status', 'Expiration Date',
+    'City', 'State', 'County', 'Zip',
+]
+# Expiration dates on the search, e.g. "July 1, 2025"
+PAGE_DATE_FORMAT = '%B %d, %Y'
+OUT_OF_STATE = 'OUT OF STATE'
+
+STATE_ABBREVIATIONS = {
+    'Alabama': 'AL', 'Alaska': 'AK', 'Arizona': 'AZ', 'Arkansas': 'AR', 'California': 'CA',
+    'Colorado': 'CO', 'Connecticut': 'CT', 'Delaware': 'DE', 'District of Columbia': 'DC', 'Florida': 'FL',
+    'Georgia': 'GA', 'Hawaii': 'HI', 'Idaho': 'ID', 'Illinois': 'IL', 'Indiana': 'IN',
+    'Iowa': 'IA', 'Kansas': 'KS', 'Kentucky': 'KY', 'Louisiana': 'LA', 'Maine': 'ME',
+    'Maryland': 'MD', 'Massachusetts': 'MA', 'Michigan': 'MI', 'Minnesota': 'MN', 'Mississippi': 'MS',
+    'Missouri': 'MO', 'Montana': 'MT', 'Nebraska': 'NE', 'Nevada': 'NV', 'New Hampshire': 'NH',
+    'New Jersey': 'NJ', 'New Mexico': 'NM', 'New York': 'NY', 'North Carolina': 'NC', 'North Dakota': 'ND',
+    'Ohio': 'OH', 'Oklahoma': 'OK', 'Oregon': 'OR', 'Pennsylvania': 'PA', 'Puerto Rico': 'PR',
+    'Rhode Island': 'RI', 'South Carolina': 'SC', 'South Dakota': 'SD', 'Tennessee': 'TN', 'Texas': 'TX',
+    'Utah': 'UT', 'Vermont': 'VT', 'Virginia': 'VA', 'Washington': 'WA', 'West Virginia': 'WV',
+    'Wisconsin': 'WI', 'Wyoming': 'WY',
+}
+
+
+class RetryableStatus(Exception):
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} from {response.url}")
+        retry_after = response.headers.get('Retry-After', '')
+        self.retry_after = float(retry_after) if retry_after.isdigit() else None
+
+
+class ExportRefused(Exception):
+    """
+    The lookups would make a misleading export. `licenses` maps each
+    affected license to what went wrong with it.
+    """
+
+    def __init__(self, message, licenses):
+        super().__init__(message)
+        self.licenses = licenses
+
+
+class RateLimiter:
+    """
+    Token bucket shared by threads: at most `rate` acquisitions per second
+    on average, with bursts of up to `burst`. A rate of 0 or less never waits.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take a token now even if it is not there yet, and sleep until
+            # it would have been; later callers queue up behind
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ResultPageParser(HTMLParser):
+    """
+    The licenses listed on a result page of the license search. Each is a
+    <ul class="actions"> with the name in an <h3> and one 'Key: value' <li>
+    per field.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        # Nesting depth inside the current ul.actions (0 outside one)
+        self._depth = 0
+        self._item = None
+        self._heading = None
+
+    def handle_starttag(self, tag, attrs):
+        if not self._depth:
+            if tag == 'ul' and 'actions' in (dict(attrs).get('class') or '').split():
+                self._depth = 1
+                self.records.append({})
+        elif tag == 'ul':
+            self._depth += 1
+        elif tag == 'li':
+            self._item = []
+        elif tag == 'h3':
+            self._heading = []
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        if tag == 'h3' and self._heading is not None:
+            self.records[-1]['Pharmacy Name'] = _clean(''.join(self._heading))
+            self._heading = None
+            # The name's <li> holds no field
+            self._item = None
+        elif tag == 'li' and self._item is not None:
+            key, _, value = _clean(''.join(self._item)).partition(':')
+            if value:
+                self.records[-1][key.strip()] = value.strip()
+            self._item = None
+        elif tag == 'ul':
+            self._depth -= 1
+
+    def handle_data(self, data):
+        if self._heading is not None:
+            self._heading.append(data)
+        elif self._item is not None:
+            self._item.append(data)
+
+
+def _clean(text):
+    return ' '.join(text.split())
+
+
+def parse_result_page(html, license_number):
+    # The fields of `license_number` on a result page, or None if not listed
+    parser = ResultPageParser()
+    parser.feed(html)
+    parser.close()
+    wanted = _clean(license_number).upper()
+    for record in parser.records:
+        if _clean(record.get('License Number', '')).upper() == wanted:
+            return {column: record.get(column) for column in EXPORT_COLUMNS}
+    return None
+
+
+def to_export(records):
+    """
+    Raw export frame of parsed records, converted to the snapshot's
+    conventions. Values that do not parse are kept as they are, for
+    schema.conform to report.
+    """
+    export = pd.DataFrame(list(records), columns=EXPORT_COLUMNS, dtype=object)
+    dates = export['Expiration Date']
+    parsed = pd.to_datetime(dates, format=PAGE_DATE_FORMAT, errors='coerce')
+    export['Expiration Date'] = parsed.dt.strftime('%Y-%m-%d').where(parsed.notna(), dates)
+    export['State'] = export['State'].map(lambda state: STATE_ABBREVIATIONS.get(state, state))
+    export['County'] = export['County'].mask(export['County'].str.upper() == OUT_OF_STATE)
+    return export
+
+
+def page_name(license_number):
+    # File name of a recorded result page
+    return re.sub(r'[^A-Za-z0-9]+', '_', license_number).strip('_') + '.html'
+
+
+class LicenseFetcher:
+    """
+    Looks up licenses from a pool of `workers` threads over one Session,
+    whose connection pool keeps a connection alive per thread. Requests
+    share a RateLimiter, and timeouts, connection errors and
+    RETRY_STATUSES are retried up to `attempts` times with jittered
+    exponential backoff (or the server's Retry-After, if longer).
+    """
+
+    def __init__(self, url=LOOKUP_URL, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE,
+                 attempts=DEFAULT_ATTEMPTS, timeout=TIMEOUT, record_dir=None):
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.record_dir = record_dir
+        self.limiter = RateLimiter(rate, burst=workers)
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._retrying = tenacity.Retrying(
+            stop=tenacity.stop_after_attempt(attempts),
+            wait=_backoff,
+            retry=tenacity.retry_if_exception_type((requests.ConnectionError, requests.Timeout, RetryableStatus)),
+            before_sleep=tenacity.before_sleep_log(logger, logging.WARNING),
+            reraise=True,
+        )
+
+    def close(self):
+        self.session.close()
+
+    def lookup(self, license_number):
+        # The parsed record of a license, or None if the search does not list it
+        response = self._retrying.copy()(self._get, license_number)
+        if response.status_code == 404:
+            return None
+        if self.record_dir:
+            with open(os.path.join(self.record_dir, page_name(license_number)), 'w', encoding='utf-8') as f:
+                f.write(response.text)
+        return parse_result_page(response.text, license_number)
+
+    def _get(self, license_number):
+        self.limiter.acquire()
+        response = self.session.get(self.url.format(license=quote(license_number)), timeout=self.timeout)
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableStatus(response)
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    def fetch_all(self, licenses, checkpoint):
+        """
+        Look up every license not already done in the `checkpoint` file,
+        appending each outcome to it as it finishes. Returns license ->
+        checkpoint entry: {'outcome': 'found', 'record': {...}},
+        {'outcome': 'missing'} or {'outcome': 'failed', 'error': '...'}.
+        """
+        entries = read_checkpoint(checkpoint)
+        pending = [license_number for license_number in licenses if license_number not in entries]
+        if len(pending) < len(licenses):
+            print(f"Resuming: {len(licenses) - len(pending)} of {len(licenses)} licenses already looked up")
+
+        started = time.perf_counter()
+        with open(checkpoint, 'a', encoding='utf-8') as log, ThreadPoolExecutor(self.workers) as executor:
+            futures = {executor.submit(self.lookup, license_number): license_number for license_number in pending}
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    license_number = futures[future]
+                    try:
+                        record = future.result()
+                    except (requests.RequestException, RetryableStatus) as error:
+                        entry = {'outcome': 'failed', 'error': str(error)}
+                    else:
+                        entry = {'outcome': 'found', 'record': record} if record else {'outcome': 'missing'}
+                    entries[license_number] = entry
+                    log.write(json.dumps({'license': license_number, **entry}) + '\n')
+                    log.flush()
+                    if done % 100 == 0:
+                        elapsed = time.perf_counter() - started
+                        print(f"{done}/{len(pending)} looked up ({done / elapsed:.1f}/s)")
+            except KeyboardInterrupt:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+        return entries
+
+
+def _backoff(retry_state):
+    exponential = tenacity.wait_exponential_jitter(initial=1, max=MAX_BACKOFF)(retry_state)
+    retry_after = getattr(retry_state.outcome.exception(), 'retry_after', None) or 0
+    return max(exponential, min(retry_after, MAX_BACKOFF))
+
+
+def read_checkpoint(path):
+    # License -> entry of the lookups finished in an earlier run; failed
+    # ones are left out so they are tried again
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off when the run was killed
+                continue
+            license_number = entry.pop('license')
+            if entry['outcome'] == 'failed':
+                entries.pop(license_number, None)
+            else:
+                entries[license_number] = entry
+    return entries
+
+
+def check_export(licenses, entries, max_missing=MAX_MISSING_SHARE):
+    """
+    Raise ExportRefused unless the lookups of `licenses` (entries as
+    returned by LicenseFetcher.fetch_all) can be written as an export.
+    ingest.py reads every license left out of an export as removed, so
+    none may have failed, at least one must have been found, and no more
+    than `max_missing` of them may be not listed.
+    """
+    failed = {
+        license_number: entries[license_number]['error'] for license_number in licenses
+        if entries[license_number]['outcome'] == 'failed'
+    }
+    if failed:
+        raise ExportRefused(f"run again to retry the {len(failed)} failed lookups", failed)
+    missing = {
+        license_number: 'not listed' for license_number in licenses
+        if entries[license_number]['outcome'] == 'missing'
+    }
+    if licenses and len(missing) == len(licenses):
+        raise ExportRefused(
+            f"none of the {len(licenses)} licenses are listed. Check --url and run again with --restart", missing
+        )
+    if len(missing) > max_missing * len(licenses):
+        raise ExportRefused(
+            f"{len(missing)} of {len(licenses)} licenses are not listed (more than --max-missing {max_missing:g}). "
+            f"Check --url and run again with --restart, or raise --max-missing if they were removed", missing
+        )
+
+
+def main():
+    from data_loader import read_raw_snapshot
+
+    parser = argparse.ArgumentParser(description="Look up licenses on the license search and write a raw export.")
+    parser.add_argument('snapshot', help="Snapshot whose licenses are looked up (CSV or Parquet directory)")
+    parser.add_argument('output', help="Raw license export CSV to write")
+    parser.add_argument('--license', action='append', default=[], help="Look up only this license (repeatable)")
+    parser.add_argument('--url', default=LOOKUP_URL, help="Lookup URL with a {license} placeholder")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Requests per second (0: unlimited)")
+    parser.add_argument('--attempts', type=int, default=DEFAULT_ATTEMPTS, help="Tries per license")
+    parser.add_argument('--record', metavar='DIR', help="Also save every result page to DIR")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint of an earlier run")
+    parser.add_argument('--max-missing', type=float, default=MAX_MISSING_SHARE,
+                        help="Share of licenses that may be not listed (default: %(default)s)")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(levelname)s %(name)s: %(message)s')
+
+    licenses = args.license or read_raw_snapshot(args.snapshot)['License Number'].dropna().tolist()
+    licenses = list(dict.fromkeys(_clean(license_number) for license_number in licenses))
+    checkpoint = args.output + CHECKPOINT_SUFFIX
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+
+    fetcher = LicenseFetcher(args.url, args.workers, args.rate, args.attempts, record_dir=args.record)
+    started = time.perf_counter()
+    try:
+        entries = fetcher.fetch_all(licenses, checkpoint)
+    finally:
+        fetcher.close()
+    elapsed = time.perf_counter() - started
+
+    outcomes = [entries[license_number]['outcome'] for license_number in licenses]
+    print(f"Looked up {len(licenses)} licenses in {elapsed:.1f}s: {outcomes.count('found')} found, "
+          f"{outcomes.count('missing')} not listed, {outcomes.count('failed')} failed")
+    try:
+        check_export(licenses, entries, args.max_missing)
+    except ExportRefused as refused:
+        for license_number, problem in list(refused.licenses.items())[:20]:
+            print(f"  {license_number}: {problem}")
+        print(f"No export written; {refused}")
+        print(f"Finished lookups are kept in {checkpoint}")
+        sys.exit(1)
+
+    export = to_export(entries[license_number]['record'] for license_number in licenses
+                       if entries[license_number]['outcome'] == 'found')
+    _, problems = schema.conform(export)
+    if len(problems):
+        print(f"{len(problems)} values do not conform to the schema and will be left empty by ingest.py:")
+        print(problems.to_string(index=False))
+    export.to_csv(args.output, index=False)
+    os.remove(checkpoint)
+    print(f"Wrote {len(export)} licenses to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+A prepared Dataset shared by every server process through memory-mapped
+Arrow IPC files.
+
+A publisher loads the snapshot and builds the indexes once, then writes
+them to a store directory, checking for a changed snapshot every minute:
+
+    python shared_store.py enriched_pharmacy_data_01032024.csv data/shared --watch 60
+
+and every worker serves the store (PHARMACY_DATA=data/shared). The frame is
+an uncompressed Feather file and the indexes an Arrow IPC file of pickle
+buffers; workers map both read-only, so the operating system keeps one
+physical copy of them however many workers there are.
+
+Publishing writes the files of the new version first and then atomically
+replaces CURRENT, which names the current version. Workers stat CURRENT on
+every load and switch to the new version on their next rerun, while reruns
+in flight finish on the old one. The files of the last `keep` versions are
+kept, so a worker that has just read CURRENT still finds them.
+"""
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+
+import storage
+
+CURRENT_FILE = 'CURRENT'
+FRAME_SUFFIX = '.frame.arrow'
+OBJECTS_SUFFIX = '.objects.arrow'
+KEEP_VERSIONS = 2
+
+# Array buffers smaller than this stay inside the pickle stream
+MIN_SHARED_BYTES = 1 << 16
+# Alignment of every buffer in the objects file, so arrays mapped from it
+# are aligned for any dtype
+ALIGNMENT = 64
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, CURRENT_FILE))
+
+
+def current_file(root):
+    return os.path.join(root, CURRENT_FILE)
+
+
+def current_version(root):
+    with open(current_file(root), encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def publish(pharmacies, objects, version, root, keep=KEEP_VERSIONS):
+    """
+    Write `pharmacies` and the picklable `objects` (name -> object) as
+    `version` of the store at `root` and make it the current version.
+    """
+    os.makedirs(root, exist_ok=True)
+    storage.replace_path(os.path.join(root, version + FRAME_SUFFIX), lambda path: write_frame(pharmacies, path))
+    storage.replace_path(os.path.join(root, version + OBJECTS_SUFFIX), lambda path: write_objects(objects, path))
+    storage.replace_path(current_file(root), lambda path: _write_text(path, version))
+    _prune(root, keep)
+
+
+def open_version(root, version):
+    # (frame, objects) of a version of the store, mapped read-only
+    pharmacies = read_frame(os.path.join(root, version + FRAME_SUFFIX))
+    objects = read_objects(os.path.join(root, version + OBJECTS_SUFFIX))
+    return pharmacies, objects
+
+
+def write_frame(pharmacies, path):
+    table = pa.table({column: _to_arrow(pharmacies[column]) for column in pharmacies.columns})
+    # One record batch, so every column is a single contiguous array
+    feather.write_feather(table, path, compression='uncompressed', chunksize=max(len(table), 1))
+
+
+def read_frame(path):
+    """
+    The frame of a Feather file written by write_frame. The file is memory
+    mapped, and strings, numbers, dates and category codes are views of it
+    rather than copies; only the boolean columns are unpacked.
+    """
+    table = ipc.open_file(pa.memory_map(path)).read_all()
+    # copy=False also keeps columns of the same dtype from being copied into
+    # one block
+    return pd.DataFrame({name: _from_arrow(table.column(name)) for name in table.column_names}, copy=False)
+
+
+def _to_arrow(values):
+    # Arrow array of a typed column that read_frame can map back without a copy
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        indices = _with_validity(codes, codes < 0)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(dtype.categories.to_numpy(), from_pandas=True))
+    if isinstance(dtype, (pd.StringDtype, pd.BooleanDtype)):
+        array = pa.array(values.array)
+        return array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biufM':
+        # Missing values keep their NaN/NaT bit pattern under the null bitmap
+        return _with_validity(values.to_numpy(), values.isna().to_numpy())
+    return pa.array(values, from_pandas=True)
+
+
+def _with_validity(array, missing):
+    # Arrow array over the bytes of `array`, with `missing` marked null
+    validity = pa.array(~missing).buffers()[1] if missing.any() else None
+    return pa.Array.from_buffers(pa.from_numpy_dtype(array.dtype), len(array), [validity, pa.py_buffer(np.ascontiguousarray(array))])
+
+
+def _from_arrow(column):
+    array = column.chunk(0) if column.num_chunks else column.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        codes = _raw_values(array.indices)
+        categories = pd.Index(array.dictionary.to_pandas())
+        return pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories), validate=False)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return pd.arrays.ArrowStringArray(column)
+    if pa.types.is_boolean(array.type):
+        return pd.BooleanDtype().__from_arrow__(column)
+    if pa.types.is_integer(array.type) or pa.types.is_floating(array.type) or pa.types.is_timestamp(array.type):
+        return _raw_values(array)
+    return column.to_pandas()
+
+
+def _raw_values(array):
+    # The values buffer of a fixed-width Arrow array as a numpy view,
+    # ignoring its null bitmap
+    dtype = array.type.to_pandas_dtype()
+    dtype = np.dtype(dtype) if not isinstance(dtype, np.dtype) else dtype
+    return np.frombuffer(array.buffers()[1], dtype=dtype, count=len(array), offset=array.offset * dtype.itemsize)
+
+
+def write_objects(objects, path):
+    """
+    Pickle `objects` with the buffers of large arrays written out of band,
+    each on its own aligned row of an Arrow IPC file.
+    """
+    buffers = []
+
+    def out_of_band(buffer):
+        # Returning True keeps a small buffer in the pickle stream
+        if buffer.raw().nbytes < MIN_SHARED_BYTES:
+            return True
+        buffers.append(buffer.raw())
+        return False
+
+    parts = [memoryview(pickle.dumps(objects, protocol=5, buffer_callback=out_of_band))] + buffers
+    lengths = np.array([part.nbytes for part in parts], dtype=np.int64)
+    padded = -(-lengths // ALIGNMENT) * ALIGNMENT
+    offsets = np.concatenate([[0], np.cumsum(padded)])
+    data = np.zeros(offsets[-1], dtype=np.uint8)
+    for part, start in zip(parts, offsets):
+        data[start:start + part.nbytes] = np.frombuffer(part.cast('B'), dtype=np.uint8)
+
+    table = pa.table({
+        'length': lengths,
+        'data': pa.Array.from_buffers(pa.large_binary(), len(parts), [None, pa.py_buffer(offsets), pa.py_buffer(data)]),
+    })
+    with ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_objects(path):
+    # The objects of a write_objects file; large arrays are views of the mapping
+    table = ipc.open_file(pa.memory_map(path)).read_all()
+    lengths = table.column('length').to_pylist()
+    data = table.column('data').chunk(0)
+    # Slices of the data buffer itself (scalar values would be copies)
+    offsets = np.frombuffer(data.buffers()[1], dtype=np.int64, count=len(data) + 1, offset=data.offset * 8)
+    values = data.buffers()[2]
+    parts = [values.slice(start, length) for start, length in zip(offsets[:-1].tolist(), lengths)]
+    return pickle.loads(parts[0], buffers=parts[1:])
+
+
+def _write_text(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _prune(root, keep):
+    # Remove all but the `keep` most recently published versions
+    published = {}
+    for name in os.listdir(root):
+        for suffix in (FRAME_SUFFIX, OBJECTS_SUFFIX):
+            if name.endswith(suffix):
+                version = name[:-len(suffix)]
+                mtime = os.path.getmtime(os.path.join(root, name))
+                published[version] = max(published.get(version, 0), mtime)
+    current = current_version(root)
+    stale = sorted((version for version in published if version != current), key=published.get, reverse=True)
+    for version in stale[max(keep - 1, 0):]:
+        for suffix in (FRAME_SUFFIX, OBJECTS_SUFFIX):
+            path = os.path.join(root, version + suffix)
+            if os.path.exists(path):
+                # Workers still mapping the files keep them until they unmap
+                os.remove(path)
+
+
+def main():
+    from data_loader import load_dataset, publish_dataset
+
+    parser = argparse.ArgumentParser(description="Publish a snapshot to a shared store for the app's workers.")
+    parser.add_argument('snapshot', help="Snapshot CSV or Parquet directory")
+    parser.add_argument('store', help="Store directory (serve it with PHARMACY_DATA=<store>)")
+    parser.add_argument('--states', default='', help="Comma-separated states to publish (default: all)")
+    parser.add_argument('--keep', type=int, default=KEEP_VERSIONS, help="Versions to keep (default: %(default)s)")
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help="Keep running, publishing whenever the snapshot changes")
+    args = parser.parse_args()
+    states = tuple(state for state in args.states.split(',') if state)
+
+    while True:
+        dataset = load_dataset(args.snapshot, states)
+        if not is_store(args.store) or current_version(args.store) != dataset.version:
+            started = time.perf_counter()
+            publish_dataset(dataset, args.store, keep=args.keep)
+            print(f"Published version {dataset.version[:12]} ({len(dataset.pharmacies)} licenses) "
+                  f"to {args.store} in {time.perf_counter() - started:.1f}s")
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
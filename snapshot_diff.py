@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Identifies a license across snapshots
+KEY_COLUMN = 'License Number'
+
+
+class SnapshotDiff:
+    """
+    Row-level comparison of two snapshot frames matched on License Number.
+
+    `source` gives, for each row of `new`, the position of the same license
+    in `old` (-1 for licenses that are new), and `removed` the positions in
+    `old` of licenses no longer present; `matched` are the rows of `new`
+    that have a source. Derived structures use `delta()` to
+    find the few rows they have to reprocess.
+    """
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        old_keys = pd.Index(old[KEY_COLUMN])
+        new_keys = pd.Index(new[KEY_COLUMN])
+        if not (old_keys.is_unique and new_keys.is_unique):
+            raise ValueError(f"{KEY_COLUMN} must be unique in both snapshots")
+        self.source = old_keys.get_indexer(new_keys)
+        self.added = np.flatnonzero(self.source < 0)
+        self.matched = np.flatnonzero(self.source >= 0)
+        kept = np.zeros(len(old), dtype=bool)
+        kept[self.source[self.matched]] = True
+        self.removed = np.flatnonzero(~kept)
+        self._differences = {}
+
+    def changed(self, columns):
+        # Rows of `new` whose values in `columns` differ from their source
+        # row, new licenses included
+        differs = np.zeros(len(self.matched), dtype=bool)
+        for column in columns:
+            differs |= self.differs(column)
+        return np.sort(np.concatenate([self.added, self.matched[differs]]))
+
+    def differs(self, column):
+        # Per matched row, whether `column` changed (missing == missing)
+        if column not in self._differences:
+            before = _values(self.old[column])[self.source[self.matched]]
+            after = _values(self.new[column])[self.matched]
+            unequal = np.flatnonzero(before != after)
+            both_missing = pd.isna(before[unequal]) & pd.isna(after[unequal])
+            differs = np.zeros(len(self.matched), dtype=bool)
+            differs[unequal[~both_missing]] = True
+            self._differences[column] = differs
+        return self._differences[column]
+
+    def delta(self, columns):
+        """
+        (rows of `new` to add, rows of `old` to retract) for a structure
+        built from `columns`: a changed license is retracted in its old form
+        and added in its new one, so count tables can be adjusted by
+        subtracting the one and adding the other.
+        """
+        added = self.changed(columns)
+        replaced = self.source[added]
+        retracted = np.sort(np.concatenate([self.removed, replaced[replaced >= 0]]))
+        return added, retracted
+
+    @property
+    def churn(self):
+        # Share of licenses added or removed
+        return (len(self.added) + len(self.removed)) / max(len(self.new), 1)
+
+
+def _values(column):
+    # Values as a numpy array that compares elementwise; the pd.NA of
+    # nullable columns cannot be compared, so it becomes None
+    if isinstance(column.dtype, (pd.BooleanDtype, pd.StringDtype)):
+        return column.to_numpy(dtype=object, na_value=None)
+    return column.to_numpy()
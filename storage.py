@@ -0,0 +1,147 @@
+import argparse
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# On-disk column types of a snapshot
+SNAPSHOT_SCHEMA = pa.schema([
+    ('Pharmacy Name', pa.string()),
+    ('License Number', pa.string()),
+    ('License Type', pa.string()),
+    ('License Status', pa.string()),
+    ('Expiration Date', pa.date32()),
+    ('City', pa.string()),
+    ('State', pa.string()),
+    ('County', pa.string()),
+    ('Zip', pa.string()),
+    ('LAT', pa.float64()),
+    ('LONG', pa.float64()),
+    ('isGovernment', pa.bool_()),
+    ('isSatellite', pa.bool_()),
+    ('Facility Type', pa.string()),
+    ('Specialties', pa.string()),
+    ('Conditions', pa.string()),
+    ('Registered Outsourcer', pa.bool_()),
+    ('Accreditations', pa.string()),
+    ('URL', pa.string()),
+])
+
+PARTITION_COLUMN = 'State'
+BOOLEAN_COLUMNS = [field.name for field in SNAPSHOT_SCHEMA if field.type == pa.bool_()]
+
+
+def to_table(pharmacies):
+    # Convert a snapshot frame (as read from the CSV) to a typed Arrow table
+    typed = pharmacies.assign(
+        **{
+            'Expiration Date': pd.to_datetime(pharmacies['Expiration Date']),
+            'LAT': pd.to_numeric(pharmacies['LAT'], errors='coerce'),
+            'LONG': pd.to_numeric(pharmacies['LONG'], errors='coerce'),
+        },
+        **{
+            column: pharmacies[column].map({"True": True, "False": False, True: True, False: False}).astype('boolean')
+            for column in BOOLEAN_COLUMNS
+        }
+    )
+    return pa.Table.from_pandas(typed[SNAPSHOT_SCHEMA.names], schema=SNAPSHOT_SCHEMA, preserve_index=False)
+
+
+def write_snapshot(pharmacies, root):
+    """
+    Write a snapshot as Parquet under `root`, one directory per State
+    (`root/State=CA/...`). Existing files of the states being written are
+    replaced; other states are left untouched, so states can be refreshed
+    one at a time.
+    """
+    pq.write_to_dataset(
+        to_table(pharmacies),
+        root,
+        partition_cols=[PARTITION_COLUMN],
+        existing_data_behavior='delete_matching',
+    )
+
+
+def open_snapshot(root):
+    return ds.dataset(
+        root,
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor='hive'),
+    )
+
+
+def read_snapshot(root, states=None, columns=None, filter=None):
+    """
+    Read a partitioned snapshot into a frame.
+
+    Only the partitions of `states` (all when None) and the requested
+    `columns` are read, and `filter` (a pyarrow.dataset expression) is pushed
+    down to the Parquet row groups, so the cost is bounded by what is asked
+    for rather than by the size of the directory.
+    """
+    expression = filter
+    if states:
+        state_filter = ds.field(PARTITION_COLUMN).isin(list(states))
+        expression = state_filter if expression is None else expression & state_filter
+    table = open_snapshot(root).to_table(columns=columns, filter=expression)
+    frame = table.to_pandas(date_as_object=False)
+    # Keep the CSV column order regardless of where the partition column lands
+    ordered = [name for name in SNAPSHOT_SCHEMA.names if name in frame.columns]
+    return frame[ordered]
+
+
+def snapshot_files(root, states=None):
+    # Parquet files making up the snapshot (or the given states), sorted
+    files = []
+    for directory, _, names in os.walk(root):
+        partition = os.path.basename(directory)
+        if states and partition not in {f'{PARTITION_COLUMN}={state}' for state in states}:
+            continue
+        files.extend(os.path.join(directory, name) for name in names if name.endswith('.parquet'))
+    return sorted(files)
+
+
+def replace_path(path, write):
+    """
+    Call `write` with a temporary path next to `path`, then move what it
+    wrote into place, so a reader never sees a partly written snapshot. A
+    file is replaced atomically; a directory is first renamed aside, so for
+    a moment `path` is missing (load_dataset waits and reads it again).
+    """
+    temporary = f'{path}.tmp-{os.getpid()}'
+    previous = f'{path}.old-{os.getpid()}'
+    try:
+        write(temporary)
+        if os.path.isdir(temporary) and os.path.isdir(path):
+            os.rename(path, previous)
+            try:
+                os.rename(temporary, path)
+            except OSError:
+                os.rename(previous, path)
+                raise
+        else:
+            os.replace(temporary, path)
+    finally:
+        for leftover in (temporary, previous):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+            elif os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a snapshot CSV to Parquet partitioned by State.")
+    parser.add_argument('csv', help="Snapshot CSV, e.g. enriched_pharmacy_data_01032024.csv")
+    parser.add_argument('root', help="Output directory of the partitioned snapshot")
+    args = parser.parse_args()
+
+    pharmacies = pd.read_csv(args.csv, dtype=str, encoding='utf-8')
+    write_snapshot(pharmacies, args.root)
+    print(f"Wrote {len(pharmacies)} licenses in {pharmacies[PARTITION_COLUMN].nunique()} states to {args.root}")
+
+
+if __name__ == '__main__':
+    main()
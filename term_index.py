@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+# Rewrites applied to the raw comma-joined string before it is split, for
+# terms that contain commas of their own
+SPECIALTY_REPLACEMENTS = {
+    "Ear, Nose, and Throat": "Ear Nose and Throat",
+}
+
+# Aliases applied to individual terms after cleaning
+ACCREDITATION_ALIASES = {
+    "American Association of Homeopathic Pharmacists": "AAHP",
+}
+
+
+# Define a function to clean the terms by removing unwanted punctuation
+def clean_term(term):
+    # Remove extra spaces, just in case
+    term = term.strip()
+    return term
+
+
+class TermIndex:
+    """
+    Term -> row bitmap index over a comma-joined, multi-valued column.
+
+    Each term owns one packed bit array with a bit per row, so combining any
+    set of selections is a handful of vectorized bitwise operations instead
+    of a substring scan per row.
+    """
+
+    def __init__(self, terms, bitmaps, n_rows):
+        self.terms = list(terms)
+        self.n_rows = n_rows
+        self._positions = {term: i for i, term in enumerate(self.terms)}
+        self._bitmaps = bitmaps
+        self._bitmaps.flags.writeable = False
+
+    @classmethod
+    def from_column(cls, column, replacements=None, aliases=None):
+        n_rows = len(column)
+        values = column.reset_index(drop=True).dropna()
+        for old, new in (replacements or {}).items():
+            values = values.str.replace(old, new, regex=False)
+
+        # One entry per (row, term) pair
+        exploded = values.str.split(',').explode()
+        exploded = exploded.map(clean_term)
+        if aliases:
+            exploded = exploded.replace(aliases)
+        exploded = exploded[exploded != '']
+
+        terms = sorted(exploded.unique())
+        codes = pd.Categorical(exploded, categories=terms).codes
+        rows = exploded.index.to_numpy()
+
+        bits = np.zeros((len(terms), n_rows), dtype=bool)
+        bits[codes, rows] = True
+        return cls(terms, np.packbits(bits, axis=1, bitorder='little'), n_rows)
+
+    def __contains__(self, term):
+        return term in self._positions
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _unpack(self, packed):
+        return np.unpackbits(packed, count=self.n_rows, bitorder='little').astype(bool)
+
+    def mask(self, term):
+        # Rows tagged with `term`; unknown terms match nothing
+        position = self._positions.get(term)
+        if position is None:
+            return np.zeros(self.n_rows, dtype=bool)
+        return self._unpack(self._bitmaps[position])
+
+    def match_all(self, terms):
+        # Rows tagged with every term (AND); no terms means no restriction
+        terms = set(terms)
+        if not terms:
+            return np.ones(self.n_rows, dtype=bool)
+        if not terms <= self._positions.keys():
+            return np.zeros(self.n_rows, dtype=bool)
+        positions = [self._positions[term] for term in terms]
+        return self._unpack(np.bitwise_and.reduce(self._bitmaps[positions], axis=0))
+
+    def match_any(self, terms):
+        # Rows tagged with at least one term (OR)
+        positions = [self._positions[term] for term in set(terms) if term in self._positions]
+        if not positions:
+            return np.zeros(self.n_rows, dtype=bool)
+        return self._unpack(np.bitwise_or.reduce(self._bitmaps[positions], axis=0))
+
+    def counts(self):
+        # Number of rows tagged with each term
+        return pd.Series(
+            np.unpackbits(self._bitmaps, axis=1, count=self.n_rows, bitorder='little').sum(axis=1, dtype=np.int64),
+            index=self.terms,
+            name='Count'
+        )
+
+    def updated(self, source, changed, column, replacements=None, aliases=None):
+        """
+        Index of a refreshed snapshot whose `column` differs from this one
+        only in the `changed` rows. Every other row keeps the terms of row
+        `source[row]` of this index, so only the changed values are split
+        and cleaned again.
+        """
+        n_rows = len(column)
+        kept = np.ones(n_rows, dtype=bool)
+        kept[changed] = False
+        kept = np.flatnonzero(kept)
+        # Old row -> new row for the rows kept as they were (-1 otherwise)
+        target = np.full(self.n_rows, -1, dtype=np.int64)
+        target[source[kept]] = kept
+
+        rows = {}
+        for term, bitmap in zip(self.terms, self._bitmaps):
+            moved = target[np.flatnonzero(self._unpack(bitmap))]
+            rows[term] = [moved[moved >= 0]]
+        fresh = TermIndex.from_column(column.iloc[changed], replacements=replacements, aliases=aliases)
+        for term, bitmap in zip(fresh.terms, fresh._bitmaps):
+            rows.setdefault(term, []).append(changed[np.flatnonzero(fresh._unpack(bitmap))])
+
+        terms, bitmaps = [], []
+        for term in sorted(rows):
+            bits = np.zeros(n_rows, dtype=bool)
+            for positions in rows[term]:
+                bits[positions] = True
+            # Drop terms whose last tagged row was changed or removed
+            if bits.any():
+                terms.append(term)
+                bitmaps.append(np.packbits(bits, bitorder='little'))
+        packed = np.stack(bitmaps) if bitmaps else np.zeros((0, (n_rows + 7) // 8), dtype=np.uint8)
+        return TermIndex(terms, packed, n_rows)
@@ -0,0 +1,43 @@
+"""
+ETag revalidation and paging of the JSON API, on the shipped snapshot.
+
+    python -m pytest tests
+"""
+import json
+
+from tornado.testing import AsyncHTTPTestCase
+
+from api import make_app
+from paging import page_count
+
+SEARCH = '/api/search?pharmacy_type=503A&page_size=25'
+
+
+class APITest(AsyncHTTPTestCase):
+    def get_app(self):
+        return make_app()
+
+    def get(self, url, if_none_match=None):
+        headers = {'If-None-Match': if_none_match} if if_none_match is not None else {}
+        return self.fetch(url, headers=headers)
+
+    def test_etag_revalidation(self):
+        etag = self.get(SEARCH).headers['ETag']
+        for validator in [etag, f'W/{etag}', '*', f'"other", W/{etag}']:
+            with self.subTest(validator=validator):
+                response = self.get(SEARCH, validator)
+                assert response.code == 304
+                assert response.headers['ETag'] == etag
+        assert self.get(SEARCH, '"other"').code == 200
+
+    def test_export_etag_revalidation(self):
+        url = '/api/export.csv?pharmacy_type=503B&fields=Pharmacy%20Name'
+        etag = self.get(url).headers['ETag']
+        assert self.get(url, f'W/{etag}').code == 304
+
+    def test_pages_match_app(self):
+        for url in [SEARCH, '/api/search?city=NOWHERE&page_size=25']:
+            body = json.loads(self.get(url).body)
+            assert body['pages'] == page_count(body['total'], body['page_size'])
+        assert body['total'] == 0 and body['pages'] == 1
+
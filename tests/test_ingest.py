@@ -0,0 +1,111 @@
+"""
+ingest.py writes a refreshed snapshot aside and swaps it in, rewriting only
+the Parquet partitions of changed states.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+import data_loader
+import ingest
+import schema
+import storage
+from benchmarks.synthetic import churn, generate
+from data_loader import read_snapshot
+from ingest import changed_states, write_refreshed
+from scraper import EXPORT_COLUMNS
+from snapshot_diff import SnapshotDiff
+
+N_ROWS = 2_000
+
+
+def _stored(pharmacies):
+    return pharmacies.astype({column: object for column in pharmacies.columns if pharmacies[column].dtype == 'category'})
+
+
+@pytest.fixture(scope='module')
+def snapshots():
+    # (current, refreshed) with the stored column types, as ingest.py has them
+    current, _ = schema.conform(generate(N_ROWS), schema.STORED_SCHEMA)
+    current = _stored(current)
+    refreshed = churn(current, 0.01, seed=1)
+    # churn() changes licenses anywhere; keep them to one state, so the
+    # other partitions must be left as they are
+    state = current['State'].iloc[0]
+    refreshed = pd.concat([refreshed[refreshed['State'] == state], current[current['State'] != state]], ignore_index=True)
+    return current, _stored(refreshed)
+
+
+def _files(root):
+    return {os.path.relpath(file, root): os.stat(file).st_ino for file in storage.snapshot_files(root)}
+
+
+def _sorted(pharmacies):
+    return pharmacies.sort_values('License Number', ignore_index=True)
+
+
+def test_parquet_refreshed_in_place(tmp_path, snapshots):
+    current, refreshed = snapshots
+    root = str(tmp_path / 'pharmacies')
+    storage.write_snapshot(current, root)
+    before = _files(root)
+
+    write_refreshed(root, current, refreshed, root)
+
+    pd.testing.assert_frame_equal(
+        _sorted(_stored(read_snapshot(root, kinds=schema.STORED_SCHEMA))), _sorted(refreshed), check_dtype=False
+    )
+    # Unchanged states keep their files (hard links of them), changed ones
+    # get new files
+    after = _files(root)
+    changed = {f'{storage.PARTITION_COLUMN}={state}' for state in changed_states(current, refreshed)}
+    assert changed
+    for file, inode in before.items():
+        if os.path.dirname(file) in changed:
+            assert file not in after
+        else:
+            assert after[file] == inode
+    assert os.listdir(tmp_path) == ['pharmacies']
+
+
+def test_csv_replaced(tmp_path, snapshots):
+    current, refreshed = snapshots
+    path = str(tmp_path / 'pharmacies.csv')
+    current.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+    write_refreshed(path, current, refreshed, path)
+
+    pd.testing.assert_frame_equal(
+        _stored(read_snapshot(path, kinds=schema.STORED_SCHEMA)), refreshed, check_dtype=False
+    )
+    assert os.listdir(tmp_path) == ['pharmacies.csv']
+
+
+def test_published_csv_refreshes_running_app(tmp_path, snapshots, monkeypatch):
+    current, refreshed = snapshots
+    served = str(tmp_path / 'pharmacies.csv')
+    export = str(tmp_path / 'export.csv')
+    current.to_csv(served, index=False, date_format='%Y-%m-%d')
+    refreshed[EXPORT_COLUMNS].to_csv(export, index=False, date_format='%Y-%m-%d')
+
+    diffs = []
+    monkeypatch.setattr(data_loader, 'SnapshotDiff', lambda *frames: diffs.append(SnapshotDiff(*frames)) or diffs[-1])
+    data_loader.clear_cache()
+    try:
+        previous = data_loader.load_dataset(served)
+        monkeypatch.setattr(sys, 'argv', ['ingest.py', served, export, '--as-of', '2024-02-01', '--publish', served])
+        ingest.main()
+        dataset = data_loader.load_dataset(served)
+    finally:
+        data_loader.clear_cache()
+
+    # The dated snapshot is kept, and the served one refreshed from the
+    # loaded Dataset rather than rebuilt
+    assert os.path.isfile(tmp_path / 'enriched_pharmacy_data_02012024.csv')
+    assert dataset.version != previous.version
+    assert len(diffs) == 1 and 0 < diffs[0].churn <= data_loader.MAX_INCREMENTAL_CHURN
+    assert sorted(dataset.pharmacies['License Number']) == sorted(refreshed['License Number'])
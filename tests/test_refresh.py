@@ -0,0 +1,123 @@
+"""
+An incremental refresh (a changed snapshot applied to the loaded Dataset as
+a delta) must build the same indexes as loading the new snapshot from
+scratch.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_loader
+import schema
+from aggregates import AGGREGATES
+from benchmarks.synthetic import churn, generate
+from data_loader import MAX_INCREMENTAL_CHURN, SERVED_COLUMNS, Dataset, load_dataset, read_snapshot
+from query_engine import PharmacyQuery
+from snapshot_diff import SnapshotDiff
+
+N_ROWS = 20_000
+CHURN = 0.05
+TEXT_QUERIES = ['pharm', 'kaiser san', 'walgreens', 'oakland', 'lsc 10', 'new 9000', 'anahiem', 'moved town']
+
+
+def _write(pharmacies, path):
+    pharmacies.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+
+def _refreshed(current, seed=0):
+    # churn() renews, drops and adds licenses; on top of that some move,
+    # get renamed or pick up a term no other license has
+    refreshed = churn(current, CHURN, seed=seed)
+    refreshed = refreshed.astype({column: object for column in refreshed.columns if refreshed[column].dtype == 'category'})
+    rng = np.random.default_rng(seed)
+    moved, renamed, tagged = np.split(rng.choice(len(current) // 2, size=60, replace=False), 3)
+    refreshed.loc[moved, ['City', 'Zip', 'County']] = ['MOVED TOWN', '96161', 'NEVADA']
+    refreshed.loc[moved, 'LAT'] = 39.3279
+    refreshed.loc[moved, 'LONG'] = -120.1833
+    refreshed.loc[renamed, 'Pharmacy Name'] = refreshed.loc[renamed, 'Pharmacy Name'] + ' RENAMED'
+    refreshed.loc[tagged, 'Specialties'] = 'Oncology, Brand New Specialty'
+    refreshed.loc[tagged, 'Accreditations'] = np.nan
+    return refreshed
+
+
+@pytest.fixture(scope='module')
+def refreshes(tmp_path_factory):
+    # (Dataset refreshed incrementally, Dataset built from scratch)
+    path = str(tmp_path_factory.mktemp('snapshots') / 'snapshot.csv')
+    current, _ = schema.conform(generate(N_ROWS))
+    refreshed = _refreshed(current)
+
+    data_loader.clear_cache()
+    try:
+        _write(current, path)
+        previous = load_dataset(path)
+        # Build what is otherwise built on first use, so it is refreshed too
+        previous.aggregates.base_cube
+        _write(refreshed, path)
+        incremental = load_dataset(path)
+    finally:
+        data_loader.clear_cache()
+
+    full = Dataset(read_snapshot(path, columns=SERVED_COLUMNS), 'full', path)
+    assert SnapshotDiff(previous.pharmacies, incremental.pharmacies).churn <= MAX_INCREMENTAL_CHURN
+    assert incremental.version != previous.version
+    return incremental, full
+
+
+def _cube(registry):
+    cube = registry.base_cube.astype(object)
+    return cube.sort_values(list(cube.columns)).reset_index(drop=True)
+
+
+def test_frame_matches(refreshes):
+    incremental, full = refreshes
+    pd.testing.assert_frame_equal(incremental.pharmacies, full.pharmacies)
+
+
+@pytest.mark.parametrize('attribute', ['specialty_index', 'condition_index', 'accreditation_index'])
+def test_term_index_matches(refreshes, attribute):
+    incremental, full = (getattr(dataset, attribute) for dataset in refreshes)
+    assert incremental.terms == full.terms
+    for term in full.terms:
+        np.testing.assert_array_equal(incremental.mask(term), full.mask(term), err_msg=term)
+    assert 'Brand New Specialty' in refreshes[1].specialty_index
+
+
+def test_aggregates_match(refreshes):
+    incremental, full = refreshes
+    pd.testing.assert_frame_equal(_cube(incremental.aggregates), _cube(full.aggregates), check_dtype=False)
+    for name in AGGREGATES:
+        pd.testing.assert_frame_equal(
+            incremental.aggregates[name].astype(object), full.aggregates[name].astype(object), check_dtype=False
+        )
+
+
+def test_expirations_match(refreshes):
+    incremental, full = refreshes
+    pd.testing.assert_frame_equal(incremental.expirations.matrix, full.expirations.matrix)
+    np.testing.assert_array_equal(incremental.expiration_index.between(), full.expiration_index.between())
+
+
+def test_geo_index_matches(refreshes):
+    incremental, full = (dataset.geo_index for dataset in refreshes)
+    np.testing.assert_array_equal(incremental.lats, full.lats)
+    np.testing.assert_array_equal(incremental.lons, full.lons)
+    np.testing.assert_array_equal(incremental.zips, full.zips)
+    assert incremental.zip_centroids.keys() == full.zip_centroids.keys()
+    for zip_code, centroid in full.zip_centroids.items():
+        np.testing.assert_allclose(incremental.zip_centroids[zip_code], centroid)
+    for lat, lon in [(34.05, -118.24), (39.3279, -120.1833)]:
+        rows, distances = incremental.within(lat, lon, 30)
+        expected_rows, expected_distances = full.within(lat, lon, 30)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_allclose(distances, expected_distances)
+
+
+def test_text_search_matches(refreshes):
+    incremental, full = refreshes
+    for text in TEXT_QUERIES:
+        np.testing.assert_array_equal(incremental.text_index.search(text), full.text_index.search(text), err_msg=text)
+        query = PharmacyQuery(text=text, pharmacy_types=['503A'])
+        np.testing.assert_array_equal(incremental.engine.run(query), full.engine.run(query), err_msg=text)
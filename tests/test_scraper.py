@@ -0,0 +1,170 @@
+"""
+scraper.py against benchmarks.recorded_site served in-process: parsing,
+retries, checkpoint resume and the rules for refusing an export.
+
+    python -m pytest tests
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import socket
+import threading
+
+import pandas as pd
+import pytest
+import tornado.httpserver
+import tornado.netutil
+
+import scraper
+from benchmarks.recorded_site import make_app, render_snapshot
+from scraper import ExportRefused, LicenseFetcher, check_export, read_checkpoint, to_export
+
+SNAPSHOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'enriched_pharmacy_data_01032024.csv')
+N_LICENSES = 20
+
+
+@contextlib.contextmanager
+def serving(pages, error_rate=0.0):
+    # The recorded site on a free port, in a thread of its own; yields the
+    # lookup URL
+    ready = threading.Event()
+    served = {}
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        sockets = tornado.netutil.bind_sockets(0, '127.0.0.1')
+        server = tornado.httpserver.HTTPServer(make_app(pages, error_rate=error_rate))
+        server.add_sockets(sockets)
+        served.update(loop=loop, port=sockets[0].getsockname()[1])
+        ready.set()
+        loop.run_forever()
+        server.stop()
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    try:
+        yield f"http://127.0.0.1:{served['port']}/results?licenseNumber={{license}}"
+    finally:
+        served['loop'].call_soon_threadsafe(served['loop'].stop)
+        thread.join()
+
+
+def _closed_url():
+    # A lookup URL nothing listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/results?licenseNumber={{license}}"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(scraper, '_backoff', lambda retry_state: 0)
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return pd.read_csv(SNAPSHOT, dtype=str).dropna(subset=['License Number']).head(N_LICENSES).reset_index(drop=True)
+
+
+@pytest.fixture
+def pages(tmp_path, snapshot):
+    path = str(tmp_path / 'snapshot.csv')
+    snapshot.to_csv(path, index=False)
+    render_snapshot(path, str(tmp_path / 'pages'))
+    return str(tmp_path / 'pages')
+
+
+@pytest.fixture
+def licenses(snapshot):
+    return snapshot['License Number'].tolist()
+
+
+def _fetch(url, licenses, checkpoint, attempts=3):
+    fetcher = LicenseFetcher(url, workers=4, rate=0, attempts=attempts)
+    try:
+        return fetcher.fetch_all(licenses, checkpoint)
+    finally:
+        fetcher.close()
+
+
+def test_lookups_parse_recorded_pages(tmp_path, pages, snapshot, licenses):
+    with serving(pages) as url:
+        entries = _fetch(url, licenses, str(tmp_path / 'checkpoint.jsonl'))
+
+    assert {entry['outcome'] for entry in entries.values()} == {'found'}
+    check_export(licenses, entries)
+    export = to_export(entries[license_number]['record'] for license_number in licenses)
+    for column in ['License Number', 'Expiration Date', 'State', 'Zip']:
+        assert export[column].tolist() == snapshot[column].tolist(), column
+
+
+def test_unavailable_responses_are_retried(tmp_path, pages, licenses, caplog):
+    with caplog.at_level(logging.WARNING, logger='pharmacy.scraper'), serving(pages, error_rate=0.5) as url:
+        entries = _fetch(url, licenses, str(tmp_path / 'checkpoint.jsonl'), attempts=30)
+
+    assert {entry['outcome'] for entry in entries.values()} == {'found'}
+    assert any('503' in record.getMessage() for record in caplog.records)
+
+
+def test_failed_lookups_are_refused_then_retried(tmp_path, pages, licenses):
+    checkpoint = str(tmp_path / 'checkpoint.jsonl')
+    with serving(pages, error_rate=1.0) as url:
+        entries = _fetch(url, licenses, checkpoint, attempts=2)
+    assert {entry['outcome'] for entry in entries.values()} == {'failed'}
+    with pytest.raises(ExportRefused) as refused:
+        check_export(licenses, entries)
+    assert set(refused.value.licenses) == set(licenses)
+
+    # Failed lookups are not kept, so the next run tries them again
+    assert read_checkpoint(checkpoint) == {}
+    with serving(pages) as url:
+        entries = _fetch(url, licenses, checkpoint)
+    check_export(licenses, entries)
+
+
+def test_resume_skips_finished_lookups(tmp_path, pages, licenses):
+    checkpoint = str(tmp_path / 'checkpoint.jsonl')
+    done, pending = licenses[:N_LICENSES // 2], licenses[N_LICENSES // 2:]
+    with serving(pages) as url:
+        _fetch(url, done, checkpoint)
+
+    # Only the pending licenses go to the (now unreachable) site
+    entries = _fetch(_closed_url(), licenses, checkpoint, attempts=1)
+    assert [entries[license_number]['outcome'] for license_number in done] == ['found'] * len(done)
+    assert [entries[license_number]['outcome'] for license_number in pending] == ['failed'] * len(pending)
+
+
+def test_all_missing_is_refused(tmp_path, licenses):
+    os.makedirs(tmp_path / 'empty')
+    with serving(str(tmp_path / 'empty')) as url:
+        entries = _fetch(url, licenses, str(tmp_path / 'checkpoint.jsonl'))
+
+    assert {entry['outcome'] for entry in entries.values()} == {'missing'}
+    # Even when any share may be missing
+    with pytest.raises(ExportRefused, match='none of the'):
+        check_export(licenses, entries, max_missing=1)
+
+
+@pytest.mark.parametrize('removed, max_missing, refused', [
+    (2, scraper.MAX_MISSING_SHARE, False),
+    (3, scraper.MAX_MISSING_SHARE, True),
+    (3, 0.5, False),
+])
+def test_missing_share_is_limited(tmp_path, pages, licenses, removed, max_missing, refused):
+    for license_number in licenses[:removed]:
+        os.remove(os.path.join(pages, scraper.page_name(license_number)))
+    with serving(pages) as url:
+        entries = _fetch(url, licenses, str(tmp_path / 'checkpoint.jsonl'))
+
+    assert sum(entry['outcome'] == 'missing' for entry in entries.values()) == removed
+    if refused:
+        with pytest.raises(ExportRefused) as error:
+            check_export(licenses, entries, max_missing)
+        assert set(error.value.licenses) == set(licenses[:removed])
+    else:
+        check_export(licenses, entries, max_missing)
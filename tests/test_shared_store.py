@@ -0,0 +1,119 @@
+"""
+A Dataset published to a shared store and mapped back must answer like the
+Dataset it was published from.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_loader
+import schema
+import shared_store
+from aggregates import AGGREGATES
+from benchmarks.synthetic import generate
+from data_loader import TERM_INDEXES, load_dataset, publish_dataset
+from figures import FIGURES
+from map_bins import POINT_ZOOM
+from query_engine import PharmacyQuery
+
+N_ROWS = 20_000
+POINTS = [(34.05, -118.24, 25), (37.77, -122.42, 100), (39.3279, -120.1833, 10)]
+
+
+@pytest.fixture(scope='module')
+def datasets(tmp_path_factory):
+    # (Dataset loaded from the CSV, the same Dataset mapped from a store)
+    root = tmp_path_factory.mktemp('shared')
+    path = str(root / 'snapshot.csv')
+    pharmacies, _ = schema.conform(generate(N_ROWS))
+    pharmacies.to_csv(path, index=False, date_format='%Y-%m-%d')
+
+    data_loader.clear_cache()
+    try:
+        loaded = load_dataset(path)
+        publish_dataset(loaded, str(root / 'store'))
+        mapped = load_dataset(str(root / 'store'))
+    finally:
+        data_loader.clear_cache()
+    assert mapped is not loaded and mapped.version == loaded.version
+    return loaded, mapped
+
+
+def _queries(dataset):
+    pharmacies = dataset.pharmacies
+    city = pharmacies['City'].value_counts().index[0]
+    specialties = dataset.specialty_index.counts().sort_values(ascending=False).index[:2].tolist()
+    name = pharmacies['Pharmacy Name'].iloc[0].split()[0]
+    return [
+        PharmacyQuery(),
+        PharmacyQuery(pharmacy_types=['503B'], facility_types=['Sterile Compounding Pharmacy']),
+        PharmacyQuery(cities=[city], specialties=specialties[:1]),
+        PharmacyQuery(specialties=specialties[:1], conditions=[dataset.condition_index.counts().idxmax()]),
+        PharmacyQuery(specialties=specialties),
+        PharmacyQuery(accreditations=dataset.accreditation_index.terms[:1], pharmacy_types=['503A']),
+        PharmacyQuery(text=f'{name} {city[:3]}'),
+        PharmacyQuery(text=name[:-1] + 'x'),
+    ]
+
+
+def test_large_arrays_are_mapped(datasets):
+    # Out of band buffers come back as read-only views of the store files
+    _, mapped = datasets
+    for array in [mapped.geo_index.lats, mapped.geo_index.lons]:
+        assert array.nbytes >= shared_store.MIN_SHARED_BYTES
+        assert not array.flags.writeable and not array.flags.owndata
+    assert not mapped.pharmacies['LAT'].to_numpy().flags.writeable
+
+
+def test_frame_matches(datasets):
+    loaded, mapped = datasets
+    pd.testing.assert_frame_equal(mapped.pharmacies, loaded.pharmacies, check_dtype=False)
+    for column in loaded.pharmacies.columns:
+        assert str(mapped.pharmacies[column].dtype) == str(loaded.pharmacies[column].dtype), column
+    pd.testing.assert_frame_equal(mapped.problems, loaded.problems)
+
+
+def test_indexes_match(datasets):
+    loaded, mapped = datasets
+    for attribute in TERM_INDEXES.values():
+        expected, actual = getattr(loaded, attribute), getattr(mapped, attribute)
+        assert actual.terms == expected.terms
+        for term in expected.terms:
+            np.testing.assert_array_equal(actual.mask(term), expected.mask(term), err_msg=term)
+    pd.testing.assert_frame_equal(mapped.expirations.matrix, loaded.expirations.matrix)
+    np.testing.assert_array_equal(mapped.expiration_index.between(), loaded.expiration_index.between())
+    pd.testing.assert_frame_equal(mapped.aggregates.base_cube, loaded.aggregates.base_cube)
+    for name in AGGREGATES:
+        pd.testing.assert_frame_equal(mapped.aggregates[name], loaded.aggregates[name])
+
+
+def test_queries_match(datasets):
+    loaded, mapped = datasets
+    for query in _queries(loaded):
+        np.testing.assert_array_equal(mapped.engine.run(query), loaded.engine.run(query), err_msg=repr(query))
+
+
+def test_radius_searches_match(datasets):
+    loaded, mapped = datasets
+    for lat, lon, miles in POINTS:
+        rows, distances = mapped.geo_index.within(lat, lon, miles)
+        expected_rows, expected_distances = loaded.geo_index.within(lat, lon, miles)
+        np.testing.assert_array_equal(rows, expected_rows)
+        np.testing.assert_array_equal(distances, expected_distances)
+    zip_code = next(zip_code for zip_code in loaded.geo_index.zips if zip_code)
+    assert mapped.geo_index.locate(zip_code) == loaded.geo_index.locate(zip_code)
+
+
+@pytest.mark.parametrize('name', sorted(FIGURES))
+def test_figures_match(datasets, name):
+    # Built directly: get_figure would share the cached figure, as both
+    # datasets have the same version
+    loaded, mapped = datasets
+    params = {
+        'expirations': [{'facility_types': loaded.expirations.facility_types}],
+        'pharmacy_map': [{'zoom': 4}, {'zoom': POINT_ZOOM, 'query': PharmacyQuery(pharmacy_types=['503B'])}],
+    }.get(name, [{}])
+    for kwargs in params:
+        assert FIGURES[name](mapped, **kwargs).to_json() == FIGURES[name](loaded, **kwargs).to_json(), kwargs
@@ -0,0 +1,76 @@
+"""
+TermIndex matches whole terms of a comma-joined column, after the
+"Ear, Nose, and Throat" rewrite and the AAHP alias.
+
+    python -m pytest tests
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from term_index import ACCREDITATION_ALIASES, SPECIALTY_REPLACEMENTS, TermIndex
+
+SPECIALTIES = pd.Series([
+    'Nuclear Cardiology, Oncology',
+    'Cardiology',
+    'Ear, Nose, and Throat, Dermatology',
+    np.nan,
+    ' Oncology ,Dermatology',
+])
+CONDITIONS = pd.Series(['Anxiety Disorders', 'Anxiety, Pain', np.nan])
+ACCREDITATIONS = pd.Series([
+    'American Association of Homeopathic Pharmacists, PCAB',
+    'AAHP',
+    'PCAB',
+    np.nan,
+])
+
+
+@pytest.fixture(scope='module')
+def specialties():
+    return TermIndex.from_column(SPECIALTIES, replacements=SPECIALTY_REPLACEMENTS)
+
+
+def _rows(mask):
+    return np.flatnonzero(mask).tolist()
+
+
+def test_whole_terms_only(specialties):
+    # Not a substring of a longer term
+    assert _rows(specialties.mask('Cardiology')) == [1]
+    assert _rows(specialties.mask('Nuclear Cardiology')) == [0]
+    conditions = TermIndex.from_column(CONDITIONS)
+    assert _rows(conditions.mask('Anxiety')) == [1]
+    assert _rows(conditions.mask('Anxiety Disorders')) == [0]
+
+
+def test_terms_are_cleaned(specialties):
+    assert specialties.terms == ['Cardiology', 'Dermatology', 'Ear Nose and Throat', 'Nuclear Cardiology', 'Oncology']
+    assert _rows(specialties.mask('Oncology')) == [0, 4]
+    # Missing values tag no terms, not a 'nan' term
+    assert 'nan' not in specialties
+    assert not specialties.match_any(specialties.terms)[3]
+
+
+def test_ear_nose_and_throat_is_one_term(specialties):
+    assert _rows(specialties.mask('Ear Nose and Throat')) == [2]
+    for part in ['Ear', 'Nose', 'and Throat']:
+        assert part not in specialties
+
+
+def test_aahp_alias():
+    accreditations = TermIndex.from_column(ACCREDITATIONS, aliases=ACCREDITATION_ALIASES)
+    assert accreditations.terms == ['AAHP', 'PCAB']
+    assert _rows(accreditations.mask('AAHP')) == [0, 1]
+
+
+def test_match_all_and_any(specialties):
+    assert _rows(specialties.match_all(['Oncology', 'Dermatology'])) == [4]
+    assert _rows(specialties.match_any(['Cardiology', 'Dermatology'])) == [1, 2, 4]
+    assert _rows(specialties.match_all([])) == [0, 1, 2, 3, 4]
+    # An unknown term matches nothing on its own or in an AND, and is
+    # ignored in an OR
+    assert _rows(specialties.mask('Unknown')) == []
+    assert _rows(specialties.match_all(['Oncology', 'Unknown'])) == []
+    assert _rows(specialties.match_any(['Oncology', 'Unknown'])) == [0, 4]
+    assert _rows(specialties.match_any(['Unknown'])) == []
@@ -0,0 +1,322 @@
+import re
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Searchable columns and the weight of a match in each
+TEXT_FIELDS = {
+    'Pharmacy Name': 3.0,
+    'License Number': 3.0,
+    'City': 2.0,
+    'County': 1.0,
+}
+
+# A whole-token match counts double a prefix match; a match within the
+# allowed edit distance counts half
+EXACT_BONUS = 2.0
+FUZZY_FACTOR = 0.5
+
+# Words matching more than 1/DENSE_FRACTION of the rows are scored into a
+# per-row array rather than sorted
+DENSE_FRACTION = 64
+
+_SPLIT = re.compile(r'[^0-9a-z]+')
+
+
+def tokenize(text):
+    return [token for token in _SPLIT.split(text.lower()) if token]
+
+
+def max_edits(token):
+    # Typos tolerated in a query token of this length
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) < 8 else 2
+
+
+class TextIndex:
+    """
+    Token index over the name, license number, city and county of every row.
+
+    The vocabulary is sorted, and the (row, field) postings are stored
+    grouped by token in vocabulary order, so all the tokens starting with a
+    prefix are one binary search and their postings one contiguous slice.
+    A search starts from its most selective word and checks the remaining
+    words only against the rows found so far, through a second copy of the
+    postings grouped by row. Misspelled words are matched through a
+    trigram index over the vocabulary, checking the edit distance of the few
+    candidates only.
+    """
+
+    def __init__(self, vocabulary, token_ids, rows, weights, n_rows, name_rank):
+        vocabulary = np.asarray(vocabulary, dtype=object)
+        # Tokens are ASCII, so the vocabulary is kept as fixed-width bytes:
+        # one flat array instead of an object per word
+        self.vocabulary = vocabulary.astype(bytes) if len(vocabulary) else np.array([], dtype='S1')
+        self.n_rows = n_rows
+
+        order = np.argsort(token_ids, kind='stable')
+        self._token_ids = token_ids[order]
+        self._rows = rows[order]
+        self._weights = weights[order]
+        self._offsets = np.searchsorted(self._token_ids, np.arange(len(self.vocabulary) + 1))
+
+        order = np.argsort(rows, kind='stable')
+        self._row_token_ids = token_ids[order]
+        self._row_weights = weights[order]
+        self._row_offsets = np.searchsorted(rows[order], np.arange(n_rows + 1))
+        self.mean_tokens = len(rows) / max(n_rows, 1)
+
+        # Alphabetical position of each row's name, to break score ties
+        self._name_rank = name_rank
+        self._trigrams, self._trigram_ids = _trigram_index(vocabulary)
+
+    @classmethod
+    def from_frame(cls, pharmacies):
+        tokens, rows, weights = _postings(pharmacies)
+        vocabulary = _sorted_unique(tokens)
+        return cls(
+            vocabulary.to_numpy(zero_copy_only=False),
+            _positions(tokens, vocabulary),
+            rows,
+            weights,
+            len(pharmacies),
+            _name_rank(pharmacies),
+        )
+
+    def updated(self, source, changed, pharmacies):
+        """
+        Index of a refreshed snapshot whose searchable columns differ from
+        this one only in the `changed` rows; other rows keep the postings of
+        row `source[row]` of this index, so only changed rows are tokenized.
+        """
+        n_rows = len(pharmacies)
+        kept = np.ones(n_rows, dtype=bool)
+        kept[changed] = False
+        kept = np.flatnonzero(kept)
+        target = np.full(self.n_rows, -1, dtype=np.int64)
+        target[source[kept]] = kept
+
+        rows = target[self._rows]
+        keep = rows >= 0
+        old_tokens = pa.array(self.vocabulary[np.unique(self._token_ids[keep])], type=pa.binary()).cast(pa.string())
+        fresh_tokens, fresh_rows, fresh_weights = _postings(pharmacies.iloc[changed])
+        vocabulary = _sorted_unique(pa.concat_arrays([old_tokens, fresh_tokens]))
+        remap = _positions(pa.array(self.vocabulary, type=pa.binary()).cast(pa.string()), vocabulary)
+        return TextIndex(
+            vocabulary.to_numpy(zero_copy_only=False),
+            np.concatenate([remap[self._token_ids[keep]], _positions(fresh_tokens, vocabulary)]),
+            np.concatenate([rows[keep], changed[fresh_rows]]),
+            np.concatenate([self._weights[keep], fresh_weights]),
+            n_rows,
+            _name_rank(pharmacies),
+        )
+
+    def _match(self, token):
+        # What `token` matches: its prefix range of the vocabulary, the id
+        # of the token itself (-1 if absent), misspelled ids, and the number
+        # of postings of all of them
+        encoded = token.encode('ascii')
+        lo = np.searchsorted(self.vocabulary, encoded, 'left')
+        hi = np.searchsorted(self.vocabulary, encoded + b'\xff', 'left')
+        exact = lo if lo < hi and self.vocabulary[lo] == encoded else -1
+        fuzzy = np.array([
+            candidate for candidate in self._fuzzy_tokens(token) if not lo <= candidate < hi
+        ], dtype=np.int64)
+        postings = self._offsets[hi] - self._offsets[lo] + int(
+            (self._offsets[fuzzy + 1] - self._offsets[fuzzy]).sum()
+        )
+        return lo, hi, exact, fuzzy, postings
+
+    def _fuzzy_tokens(self, token):
+        # Vocabulary ids within the allowed edit distance of `token`, or of
+        # the start of a longer token (for a misspelled partial word)
+        edits = max_edits(token)
+        if not edits:
+            return []
+        grams = [gram for gram in _trigrams(token) if gram in self._trigrams]
+        if not grams:
+            return []
+        candidates, shared = np.unique(
+            np.concatenate([self._trigram_ids[slice(*self._trigrams[gram])] for gram in grams]), return_counts=True
+        )
+        # Each edit breaks at most three of the token's trigrams, and a
+        # partial word misses its closing one
+        candidates = candidates[shared >= len(_trigrams(token)) - 3 * edits - 1]
+        return [
+            candidate for candidate in candidates
+            if _within_edits(token, self.vocabulary[candidate].decode('ascii'), edits)
+        ]
+
+    def _scale(self, token_ids, weights, match):
+        # Weights of postings of the given tokens as matches of `match`
+        lo, hi, exact, fuzzy, _ = match
+        in_prefix = (token_ids >= lo) & (token_ids < hi)
+        factor = np.where(
+            in_prefix,
+            np.where(token_ids == exact, EXACT_BONUS, 1.0),
+            np.where(np.isin(token_ids, fuzzy), FUZZY_FACTOR, 0.0)
+        )
+        return weights * factor
+
+    def _dense_scores(self, match):
+        # Best score of `match` in every row, from its postings
+        rows, weights = self._postings_of(match)
+        scores = np.zeros(self.n_rows)
+        np.maximum.at(scores, rows, weights)
+        return scores
+
+    def _postings_of(self, match):
+        lo, hi, _, fuzzy, _ = match
+        slices = [slice(self._offsets[lo], self._offsets[hi])]
+        slices += [slice(self._offsets[token_id], self._offsets[token_id + 1]) for token_id in fuzzy]
+        rows = np.concatenate([self._rows[part] for part in slices])
+        weights = self._scale(np.concatenate([self._token_ids[part] for part in slices]),
+                              np.concatenate([self._weights[part] for part in slices]), match)
+        return rows, weights
+
+    def _matching_rows(self, match):
+        # Rows matching `match` and their best score
+        if match[-1] > self.n_rows // DENSE_FRACTION:
+            scores = self._dense_scores(match)
+            rows = np.flatnonzero(scores)
+            return rows, scores[rows]
+        rows, weights = self._postings_of(match)
+        order = np.lexsort((-weights, rows))
+        rows, weights = rows[order], weights[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        return rows[first], weights[first]
+
+    def _scores_at(self, rows, match):
+        # Best score of `match` in each of `rows` (0 where it does not match)
+        starts = self._row_offsets[rows]
+        counts = self._row_offsets[rows + 1] - starts
+        owners = np.repeat(np.arange(len(rows)), counts)
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        weights = self._scale(self._row_token_ids[positions], self._row_weights[positions], match)
+        scores = np.zeros(len(rows))
+        np.maximum.at(scores, owners, weights)
+        return scores
+
+    def search(self, text, mask=None, limit=None):
+        """
+        Rows matching every word of `text` (as a whole word, a prefix or
+        with a typo), best matches first, optionally restricted to a boolean
+        `mask` over all rows and cut to the top `limit`.
+        """
+        tokens = tokenize(text)
+        if not tokens:
+            rows = np.arange(self.n_rows) if mask is None else np.flatnonzero(mask)
+            return rows[:limit]
+        matches = sorted((self._match(token) for token in dict.fromkeys(tokens)), key=lambda match: match[-1])
+
+        rows, total = self._matching_rows(matches[0])
+        if mask is not None:
+            keep = mask[rows]
+            rows, total = rows[keep], total[keep]
+        for match in matches[1:]:
+            if not len(rows):
+                break
+            # Look the word up in the rows found so far, or score it over
+            # its own postings when it has fewer of those
+            if match[-1] < len(rows) * self.mean_tokens:
+                scores = self._dense_scores(match)[rows]
+            else:
+                scores = self._scores_at(rows, match)
+            keep = scores > 0
+            rows, total = rows[keep], total[keep] + scores[keep]
+
+        # Highest score first, then by name; scores are multiples of 1/2
+        key = -np.round(total * 2).astype(np.int64) * self.n_rows + self._name_rank[rows]
+        if limit is not None and len(rows) > limit:
+            top = np.argpartition(key, limit - 1)[:limit]
+            rows, key = rows[top], key[top]
+        return rows[np.argsort(key, kind='stable')]
+
+
+def _postings(pharmacies):
+    # (token, row, weight) of every distinct token per row, keeping the
+    # best-weighted field of a token found in several fields of a row
+    tokens, rows, weights = [], [], []
+    for column, weight in TEXT_FIELDS.items():
+        values = pc.utf8_lower(pa.array(pharmacies[column].to_numpy(dtype=object), type=pa.string(), from_pandas=True))
+        parts = [pc.split_pattern_regex(values, _SPLIT.pattern)]
+        if column == 'License Number':
+            # Also the number as typed without its space, e.g. "lsc101414"
+            parts.append(pc.split_pattern_regex(pc.replace_substring_regex(values, _SPLIT.pattern, ''), '^$'))
+        for split in parts:
+            flat = pc.list_flatten(split)
+            parents = pc.list_parent_indices(split).to_numpy()
+            nonempty = pc.not_equal(flat, '').to_numpy(zero_copy_only=False)
+            tokens.append(flat.filter(pa.array(nonempty)))
+            rows.append(parents[nonempty])
+            weights.append(np.full(nonempty.sum(), weight))
+    tokens = pa.concat_arrays(tokens)
+    rows = np.concatenate(rows).astype(np.int64)
+    weights = np.concatenate(weights)
+
+    # Keep the first (best-weighted) posting of each (token, row)
+    ids = pc.dictionary_encode(tokens).indices.to_numpy().astype(np.int64)
+    order = np.lexsort((-weights, rows, ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (ids[order][1:] != ids[order][:-1]) | (rows[order][1:] != rows[order][:-1])
+    keep = np.sort(order[first])
+    return tokens.take(pa.array(keep)), rows[keep], weights[keep]
+
+
+def _sorted_unique(tokens):
+    unique = pc.unique(tokens)
+    return unique.take(pc.sort_indices(unique))
+
+
+def _positions(tokens, vocabulary):
+    # Position of each token in the vocabulary (-1 if absent)
+    return pc.fill_null(pc.index_in(tokens, value_set=vocabulary), -1).to_numpy().astype(np.int64)
+
+
+def _name_rank(pharmacies):
+    names = pa.array(pharmacies['Pharmacy Name'].to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[pc.sort_indices(names).to_numpy()] = np.arange(len(names))
+    return rank
+
+
+def _trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _trigram_index(vocabulary):
+    # Trigram -> (start, stop) of the ids of the vocabulary words containing
+    # it, and those ids for every trigram in one array (a few large arrays
+    # rather than one per trigram); tokens with digits (license and street
+    # numbers) are only matched as typed
+    index = {}
+    for token_id, token in enumerate(vocabulary):
+        if not token.isalpha():
+            continue
+        for gram in _trigrams(token):
+            index.setdefault(gram, []).append(token_id)
+    stops = np.cumsum([len(ids) for ids in index.values()], dtype=np.int64)
+    spans = {gram: (int(stop) - len(ids), int(stop)) for (gram, ids), stop in zip(index.items(), stops)}
+    ids = np.fromiter((token_id for ids in index.values() for token_id in ids), dtype=np.int64, count=int(stops[-1]) if len(stops) else 0)
+    return spans, ids
+
+
+def _within_edits(token, candidate, edits):
+    # Edit distance (with transpositions) of `token` to `candidate` or to
+    # any prefix of it, bounded by `edits`
+    before, previous = None, list(range(len(candidate) + 1))
+    for i, char in enumerate(token, 1):
+        current = [i]
+        for j, other in enumerate(candidate, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char == candidate[j - 2] and token[i - 2] == other:
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        if min(current) > edits:
+            return False
+        before, previous = previous, current
+    return min(previous) <= edits